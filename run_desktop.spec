@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('twitch-analytics-app/src', 'src'), ('twitch-analytics-app/src/templates', 'src/templates')],
-    hiddenimports=[],
+    hiddenimports=['waitress'],  # Imported lazily by src/serving.py
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,230 @@
+"""Vectorized analysis versus the original dict-loop aggregation.
+
+For each size (default 10k, 1M and 10M rows):
+
+* compute: the original analyze_daily/monthly_performance loops over dicts
+  against services.analysis.rollups() on the same rows held as columns. The
+  loops read from a shared pool of at most 1M dicts so 10M rows fit in memory.
+* end to end (sizes up to --db-max, default 1M): services.analysis.load_stats()
+  and rollups() reading the rows from a generated SQLite database, against
+  loading the same rows as dicts through the ORM and running the loops.
+
+Daily and monthly totals are cross-checked between both implementations. The
+generated hours are labelled "14:00", "14:00:00" and "2 PM", and one in ten has
+no start time, so the hour-of-day table is checked against the clock hours.
+
+    python benchmarks/bench_analysis.py [--sizes 10000,1000000,10000000] [--db-max 1000000]
+"""
+import argparse
+from datetime import date, timedelta
+from itertools import cycle, islice
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+WORKDIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORKDIR, 'analysis.db')
+
+from app import app  # noqa: E402
+from extensions import db  # noqa: E402
+from models import Stream, HourlyStat  # noqa: E402
+from services import analysis  # noqa: E402
+
+HOURS_PER_STREAM = 8
+DICT_POOL = 1_000_000
+FIRST_DAY = date(2020, 1, 1)
+
+
+# The implementations services/analysis.py replaced, kept verbatim as the baseline
+def legacy_daily_performance(viewer_data):
+    daily_analysis = {}
+    for entry in viewer_data:
+        date = entry['date']
+        if date not in daily_analysis:
+            daily_analysis[date] = {
+                'total_viewers': 0,
+                'total_followers': 0,
+                'total_subscribers': 0,
+                'total_bit_donors': 0,
+                'total_gift_subbers': 0,
+                'total_donors': 0
+            }
+        daily_analysis[date]['total_viewers'] += entry['viewers']
+        daily_analysis[date]['total_followers'] += entry['followers']
+        daily_analysis[date]['total_subscribers'] += entry['subscribers']
+        daily_analysis[date]['total_bit_donors'] += entry['bit_donors']
+        daily_analysis[date]['total_gift_subbers'] += entry['gift_subbers']
+        daily_analysis[date]['total_donors'] += entry['donors']
+    return daily_analysis
+
+
+def legacy_monthly_performance(viewer_data):
+    monthly_analysis = {}
+    for entry in viewer_data:
+        month = entry['date'][:7]  # Extracting YYYY-MM
+        if month not in monthly_analysis:
+            monthly_analysis[month] = {
+                'total_viewers': 0,
+                'total_followers': 0,
+                'total_subscribers': 0,
+                'total_bit_donors': 0,
+                'total_gift_subbers': 0,
+                'total_donors': 0
+            }
+        monthly_analysis[month]['total_viewers'] += entry['viewers']
+        monthly_analysis[month]['total_followers'] += entry['followers']
+        monthly_analysis[month]['total_subscribers'] += entry['subscribers']
+        monthly_analysis[month]['total_bit_donors'] += entry['bit_donors']
+        monthly_analysis[month]['total_gift_subbers'] += entry['gift_subbers']
+        monthly_analysis[month]['total_donors'] += entry['donors']
+    return monthly_analysis
+
+
+def make_columns(rows, seed=7):
+    """Synthetic stats: 8 hours per stream, 3 streams a day."""
+    rng = np.random.default_rng(seed)
+    index = np.arange(rows)
+    day_offsets = index // (HOURS_PER_STREAM * 3)
+    return {
+        'day': np.datetime64(FIRST_DAY.isoformat()) + day_offsets.astype('timedelta64[D]'),
+        'hour_of_day': (12 + index % HOURS_PER_STREAM).astype(np.int8),
+        'viewers': rng.integers(0, 5000, rows),
+        'followers': rng.integers(0, 50, rows),
+        'subs': rng.integers(0, 4, rows),
+        'donations': rng.integers(0, 2, rows),
+        'sub_donations': rng.integers(0, 2, rows),
+        'bit_donations': rng.integers(0, 3, rows),
+    }
+
+
+def legacy_entries(columns, rows):
+    pool_size = min(rows, DICT_POOL)
+    days = np.datetime_as_string(columns['day'][:pool_size], unit='D')
+    pool = [
+        {
+            'date': str(day), 'viewers': int(v), 'followers': int(f), 'subscribers': int(s),
+            'bit_donors': int(b), 'gift_subbers': int(g), 'donors': int(d),
+        }
+        for day, v, f, s, b, g, d in zip(
+            days, columns['viewers'][:pool_size], columns['followers'][:pool_size], columns['subs'][:pool_size],
+            columns['bit_donations'][:pool_size], columns['sub_donations'][:pool_size], columns['donations'][:pool_size],
+        )
+    ]
+    return lambda: islice(cycle(pool), rows)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def check(rollups, legacy_daily, legacy_monthly):
+    daily = rollups.daily
+    for day, totals in legacy_daily.items():
+        row = daily.loc[pd.Timestamp(day)]
+        assert (row['total_viewers'], row['total_followers'], row['subs']) == (
+            totals['total_viewers'], totals['total_followers'], totals['total_subscribers']), day
+    monthly = rollups.monthly
+    for month, totals in legacy_monthly.items():
+        assert monthly.loc[pd.Period(month, 'M'), 'total_viewers'] == totals['total_viewers'], month
+
+
+def bench_compute(rows):
+    columns = make_columns(rows)
+    # Past DICT_POOL rows the dicts repeat, so give the frame the same repetition
+    frame = pd.DataFrame({name: np.resize(values[:DICT_POOL], rows) for name, values in columns.items()})
+    entries = legacy_entries(columns, rows)
+    legacy_seconds, legacy_daily = timed(legacy_daily_performance, entries())
+    monthly_seconds, legacy_monthly = timed(legacy_monthly_performance, entries())
+    vector_seconds, rollups = timed(analysis.rollups, frame)
+    check(rollups, legacy_daily, legacy_monthly)
+    legacy_total = legacy_seconds + monthly_seconds
+    print(f'compute {rows:>10,} rows: loops (daily+monthly) {legacy_total:8.3f}s   '
+          f'rollups (daily+weekly+monthly+hourly) {vector_seconds:7.3f}s   {legacy_total / vector_seconds:6.1f}x')
+
+
+def build_database(rows):
+    path = os.path.join(WORKDIR, 'analysis.db')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    columns = make_columns(rows)
+    streams = -(-rows // HOURS_PER_STREAM)
+    labels = (lambda h: f'{h}:00', lambda h: f'{h}:00:00', lambda h: f'{h % 12 or 12} {"AM" if h < 12 else "PM"}')
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        'INSERT INTO stream (id, date, title, streamer) VALUES (?, ?, ?, ?)',
+        ((i + 1, (FIRST_DAY + timedelta(days=i // 3)).isoformat(), f'Stream {i + 1}', 'Da1lyVitamin') for i in range(streams)),
+    )
+    names = ('alice', 'bob', 'carol')
+    conn.executemany(
+        'INSERT INTO hourly_stat (stream_id, hour, viewers, followers, subs, donations, sub_donations, bit_donations, started_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (
+            (i // HOURS_PER_STREAM + 1, labels[i % 3](int(hour)), int(v), int(f), ','.join(names[:s]), ','.join(names[:d]),
+             ','.join(names[:g]), ';'.join(f'{n}:100' for n in names[:b]),
+             None if i % 10 == 0 else f'{day} {hour:02d}:00:00.000000')
+            for i, day, hour, v, f, s, d, g, b in zip(
+                range(rows), np.datetime_as_string(columns['day'], unit='D'), columns['hour_of_day'],
+                columns['viewers'], columns['followers'], columns['subs'],
+                columns['donations'], columns['sub_donations'], columns['bit_donations'],
+            )
+        ),
+    )
+    conn.commit()
+    conn.close()
+    return columns
+
+
+def legacy_from_orm():
+    # What a caller of the dict-loop functions had to do: load rows, build dicts
+    stats = db.session.query(HourlyStat, Stream.date).join(Stream, Stream.id == HourlyStat.stream_id).all()
+    entries = [
+        {
+            'date': stream_date.isoformat(), 'viewers': stat.viewers, 'followers': stat.followers,
+            'subscribers': len(stat.subs.split(',')) if stat.subs else 0,
+            'bit_donors': len(stat.bit_donations.split(';')) if stat.bit_donations else 0,
+            'gift_subbers': len(stat.sub_donations.split(',')) if stat.sub_donations else 0,
+            'donors': len(stat.donations.split(',')) if stat.donations else 0,
+        }
+        for stat, stream_date in stats
+    ]
+    return legacy_daily_performance(entries), legacy_monthly_performance(entries)
+
+
+def bench_end_to_end(rows):
+    columns = build_database(rows)
+    with app.app_context():
+        legacy_seconds, (legacy_daily, legacy_monthly) = timed(legacy_from_orm)
+        db.session.expunge_all()
+        vector_seconds, rollups = timed(lambda: analysis.rollups(analysis.load_stats()))
+    check(rollups, legacy_daily, legacy_monthly)
+    hours = np.bincount(columns['hour_of_day'], minlength=24)
+    assert rollups.hourly['hours'].to_dict() == {hour: count for hour, count in enumerate(hours) if count}
+    print(f'db      {rows:>10,} rows: ORM + loops           {legacy_seconds:8.3f}s   '
+          f'load_stats() + rollups()              {vector_seconds:7.3f}s   {legacy_seconds / vector_seconds:6.1f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,1000000,10000000')
+    parser.add_argument('--db-max', type=int, default=1_000_000)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    for rows in sizes:
+        bench_compute(rows)
+    for rows in sizes:
+        if rows <= args.db_max:
+            bench_end_to_end(rows)
+
+
+if __name__ == '__main__':
+    main()
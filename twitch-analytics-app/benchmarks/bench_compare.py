@@ -0,0 +1,149 @@
+"""Cross-stream comparison time and correctness for a few hundred streams.
+
+1. Fills a database with benchmarks/synthetic.py and compares the latest
+   --compare streams with services.comparison.compare().
+2. Checks the matrices, the weekday x hour of day averages and the median
+   retention curve against the same numbers computed with plain Python loops
+   over the hours.
+3. Moves the streams older than --days into the archive and checks that the
+   comparison is unchanged.
+4. Times loading the hours, building the matrices, the JSON payload and the
+   chart, and fails if load + compare takes longer than --budget seconds.
+
+    python benchmarks/bench_compare.py [--streams 2000] [--compare 500] [--days 90] [--budget 1.0]
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, timedelta
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+
+
+def close(a, b):
+    if a is None or b is None or (isinstance(a, float) and math.isnan(a)) or (isinstance(b, float) and math.isnan(b)):
+        return (a is None or a != a) and (b is None or b != b)
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+
+
+def looped(selected):
+    # The comparison computed hour by hour, without NumPy
+    from sqlalchemy import select
+    from extensions import db
+    from models import HourlyStat
+    from services.comparison import MAX_HOURS
+
+    ids = {stream.id for stream in selected}
+    hours = [row for row in db.session.execute(
+        select(HourlyStat.stream_id, HourlyStat.started_at, HourlyStat.viewers)
+        .where(HourlyStat.stream_id.in_(ids), HourlyStat.started_at.is_not(None))
+    )]
+    first = {}
+    for stream_id, started_at, _ in hours:
+        first[stream_id] = min(first.get(stream_id, started_at), started_at)
+    cells, slots = defaultdict(list), defaultdict(list)
+    for stream_id, started_at, viewers in hours:
+        since = int((started_at - first[stream_id]).total_seconds() // 3600)
+        if since < MAX_HOURS:
+            cells[stream_id, since].append(viewers or 0)
+        slots[started_at.weekday(), started_at.hour].append(viewers or 0)
+    cells = {key: sum(values) / len(values) for key, values in cells.items()}
+    slots = {key: sum(values) / len(values) for key, values in slots.items()}
+    retention = {}
+    for since in range(max((key[1] for key in cells), default=-1) + 1):
+        relative = [
+            cells[stream_id, since] / cells[stream_id, 0] for stream_id in ids
+            if (stream_id, since) in cells and cells.get((stream_id, 0), 0) > 0
+        ]
+        retention[since] = statistics.median(relative) if relative else None
+    return cells, slots, retention
+
+
+def check(comparison, expected):
+    from services.comparison import retention
+    cells, slots, median = expected
+    failures = 0
+    for row, stream in enumerate(comparison.streams):
+        for since in range(comparison.viewers.shape[1]):
+            if not close(comparison.viewers[row, since].item(), cells.get((stream.id, since))):
+                failures += 1
+    for weekday in range(7):
+        for hour in range(24):
+            if not close(comparison.slot_viewers[weekday, hour].item(), slots.get((weekday, hour))):
+                failures += 1
+    _, relative = retention(comparison)
+    for since, value in median.items():
+        if not close(relative[50][since].item(), value):
+            failures += 1
+    return failures
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=2000)
+    parser.add_argument('--compare', type=int, default=500, help='Latest streams compared')
+    parser.add_argument('--days', type=int, default=90, help='Archive streams older than this')
+    parser.add_argument('--budget', type=float, default=1.0, help='Seconds allowed for load + compare')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    synthetic.populate(os.path.join(workdir, 'compare.db'), streams=args.streams)
+
+    from sqlalchemy import select
+    from app import app
+    from extensions import db
+    from models import Stream
+    from services import charts, comparison
+    from services.archive import archive
+
+    archive.directory = os.path.join(workdir, 'archive')
+    with app.app_context():
+        latest = db.session.scalars(select(Stream.id).order_by(Stream.date.desc(), Stream.id.desc()).limit(args.compare)).all()
+        selected = comparison.streams(Stream.id.in_(latest))
+        live = comparison.compare(selected)
+        hours = int(live.slot_hours.sum())
+        failures = check(live, looped(selected))
+        print(f'{len(selected)} streams, {hours} hours: {failures} values differ from the plain Python loops')
+
+        streams, moved = archive.compact(date.today() - timedelta(days=args.days))
+        compacted = comparison.compare(selected)
+        payload_before = json.dumps(comparison.payload(live), sort_keys=True)
+        if json.dumps(comparison.payload(compacted), sort_keys=True) != payload_before:
+            failures += 1
+            print('MISMATCH comparison after compaction')
+        print(f'{moved} hours of {streams} streams archived; the comparison is unchanged: {not failures}')
+
+        loaded, load_time = timed(lambda: comparison.load(selected), args.repeat)
+        result, compare_time = timed(lambda: comparison.compare(selected), args.repeat)
+        _, payload_time = timed(lambda: json.dumps(comparison.payload(result)), args.repeat)
+        charts.comparison_chart(result)  # Loads matplotlib and its fonts
+        _, chart_time = timed(lambda: charts.comparison_chart(result), args.repeat)
+        print(f'load {load_time * 1000:.1f} ms ({len(loaded[0])} hours), load + compare {compare_time * 1000:.1f} ms, '
+              f'JSON payload {payload_time * 1000:.1f} ms, chart {chart_time * 1000:.0f} ms')
+        if compare_time > args.budget:
+            failures += 1
+            print(f'FAIL: comparing {len(selected)} streams took {compare_time:.2f} s, over {args.budget} s')
+    if failures:
+        raise SystemExit(f'{failures} checks failed')
+
+
+if __name__ == '__main__':
+    main()
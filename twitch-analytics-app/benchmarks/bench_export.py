@@ -0,0 +1,129 @@
+"""Bulk PDF export speed with the number of worker processes.
+
+1. Fills a database with benchmarks/synthetic.py and moves the streams older
+   than --days into the archive, so reports read live and archived hours.
+2. Exports every stream's report into a ZIP in this process (--workers 0, the
+   way one download at a time renders them) and checks that the archive is
+   valid, has one entry per stream, and that sample entries match what
+   /stream/<id>/pdf_download serves.
+3. Exports again on process pools of each --workers size. The pool is started
+   and warmed up first and timed separately. Checks that every entry matches
+   the serial export, and prints the time, speedup and parallel efficiency per
+   worker count and the largest chunk the ZIP was written in.
+4. Times the part that stays in this process (loading the streams' rows) and
+   prints the speedup it allows by Amdahl's law, which is what more cores than
+   this machine has could reach.
+
+    python benchmarks/bench_export.py [--streams 300] [--days 60] [--workers 1 2 4]
+"""
+import argparse
+from datetime import date, timedelta
+import io
+import os
+import re
+import sys
+import tempfile
+import time
+import zipfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+
+CREATION_DATE = re.compile(rb'/CreationDate \(D:\d+\)')
+
+
+def export(exporter, period):
+    chunks = []
+    start = time.perf_counter()
+    for chunk in exporter.zip_chunks(period):
+        chunks.append(chunk)
+    elapsed = time.perf_counter() - start
+    return b''.join(chunks), elapsed, max(len(chunk) for chunk in chunks)
+
+
+def entries(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as bundle:
+        if bundle.testzip() is not None:
+            raise SystemExit('FAIL: corrupt ZIP entry')
+        return {name: CREATION_DATE.sub(b'', bundle.read(name)) for name in bundle.namelist()}
+
+
+def default_workers():
+    cpus = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cpus:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cpus:
+        counts.append(cpus)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=300)
+    parser.add_argument('--days', type=int, default=60, help='Archive streams older than this')
+    parser.add_argument('--workers', type=int, nargs='+', default=default_workers(), help='Pool sizes to time')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    synthetic.populate(os.path.join(workdir, 'export.db'), streams=args.streams)
+
+    from app import app
+    from routes.analytics import build_stream_report
+    from services import periods
+    from services.archive import archive
+    from services.bulk_export import BulkExporter, tasks
+
+    app.config['CHART_CACHE_DIR'] = os.path.join(workdir, 'chart_cache')
+    archive.directory = os.path.join(workdir, 'archive')
+    period = periods.Period('all', date(1970, 1, 1), None)
+    with app.app_context():
+        streams, hours = archive.compact(date.today() - timedelta(days=args.days))
+        print(f'{args.streams} streams, {streams} of them ({hours} hours) archived; {os.cpu_count()} CPUs')
+
+        serial, serial_time, largest = export(BulkExporter(0), period)
+        expected = entries(serial)
+        if len(expected) != args.streams:
+            raise SystemExit(f'FAIL: {len(expected)} entries for {args.streams} streams')
+        names = sorted(expected)
+        for name in (names[0], names[len(names) // 2], names[-1]):
+            stream_id = int(name.split('_')[2])
+            if CREATION_DATE.sub(b'', build_stream_report(stream_id)) != expected[name]:
+                raise SystemExit(f'FAIL: {name} differs from the single stream download')
+        print(f'serial: {serial_time:.2f} s, {args.streams / serial_time:.1f} reports/s, '
+              f'{len(serial) / 2 ** 20:.1f} MiB ZIP, largest chunk {largest / 1024:.0f} KiB')
+
+        failures = 0
+        for workers in args.workers:
+            exporter = BulkExporter(workers)
+            start = time.perf_counter()
+            first_day = periods.resolve('custom', names[0][:10], names[0][:10])
+            export(exporter, first_day)  # Spawns the workers and imports the renderers
+            startup = time.perf_counter() - start
+            data, elapsed, largest = export(exporter, period)
+            exporter.shutdown()
+            differ = [name for name, pdf in entries(data).items() if expected.get(name) != pdf]
+            if differ or len(entries(data)) != len(expected):
+                failures += 1
+                print(f'MISMATCH {workers} workers: {len(differ)} entries differ from the serial export')
+            speedup = serial_time / elapsed
+            # 0 workers renders in this process, where efficiency per worker has no meaning
+            efficiency = f'efficiency {speedup / workers:.0%}, ' if workers else ''
+            print(f'{workers:>3} workers: {elapsed:.2f} s (+{startup:.2f} s pool start), speedup {speedup:.2f}x, '
+                  f'{efficiency}largest chunk {largest / 1024:.0f} KiB')
+
+        start = time.perf_counter()
+        for _ in tasks(period):
+            pass
+        serial_share = (time.perf_counter() - start) / serial_time
+        print(f'loading rows is {serial_share:.1%} of the serial export; with n workers the speedup is at most '
+              + ', '.join(f'{1 / (serial_share + (1 - serial_share) / n):.1f}x at {n}' for n in (2, 4, 8, 16)))
+    if failures:
+        raise SystemExit(f'{failures} exports differ')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""Per-route latency for every analytics_bp route, with JSON results for comparing commits.
+
+Fills a fresh database with benchmarks/synthetic.py, then times each route
+through the Flask test client (no network): one cold request after the chart
+and response caches are cleared, then --repeat warm requests. Streamed bodies are read to
+the end. generate_report_pdf is also timed on its own, with the rows, summary
+and chart already loaded: once for a stream report and once for the month's
+rows laid out as a daily report, to show how it scales with the table.
+
+Every analytics_bp endpoint must be covered by CASES, JOB_CASES or
+WRITE_ENDPOINTS or have a reason in SKIPPED, so a new route fails the run
+until it is benchmarked.
+
+    python benchmarks/bench_routes.py [--streams 2000] [--hours 8] [--events 6] [--repeat 5] [--output results.json]
+    python benchmarks/bench_routes.py --output new.json --compare old.json [--threshold 1.25]
+"""
+import argparse
+from datetime import date, datetime, timedelta, timezone
+import io
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+
+PERIODS = ('day', 'week', 'month', 'year', 'last_90_days')
+# Two whole months and the ends of two partial ones, ending before today
+CUSTOM_RANGE = f'start={date.today() - timedelta(days=80)}&end={date.today() - timedelta(days=5)}'
+
+# endpoint -> [(case name, method, url template, form data)]
+CASES = {
+    'analytics.home': [('home', 'GET', '/', None)],
+    'analytics.stream_list': [('stream_list', 'GET', '/streams', None)],
+    'analytics.new_stream': [('new_stream form', 'GET', '/stream/new', None)],
+    'analytics.stream': [('stream', 'GET', '/stream/{stream_id}', None)],
+    'analytics.reports': [('reports form', 'GET', '/reports', None)] + [
+        (f'reports {period}', 'POST', '/reports', {'period': period}) for period in PERIODS
+    ] + [('reports custom', 'POST', f'/reports?{CUSTOM_RANGE}', {'period': 'custom'})],
+    'analytics.stream_pdf_preview': [('stream_pdf_preview', 'GET', '/stream/{stream_id}/pdf_preview', None)],
+    'analytics.stream_series': [('stream_series', 'GET', '/stream/{stream_id}/series', None)],
+    'analytics.reports_series': [
+        (f'reports_series {period}', 'GET', f'/reports/series/{period}', None) for period in PERIODS
+    ] + [
+        ('reports_series year minmax', 'GET', '/reports/series/year?method=minmax', None),
+        ('reports_series year 2000 points', 'GET', '/reports/series/year?resolution=2000', None),
+        ('reports_series year by day', 'GET', '/reports/series/year?unit=day', None),
+        ('reports_series year auto', 'GET', '/reports/series/year?unit=auto', None),
+    ],
+    'analytics.stream_pdf_download': [('stream_pdf_download', 'GET', '/stream/{stream_id}/pdf_download', None)],
+    'analytics.reports_pdf': [(f'reports_pdf {period}', 'GET', f'/reports/pdf/{period}', None) for period in PERIODS] + [
+        ('reports_pdf custom', 'GET', f'/reports/pdf/custom?{CUSTOM_RANGE}', None),
+    ],
+    'analytics.reports_pdf_preview': [
+        (f'reports_pdf_preview {period}', 'GET', f'/reports/pdf_preview/{period}', None) for period in PERIODS
+    ],
+    'analytics.reports_export': [('reports_export month', 'GET', '/reports/export/month', None)],
+    'analytics.compare_data': [
+        ('compare_data last_30_days', 'GET', '/compare/data', None),
+        ('compare_data year', 'GET', '/compare/data?period=year', None),
+    ],
+    'analytics.compare_chart': [('compare_chart year', 'GET', '/compare/chart?period=year', None)],
+    'analytics.leaderboard': [
+        (f'leaderboard {period}', 'GET', f'/leaderboards?period={period}', None) for period in PERIODS + ('all',)
+    ] + [('leaderboard stream', 'GET', '/leaderboards?stream_id={stream_id}', None)],
+}
+# Submitted, polled and downloaded as one case; later runs get the finished job back
+JOB_CASES = {
+    'analytics.stream_pdf_job': [('stream_pdf_job', '/stream/{stream_id}/pdf_job')],
+    'analytics.reports_pdf_job': [('reports_pdf_job month', '/reports/pdf/month/job')],
+}
+SKIPPED = {
+    'analytics.job_status': 'timed as part of the job cases',
+    'analytics.job_download': 'timed as part of the job cases',
+    'analytics.clear_streams': 'deletes the dataset',
+}
+IMPORT_ROWS = 500
+# Writes invalidate caches, so they run after every read case
+WRITE_CASES = [
+    ('stream hour POST', 'POST', '/stream/{stream_id}', {
+        'hour': '23:00', 'viewers': '321', 'followers': '4',
+        'subs_usernames[]': ['viewer1', 'viewer2'], 'bit_donations_usernames[]': ['viewer3'], 'bit_donations_amounts[]': ['500'],
+    }),
+    ('new_stream POST', 'POST', '/stream/new', {'date': '2024-01-01', 'title': 'benchmark'}),
+    (f'import {IMPORT_ROWS} rows', 'POST', '/import', lambda: {'file': (io.BytesIO(import_payload()), 'stats.jsonl')}),
+]
+WRITE_ENDPOINTS = {'analytics.stream', 'analytics.new_stream', 'analytics.import_stats'}
+
+
+def import_payload():
+    return '\n'.join(json.dumps({
+        'date': '2024-01-02', 'title': 'benchmark import', 'hour': f'{hour % 24}:00', 'viewers': 100 + hour, 'followers': 1,
+        'subs': 'viewer1,viewer2', 'bit_donations': 'viewer3:100',
+    }) for hour in range(IMPORT_ROWS)).encode()
+
+
+def timed(call, repeat, reset):
+    """Time call() once after reset() and then repeat more times; call returns (status, bytes)."""
+    reset()
+    start = time.perf_counter()
+    status, size = call()
+    cold = time.perf_counter() - start
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        warm.append(time.perf_counter() - start)
+    return {
+        'status': status,
+        'bytes': size,
+        'cold_ms': cold * 1000,
+        'min_ms': min(warm) * 1000 if warm else None,
+        'median_ms': statistics.median(warm) * 1000 if warm else None,
+        'max_ms': max(warm) * 1000 if warm else None,
+    }
+
+
+def request_call(client, method, url, data):
+    def call():
+        response = client.open(url, method=method, data=data() if callable(data) else data)
+        body = response.get_data()  # Reads streamed bodies to the end
+        response.close()
+        return response.status_code, len(body)
+    return call
+
+
+def job_call(client, url):
+    def call():
+        payload = client.post(url).get_json()
+        while payload['status'] not in ('done', 'failed'):
+            time.sleep(0.005)
+            payload = client.get(payload['status_url']).get_json()
+        response = client.get(payload['download_url'])
+        return response.status_code, len(response.get_data())
+    return call
+
+
+def pdf_calls(app, stream_id):
+    """generate_report_pdf on preloaded inputs: one stream, and every row of the month."""
+    from models import HourlyStat
+    from routes.analytics import cached_chart
+    from services import aggregation, periods, rollups
+    from services.chart_cache import period_scope, stream_scope
+    from services.report_generation import generate_report_pdf
+
+    with app.app_context():
+        criteria = HourlyStat.stream_id == stream_id
+        stream_inputs = (
+            aggregation.stat_rows(criteria), rollups.stream_summary(stream_id), 'day',
+            cached_chart('trend', stream_scope(stream_id), criteria),
+        )
+        month = periods.resolve('month')
+        month_inputs = (
+            aggregation.stat_rows(*month.criteria), rollups.summary_since(month.start), 'day',
+            cached_chart('trend', period_scope('month', month.key), *month.criteria),
+        )
+
+    def build(inputs):
+        def call():
+            pdf = generate_report_pdf(*inputs).output(dest='S').encode('latin1')
+            return 200, len(pdf)
+        return call
+
+    return {
+        'generate_report_pdf stream': build(stream_inputs),
+        'generate_report_pdf month rows': build(month_inputs),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    workdir = tempfile.mkdtemp()
+    database = os.path.join(workdir, 'bench.db')
+    populate_start = time.perf_counter()
+    synthetic.populate(database, args.streams, args.hours, args.events, args.seed)
+    populate_seconds = time.perf_counter() - populate_start
+
+    import serving
+    from app import app
+    from services.chart_cache import chart_cache
+    from services.periods import report_data
+    from services.response_cache import response_cache
+
+    chart_cache.disk_dir = os.path.join(workdir, 'chart_cache')
+    os.makedirs(chart_cache.disk_dir, exist_ok=True)
+    serving.prewarm()  # Cold means an empty chart cache, not unimported matplotlib
+    client = app.test_client()
+    stream_id = args.streams  # The newest stream, inside every report period
+
+    endpoints = {rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint.startswith('analytics.')}
+    covered = set(CASES) | set(JOB_CASES) | set(SKIPPED) | WRITE_ENDPOINTS
+    missing = endpoints - covered
+    if missing:
+        raise SystemExit(f'No benchmark cases for: {", ".join(sorted(missing))}; add them to CASES or SKIPPED')
+
+    results = {}
+
+    def record(name, call):
+        result = results[name] = timed(call, args.repeat, lambda: (chart_cache.invalidate(), response_cache.clear(), report_data.clear()))
+        print(
+            f"{name:<44} {result['status']:>3}  cold {result['cold_ms']:8.1f} ms  "
+            f"median {result['median_ms'] or 0:8.1f} ms  {result['bytes']:>9} B", flush=True,
+        )
+        if result['status'] >= 400:
+            raise SystemExit(f'{name} returned {result["status"]}')
+
+    for endpoint in sorted(CASES):
+        for name, method, url, data in CASES[endpoint]:
+            record(name, request_call(client, method, url.format(stream_id=stream_id), data))
+    for endpoint in sorted(JOB_CASES):
+        for name, url in JOB_CASES[endpoint]:
+            record(name, job_call(client, url.format(stream_id=stream_id)))
+    for name, call in pdf_calls(app, stream_id).items():
+        record(name, call)
+    for name, method, url, data in WRITE_CASES:
+        record(name, request_call(client, method, url.format(stream_id=stream_id), data))
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'dataset': {'streams': args.streams, 'hours': args.hours, 'events': args.events, 'seed': args.seed},
+            'repeat': args.repeat,
+            'populate_seconds': populate_seconds,
+            'skipped': SKIPPED,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print median ratios against baseline; returns the names that got slower than threshold."""
+    print(f"\nagainst {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')})")
+    if baseline['meta'].get('dataset') != current['meta']['dataset']:
+        print('warning: the datasets differ, ratios are not comparable')
+    regressions = []
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            print(f'{name:<44} new')
+            continue
+        metric = 'median_ms' if result['median_ms'] is not None and old.get('median_ms') else 'cold_ms'
+        ratio = result[metric] / old[metric] if old[metric] else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f'{name:<44} {old[metric]:8.1f} -> {result[metric]:8.1f} ms  x{ratio:5.2f}{flag}')
+    for name in baseline['results'].keys() - current['results'].keys():
+        print(f'{name:<44} removed')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=2000)
+    parser.add_argument('--hours', type=int, default=8, help='Hours per stream')
+    parser.add_argument('--events', type=float, default=6.0, help='Mean support events per hour')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5, help='Warm requests per case after the cold one')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', help='Results JSON from an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    current = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(current, json.load(f), args.threshold)
+        if regressions:
+            raise SystemExit(f'{len(regressions)} cases slower than x{args.threshold}')
+
+
+if __name__ == '__main__':
+    main()
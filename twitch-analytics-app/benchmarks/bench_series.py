@@ -0,0 +1,99 @@
+"""Chart payloads: downsampled JSON series versus inline base64 PNGs.
+
+1. Fills a database with benchmarks/synthetic.py.
+2. For each report period, times the JSON series endpoint (LTTB and min/max)
+   and a server-rendered PNG chart of the same hours, inlined as base64 the
+   way the reports page used to, and prints both sizes.
+3. Checks the downsampling: no more points than requested, first and last
+   point kept, min/max keeps the global peak and low, and zooming in returns
+   only points inside the requested range.
+
+    python benchmarks/bench_series.py [--streams 2000] [--resolution 600]
+"""
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+
+PERIODS = ('day', 'week', 'month', 'year', 'last_365_days')
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=2000)
+    parser.add_argument('--resolution', type=int, default=600)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    synthetic.populate(os.path.join(workdir, 'series.db'), streams=args.streams)
+
+    import serving
+    from app import app
+    from routes.analytics import cached_chart
+    from services import periods, timeseries
+    from services.chart_cache import chart_cache, period_scope
+    from services.response_cache import response_cache
+
+    chart_cache.disk_dir = None
+    serving.prewarm()
+    client = app.test_client()
+    failures = 0
+    print(f'{"period":<14} {"rows":>7} {"lttb":>16} {"minmax":>16} {"png (base64)":>20}')
+    for name in PERIODS:
+        period = periods.resolve(name)
+        sizes = {}
+        for method in timeseries.METHODS:
+            response_cache.clear()
+            response, ms = timed(lambda: client.get(f'/reports/series/{name}?resolution={args.resolution}&method={method}'))
+            payload = response.get_json()
+            sizes[method] = (len(response.data), ms)
+            for series, values in payload['series'].items():
+                if len(values['x']) > args.resolution:
+                    failures += 1
+                    print(f'  {name} {method} {series}: {len(values["x"])} points > {args.resolution}')
+            with app.app_context():
+                xs, _, columns = timeseries.load(*period.criteria)
+            kept = payload['series']['viewers']['x']
+            if xs and (kept[0], kept[-1]) != (xs[0], xs[-1]):
+                failures += 1
+                print(f'  {name} {method}: first or last point dropped')
+            if xs and method == 'minmax':
+                kept = payload['series']['viewers']['y']
+                if max(kept) != max(columns['viewers']) or min(kept) != min(columns['viewers']):
+                    failures += 1
+                    print(f'  {name} minmax: lost the peak or the low')
+        with app.app_context():
+            chart_cache.invalidate()
+            png, png_ms = timed(lambda: cached_chart('trend', period_scope(name, period.key), *period.criteria))
+        print(f'{name:<14} {payload["points"]:>7} '
+              + ' '.join(f'{size / 1024:7.1f} KB {ms:5.0f} ms' for size, ms in sizes.values())
+              + f' {len(base64.b64encode(png)) / 1024:8.1f} KB {png_ms:6.0f} ms')
+
+    year = client.get(f'/reports/series/year?resolution={args.resolution}').get_json()
+    if year['range']:
+        low, high = year['range']
+        start, end = low + (high - low) // 3, low + 2 * (high - low) // 3
+        zoomed = client.get(f'/reports/series/year?resolution={args.resolution}&from={start}&to={end}').get_json()
+        inside = all(start <= x <= end for x in zoomed['series']['viewers']['x'])
+        print(f'zoomed year: {zoomed["points"]} of {year["points"]} rows, points inside the range: {inside}')
+        failures += not inside
+    if failures:
+        raise SystemExit(f'{failures} checks failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Concurrent report throughput: Flask's development server against waitress.
+
+Seeds a database with STREAMS streams, then for each serving mode starts
+`flask --app app serve` in a subprocess and has CLIENTS threads download
+stream PDF reports (chart included) while another thread keeps requesting the
+home page. Each mode gets its own streams, so no report or chart is served
+from a cache. Prints report throughput, report latency and the home page
+latency measured while the reports were being built.
+
+    python benchmarks/bench_serving.py [--reports 120] [--clients 8] [--threads 8]
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+import io
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+WORKDIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORKDIR, 'serving.db')
+
+from app import app, init_db  # noqa: E402
+from services import data_insertion  # noqa: E402
+
+MODES = ('dev', 'waitress')
+HOURS_PER_STREAM = 12
+
+
+def seed(streams):
+    init_db()
+    lines = []
+    first_day = date.today() - timedelta(days=streams)
+    for index in range(streams * HOURS_PER_STREAM):
+        stream, hour = divmod(index, HOURS_PER_STREAM)
+        lines.append(json.dumps({
+            'date': (first_day + timedelta(days=stream)).isoformat(), 'title': f'Stream {stream + 1}',
+            'hour': f'{hour + 10}:00', 'viewers': (index * 37) % 900 + 50, 'followers': index % 7,
+            'subs': 'alice,bob', 'bit_donations': 'carol:100',
+        }))
+    with app.app_context():
+        result = data_insertion.import_file(io.BytesIO('\n'.join(lines).encode()), fmt='jsonl')
+    assert result.imported == len(lines), result.to_dict()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, threads):
+    port = free_port()
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'flask', '--app', 'app', 'serve', '--server', mode, '--threads', str(threads), '--port', str(port)],
+        cwd=SRC_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(base + '/health', timeout=1).read()
+            return process, base
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+def fetch(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=120) as response:
+        body = response.read()
+    assert response.status == 200, url
+    return time.perf_counter() - start, body
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_mode(mode, stream_ids, clients, threads):
+    process, base = start_server(mode, threads)
+    try:
+        home_latencies = []
+        done = threading.Event()
+
+        def poll_home():
+            while not done.is_set():
+                home_latencies.append(fetch(base + '/')[0])
+
+        poller = threading.Thread(target=poll_home)
+        start = time.perf_counter()
+        poller.start()
+        with ThreadPoolExecutor(clients) as pool:
+            results = list(pool.map(lambda stream_id: fetch(f'{base}/stream/{stream_id}/pdf_download'), stream_ids))
+        elapsed = time.perf_counter() - start
+        done.set()
+        poller.join()
+    finally:
+        process.terminate()
+        process.wait()
+    latencies = [seconds for seconds, _ in results]
+    assert all(body.startswith(b'%PDF') for _, body in results)
+    print(
+        f'{mode:>8}: {len(results) / elapsed:6.2f} reports/s   '
+        f'report p50 {statistics.median(latencies) * 1000:7.0f} ms  p95 {percentile(latencies, 0.95) * 1000:7.0f} ms   '
+        f'home page under load p50 {statistics.median(home_latencies) * 1000:6.0f} ms  '
+        f'p95 {percentile(home_latencies, 0.95) * 1000:6.0f} ms'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reports', type=int, default=120, help='Reports downloaded per mode')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent report downloads')
+    parser.add_argument('--threads', type=int, default=8, help='waitress worker threads')
+    args = parser.parse_args()
+    seed(args.reports * len(MODES))
+    print(f'{args.reports} stream reports per mode, {args.clients} concurrent clients, {os.cpu_count()} CPUs')
+    for number, mode in enumerate(MODES):
+        first = number * args.reports + 1
+        run_mode(mode, range(first, first + args.reports), args.clients, args.threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Startup latency: from a fresh interpreter to the first page and the first chart.
+
+Each run is a new Python process that imports the app, serves the home page
+through the test client, then serves a stream's PDF preview with a freshly
+rendered chart. Runs are repeated and the medians printed for three setups:
+
+* eager:   services.charts and services.report_generation imported up front,
+           as the blueprint used to, so matplotlib, numpy and fpdf load before
+           the first page.
+* lazy:    the app as shipped; the first chart request pays for the imports.
+* prewarm: lazy, plus serving.prewarm() in the background after the first
+           page, waited for before the chart request (a user reading the home
+           page for a moment).
+
+    python benchmarks/bench_startup.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+MODES = ('eager', 'lazy', 'prewarm')
+
+
+def child(mode):
+    start = time.perf_counter()
+    sys.path.insert(0, SRC_DIR)
+    if mode == 'eager':
+        from services import charts, report_generation  # noqa: F401
+    from app import app
+    imported = time.perf_counter()
+    client = app.test_client()
+    assert client.get('/').status_code == 200
+    first_page = time.perf_counter()
+    prewarm_seconds = 0.0
+    if mode == 'prewarm':
+        import serving
+        serving.prewarm_in_background().join()
+        prewarm_seconds = time.perf_counter() - first_page
+    from services.chart_cache import chart_cache
+    chart_cache.invalidate()  # Render the chart, not the previous run's cached PNG
+    chart_start = time.perf_counter()
+    assert client.get('/stream/1/pdf_preview').status_code == 200
+    print(json.dumps({
+        'import': imported - start,
+        'first_page': first_page - start,
+        'prewarm': prewarm_seconds,
+        'first_chart': time.perf_counter() - chart_start,
+    }))
+
+
+def seed(env):
+    # One stream with a few hours, written through the app once before timing
+    script = (
+        'import sys; sys.path.insert(0, %r)\n'
+        'from app import app, init_db\n'
+        'init_db()\n'
+        'client = app.test_client()\n'
+        "client.post('/stream/new', data={'date': '2024-01-01', 'title': 'startup'})\n"
+        "for hour in range(6):\n"
+        "    client.post('/stream/1', data={'hour': f'{hour}:00', 'viewers': str(10 + hour * hour), 'followers': '1'})\n"
+    ) % SRC_DIR
+    subprocess.run([sys.executable, '-c', script], env=env, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child)
+
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(workdir, 'startup.db'))
+    seed(env)
+    print(f'median of {args.runs} fresh processes')
+    for mode in MODES:
+        runs = [
+            json.loads(subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', mode],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout)
+            for _ in range(args.runs)
+        ]
+        median = {key: statistics.median(run[key] for run in runs) * 1000 for key in runs[0]}
+        print(
+            f"{mode:>8}: import {median['import']:6.0f} ms   first page {median['first_page']:6.0f} ms   "
+            f"prewarm {median['prewarm']:6.0f} ms   first chart {median['first_chart']:6.0f} ms"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""Check that reports read the same data before and after retention compaction.
+
+1. Fills a database with benchmarks/synthetic.py and records, for every report
+   period plus custom ranges across the archive boundary: the report page, the
+   series JSON (hourly and per calendar unit), the table rows, stream summaries,
+   trend buckets, PDF table rows and analysis rollups, and the pages and series
+   of a few streams.
+2. Moves the streams older than --days into the archive, in small batches so
+   months are split across transactions and partitions are rewritten.
+3. Records everything again and compares. Then posts hours to an archived
+   stream, so one stream has live and archived hours, edits one of them, and
+   compares its summary with one computed from all its hours.
+4. Runs rollups.rebuild() and leaderboards.rebuild() and checks they reproduce
+   the rows kept from before compaction.
+5. Prints the database size before and after (vacuumed), the archive size, and
+   report load times against the live and the archived hours.
+
+    python benchmarks/check_archive.py [--streams 1500] [--days 90]
+"""
+import argparse
+from datetime import date, timedelta
+import math
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+
+SERIES_UNITS = (None, 'day', 'week', 'month', 'auto')
+
+
+def report_periods(periods, days):
+    today = date.today()
+    cutoff = today - timedelta(days=days)
+    selected = [periods.resolve(name) for name in periods.NAMES if name != periods.CUSTOM]
+    selected += [
+        periods.resolve('custom', cutoff - timedelta(days=40), cutoff + timedelta(days=20)),  # Across the cut-off
+        periods.resolve('custom', cutoff - timedelta(days=400), cutoff - timedelta(days=300)),  # Archived only
+        periods.resolve('custom', cutoff - timedelta(days=3), cutoff + timedelta(days=3)),
+    ]
+    selected.append(periods.Period('all', date(1970, 1, 1), None))
+    return selected
+
+
+def same(a, b):
+    if isinstance(a, float) and isinstance(b, float):
+        return math.isclose(a, b, rel_tol=1e-12)
+    if isinstance(a, (tuple, list)) and isinstance(b, (tuple, list)):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[key], b[key]) for key in a)
+    return a == b
+
+
+def snapshot(client, periods, selected, stream_ids):
+    from routes.analytics import stream_stats
+    from extensions import db
+    from models import Stream
+    from services import analysis
+
+    periods.report_data.clear()
+    seen = {}
+    for period in selected:
+        name = f'{period.name} {period.key}'
+        data = periods.report_data.get(period)
+        seen[name, 'count'] = data.count
+        seen[name, 'rows'] = [tuple(row) for row in data.rows]
+        seen[name, 'buckets'] = [tuple(bucket) for bucket in data.buckets]
+        seen[name, 'streams'] = {key: tuple(summary) for key, summary in data.stream_summaries.items()}
+        seen[name, 'stream rows'] = [tuple(row) for row in data.stream_rows()]
+        tables = analysis.rollups(analysis.load_stats(*period.criteria, archived=period.archived))
+        seen[name, 'analysis'] = {table: frame.to_dict('split') for table, frame in tables._asdict().items()}
+        args = {'start': period.start.isoformat(), 'end': period.last_day.isoformat()} if period.name == periods.CUSTOM else {}
+        if period.name in periods.NAMES:
+            seen[name, 'page'] = client.post('/reports', data=dict(args, period=period.name)).get_data(as_text=True)
+            for unit in SERIES_UNITS:
+                query = dict(args, unit=unit) if unit else args
+                seen[name, 'series', unit] = client.get(f'/reports/series/{period.name}', query_string=query).get_json()
+    for stream_id in stream_ids:
+        seen[stream_id, 'page'] = client.get(f'/stream/{stream_id}').get_data(as_text=True)
+        seen[stream_id, 'series'] = client.get(f'/stream/{stream_id}/series').get_json()
+        seen[stream_id, 'hours'] = [
+            (row.id, row.hour, row.viewers, row.followers, row.subs, row.bit_donations, row.started_at)
+            for row in stream_stats(db.session.get(Stream, stream_id))
+        ]
+    return seen
+
+
+def stored(models):
+    from sqlalchemy import select
+    from extensions import db
+    return [sorted(tuple(row) for row in db.session.execute(select(*model.__table__.columns))) for model in models]
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def timed(function, repeat=3):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=1500)
+    parser.add_argument('--days', type=int, default=90, help='Archive streams older than this')
+    parser.add_argument('--batch', type=int, default=3000, help='Hours moved per transaction')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    database = os.path.join(workdir, 'archive.db')
+    synthetic.populate(database, streams=args.streams)
+
+    from sqlalchemy import func, select
+    from app import app
+    from extensions import db
+    from models import HourlyStat, PeriodRollup, StreamRollup, SupportEvent, SupporterTotal
+    from services import leaderboards, periods, rollups
+    from services.archive import archive
+
+    app.config['CHART_CACHE_DIR'] = os.path.join(workdir, 'chart_cache')
+    archive.directory = os.path.join(workdir, 'archive')
+    client = app.test_client()
+    failures = 0
+    with app.app_context():
+        selected = report_periods(periods, args.days)
+        cutoff = date.today() - timedelta(days=args.days)
+        stream_ids = (1, args.streams // 2, args.streams - args.days - 1, args.streams)
+        before = snapshot(client, periods, selected, stream_ids)
+        year = periods.resolve('last_365_days')
+        live_ms = timed(lambda: (periods.report_data.clear(), periods.report_data.get(year).rows))
+        hours_before = db.session.scalar(select(func.count(HourlyStat.id)))
+        db.session.commit()
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql('VACUUM')
+        size_before = os.path.getsize(database)
+
+        start = time.perf_counter()
+        streams, hours = archive.compact(cutoff, batch=args.batch)
+        compact_ms = (time.perf_counter() - start) * 1000
+        left = db.session.scalar(select(func.count(HourlyStat.id)))
+        events_left = db.session.scalar(select(func.count(SupportEvent.id)).join(HourlyStat, HourlyStat.id == SupportEvent.hourly_stat_id, isouter=True)
+                                        .where(HourlyStat.id.is_(None)))
+        print(f'archived {hours} hours of {streams} streams older than {cutoff} in {compact_ms:.0f} ms; '
+              f'{left} hours left live ({hours_before} before)')
+        if left + hours != hours_before or events_left:
+            failures += 1
+            print(f'FAIL: {left} + {hours} != {hours_before} hours, or {events_left} orphaned support events')
+
+        after = snapshot(client, periods, selected, stream_ids)
+        differ = [key for key in before if not same(before[key], after[key])]
+        for key in differ:
+            print(f'MISMATCH {key}')
+        print(f'{len(before) - len(differ)}/{len(before)} report outputs unchanged by compaction')
+        failures += len(differ)
+        archived_ms = timed(lambda: (periods.report_data.clear(), periods.report_data.get(year).rows))
+
+        # One stream with live and archived hours
+        mixed = stream_ids[1]
+        client.post(f'/stream/{mixed}', data={'hour': '23:30', 'viewers': '99999', 'followers': '3'})
+        client.post(f'/stream/{mixed}', data={'hour': '17:00', 'viewers': '0', 'followers': '1'})
+        # Editing the live peak recomputes the stream's rollups from its archived and live hours
+        peak = db.session.scalars(select(HourlyStat).where(HourlyStat.stream_id == mixed, HourlyStat.viewers == 99999)).one()
+        peak.viewers = 5
+        db.session.commit()
+        period = periods.Period('all', date(1970, 1, 1), None)
+        periods.report_data.clear()
+        got = periods.report_data.get(period).stream_summaries[mixed]
+        expected = rollups.stream_summary(mixed)  # Folded incrementally from the archived rollup
+        if not same(tuple(got), tuple(expected)):
+            failures += 1
+            print(f'MISMATCH mixed stream summary:\n  report {got}\n  rollup {expected}')
+        else:
+            print('a stream with live and archived hours summarizes over both')
+
+        kept = stored((StreamRollup, PeriodRollup, SupporterTotal))
+        rollups.rebuild()
+        leaderboards.rebuild()
+        db.session.commit()
+        rebuilt = stored((StreamRollup, PeriodRollup, SupporterTotal))
+        for name, a, b in zip(('stream rollups', 'period rollups', 'leaderboards'), kept, rebuilt):
+            if not same(a, b):
+                failures += 1
+                print(f'MISMATCH rebuilt {name}: {len(a)} rows kept, {len(b)} rebuilt')
+        print(f'rebuild from hourly_stat and the archive reproduces {sum(len(rows) for rows in kept)} kept rows: {same(kept, rebuilt)}')
+
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql('VACUUM')
+        print(f'database {size_before / 2 ** 20:.1f} MiB -> {os.path.getsize(database) / 2 ** 20:.1f} MiB, '
+              f'archive {directory_size(archive.root()) / 2 ** 20:.1f} MiB')
+        print(f'last 365 days report rows: {live_ms:.0f} ms live, {archived_ms:.0f} ms with {args.days}+ days archived')
+    if failures:
+        raise SystemExit(f'{failures} checks failed')
+
+
+if __name__ == '__main__':
+    main()
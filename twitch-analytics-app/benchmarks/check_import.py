@@ -0,0 +1,121 @@
+"""Check that bulk import rejects unreadable files cleanly, and time a large CSV import.
+
+1. Posts malformed uploads to /import and checks each one gets a 400 with an
+   "aborted" reason instead of a 500: bytes that are not UTF-8 without a .csv
+   name (the format is sniffed from them), the same in a named CSV after
+   thousands of good rows, and a truncated JSON array. The rows read before
+   the error must be the ones reported as imported.
+2. Posts rows with bad values and checks they are reported per row while the
+   good rows are imported, and that a JSON hour of 0 is accepted.
+3. Imports a generated CSV of --rows rows (8 hours per stream, with two subs, a
+   donation and a bit donation each) through import_file() and prints the time
+   and rows per second.
+
+    python benchmarks/check_import.py [--rows 1000000]
+"""
+import argparse
+from datetime import date, timedelta
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+WORKDIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORKDIR, 'import.db')
+
+from sqlalchemy import func, select  # noqa: E402
+
+from app import app, init_db  # noqa: E402
+from extensions import db  # noqa: E402
+from models import HourlyStat  # noqa: E402
+from services import data_insertion  # noqa: E402
+
+HEADER = 'date,title,hour,viewers,followers,subs,donations,sub_donations,bit_donations\n'
+HOURS_PER_STREAM = 8
+
+
+def post(client, data, filename):
+    response = client.post('/import', data={'file': (io.BytesIO(data), filename)}, content_type='multipart/form-data')
+    return response.status_code, response.get_json()
+
+
+def hours():
+    with app.app_context():
+        return db.session.scalar(select(func.count(HourlyStat.id)))
+
+
+def csv_rows(rows, rng, title):
+    first_day = date.today() - timedelta(days=-(-rows // HOURS_PER_STREAM))
+    names = [f'viewer{i}' for i in range(500)]
+    lines = [HEADER]
+    for index in range(rows):
+        day = first_day + timedelta(days=index // HOURS_PER_STREAM)
+        subs = ';'.join(rng.sample(names, 2)).replace(';', ',')
+        lines.append(
+            f'{day},{title} {day},{12 + index % HOURS_PER_STREAM}:00,{rng.randrange(5000)},{rng.randrange(50)},'
+            f'"{subs}",{rng.choice(names)},,{rng.choice(names)}:{rng.randrange(1, 500)}\n'
+        )
+    return ''.join(lines).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+    app.config['CHART_CACHE_DIR'] = os.path.join(WORKDIR, 'chart_cache')
+    init_db()
+    client = app.test_client()
+    failures = 0
+
+    # Rows decoded before the bad bytes are imported and reported; the decoder reads blocks ahead
+    good = csv_rows(data_insertion.BATCH_SIZE, random.Random(1), 'batch')
+    cases = [
+        ('not UTF-8, format sniffed', b'\xff\xfe\x00d\x00a\x00t\x00e' + bytes(range(128, 256)), 'stats.txt'),
+        ('not UTF-8 after good rows', good + b'2024-01-02,bad \xff\xfe,21:00,1,1,,,,\n', 'stats.csv'),
+        ('truncated JSON array', b'[{"date": "2024-01-03", "hour": "20:00", "viewers": 1, "followers": 1}, {"date"', 'stats.json'),
+    ]
+    for name, data, filename in cases:
+        before = hours()
+        status, body = post(client, data, filename)
+        if status != 400 or not (body or {}).get('aborted') or hours() - before != body['imported']:
+            failures += 1
+            print(f'FAIL {name}: {status} {body}')
+        else:
+            print(f'{name}: 400, aborted ({body["aborted"]}), {body["imported"]} rows imported before it')
+
+    before = hours()
+    rows = HEADER + '2024-01-04,mixed,20:00,10,1,,,,\n2024-01-04,mixed,21:00,many,1,,,,\n2024-01-04,mixed,,10,1,,,,\n'
+    status, body = post(client, rows.encode(), 'mixed.csv')
+    if status != 200 or body['imported'] != 1 or body['failed'] != 2 or hours() - before != 1:
+        failures += 1
+        print(f'FAIL rows with bad values: {status} {body}')
+    else:
+        print('rows with bad values: 1 imported, 2 reported')
+
+    before = hours()
+    status, body = post(client, b'[{"date": "2024-01-05", "hour": 0, "viewers": 1, "followers": 0}]', 'zero.json')
+    if status != 200 or body['imported'] != 1 or hours() - before != 1:
+        failures += 1
+        print(f'FAIL JSON hour 0: {status} {body}')
+    else:
+        print('JSON hour 0: imported')
+
+    data = csv_rows(args.rows, random.Random(10), 'imported')
+    with app.app_context():
+        start = time.perf_counter()
+        result = data_insertion.import_file(io.BytesIO(data), filename='stats.csv')
+        elapsed = time.perf_counter() - start
+    if result.imported != args.rows or result.failed:
+        failures += 1
+        print(f'FAIL bulk import: {result.to_dict()}')
+    print(f'imported {args.rows} CSV rows in {elapsed:.1f} s ({args.rows / elapsed:,.0f} rows/s)')
+    if failures:
+        raise SystemExit(f'{failures} checks failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Check live ingestion: throughput, batching and recovery from a crash.
+
+1. Writes a JSON lines event feed: a viewer sample per stream and minute plus
+   follows, subs, gifted subs, donations and bits, interleaved across streams
+   in time order, a few events out of order within the allowed lateness, and
+   a few invalid lines.
+2. Ingests it in-process and reports events per second and the number of
+   write transactions.
+3. Ingests it again into a fresh database with `flask ingest`, kills the
+   process with SIGKILL once a checkpoint past --kill-at of the file has been
+   written, restarts it, and checks both databases hold exactly the hourly
+   stats, support events and rollups computed from the feed.
+
+    python benchmarks/check_ingest.py [--streams 20] [--hours 24] [--kill-at 0.4]
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+START = datetime(2025, 3, 1, 12)
+
+
+def write_feed(path, streams, hours, seed=3):
+    """Write the feed and return the expected {(stream_id, hour start): row} and event counts."""
+    rng = random.Random(seed)
+    expected = defaultdict(lambda: {'samples': [], 'followers': 0, 'sub': [], 'donation': [], 'sub_donation': [], 'bit': []})
+    lines = 0
+    with open(path, 'w') as f:
+        for minute in range(hours * 60):
+            at = START + timedelta(minutes=minute)
+            for stream_id in range(1, streams + 1):
+                batch = [{'type': 'viewers', 'count': rng.randint(50, 5000)}]
+                batch += [{'type': 'follow', 'username': f'follower{rng.randint(1, 10 ** 6)}'} for _ in range(rng.randint(0, 3))]
+                batch += [{'type': rng.choice(('sub', 'donation', 'sub_donation')), 'username': f'user{rng.randint(1, 500)}'}
+                          for _ in range(rng.randint(0, 2))]
+                if rng.random() < 0.3:
+                    batch.append({'type': 'bit', 'username': f'user{rng.randint(1, 500)}', 'amount': rng.choice((100, 500, 1000))})
+                for event in batch:
+                    # Up to a minute late, well within the default lateness
+                    event_at = at - timedelta(seconds=rng.randint(0, 60)) if rng.random() < 0.01 else at
+                    event.update(at=event_at.isoformat(), stream_id=stream_id)
+                    row = expected[stream_id, event_at.replace(minute=0, second=0)]
+                    if event['type'] == 'viewers':
+                        row['samples'].append(event['count'])
+                    elif event['type'] == 'follow':
+                        row['followers'] += 1
+                    elif event['type'] == 'bit':
+                        row['bit'].append(f'{event["username"]}:{event["amount"]}')
+                    else:
+                        row[event['type']].append(event['username'])
+                    f.write(json.dumps(event) + '\n')
+                    lines += 1
+            if minute % 600 == 0:
+                f.write('{"type": "viewers", "count": -1}\n')  # Rejected
+                lines += 1
+    rows = {
+        key: (f'{key[1].hour}:00', round(sum(row['samples']) / len(row['samples'])), row['followers'],
+              ','.join(row['sub']), ','.join(row['donation']), ','.join(row['sub_donation']), ';'.join(row['bit']))
+        for key, row in expected.items()
+    }
+    support_events = sum(len(row[kind]) for row in expected.values() for kind in ('sub', 'donation', 'sub_donation', 'bit'))
+    return rows, support_events, lines
+
+
+def create_streams(database, streams):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + database)
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'upgrade-db'], cwd=SRC_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    with sqlite3.connect(database) as conn:
+        conn.executemany('INSERT INTO stream (id, date, title, streamer) VALUES (?, ?, ?, ?)',
+                         [(i, START.date().isoformat(), f'stream {i}', 'Da1lyVitamin') for i in range(1, streams + 1)])
+
+
+def verify(database, expected, support_events):
+    conn = sqlite3.connect(database)
+    stored = {}
+    duplicates = 0
+    for row in conn.execute('SELECT stream_id, started_at, hour, viewers, followers, subs, donations, sub_donations, bit_donations '
+                            'FROM hourly_stat'):
+        key = (row[0], datetime.fromisoformat(row[1]))
+        duplicates += key in stored
+        stored[key] = tuple(row[2:])
+    wrong = sum(1 for key, row in expected.items() if stored.get(key) != row)
+    missing = len(expected.keys() - stored.keys())
+    event_count = conn.execute('SELECT COUNT(*) FROM support_event').fetchone()[0]
+    rollup_hours = conn.execute('SELECT SUM(count) FROM stream_rollup').fetchone()[0]
+    rollup_viewers = conn.execute('SELECT SUM(total) FROM stream_rollup').fetchone()[0]
+    ok = (not wrong and not missing and not duplicates and event_count == support_events
+          and rollup_hours == len(expected) and rollup_viewers == sum(row[1] for row in expected.values()))
+    print(f'  {len(stored)} hours stored ({len(expected)} expected), {wrong} differ, {duplicates} duplicated; '
+          f'{event_count}/{support_events} support events; rollups {rollup_hours} hours')
+    return ok
+
+
+def checkpoint_position(database):
+    try:
+        with sqlite3.connect(database, timeout=1) as conn:
+            row = conn.execute('SELECT state FROM ingest_checkpoint').fetchone()
+    except sqlite3.Error:
+        return 0
+    return json.loads(row[0])['position'] or 0 if row else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=20)
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--kill-at', type=float, default=0.4, help='Share of the feed checkpointed before the kill')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    feed = os.path.join(workdir, 'events.jsonl')
+    expected, support_events, lines = write_feed(feed, args.streams, args.hours)
+    size = os.path.getsize(feed)
+    print(f'feed: {lines} events, {size / 2 ** 20:.1f} MB, {len(expected)} stream hours')
+    failures = 0
+
+    # In-process run
+    database = os.path.join(workdir, 'ingest.db')
+    create_streams(database, args.streams)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + database
+    from app import app
+    from services import ingestion
+
+    ingestor = ingestion.Ingestor(app, ingestion.JsonLinesSource(feed), flush_interval=1.0)
+    start = time.perf_counter()
+    stats = asyncio.run(ingestor.run())
+    elapsed = time.perf_counter() - start
+    print(f'in-process: {stats.events / elapsed:,.0f} events/s, {stats.flushes} transactions for {stats.events} events '
+          f'({stats.invalid} invalid, {stats.late} late, queue high water {stats.queue_high_water})')
+    failures += not verify(database, expected, support_events)
+
+    # Crash and resume
+    database = os.path.join(workdir, 'crash.db')
+    create_streams(database, args.streams)
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + database)
+    command = [sys.executable, '-m', 'flask', '--app', 'app', 'ingest', feed, '--flush-interval', '0.2']
+    process = subprocess.Popen(command, cwd=SRC_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while process.poll() is None and checkpoint_position(database) < args.kill_at * size:
+        time.sleep(0.02)
+    if process.poll() is None:
+        os.kill(process.pid, signal.SIGKILL)
+        process.wait()
+        print(f'killed at a checkpoint {checkpoint_position(database) / size:.0%} into the feed')
+    else:
+        print('the first run finished before it could be killed; use a longer feed')
+        failures += 1
+    resumed = subprocess.run(command, cwd=SRC_DIR, env=env, capture_output=True, text=True)
+    print(f'  resumed: {resumed.stdout.strip()}')
+    failures += resumed.returncode != 0
+    failures += not verify(database, expected, support_events)
+    if failures:
+        raise SystemExit(f'{failures} checks failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""Check the supporter leaderboards against rankings computed from support_event.
+
+1. Fills a database with benchmarks/synthetic.py (leaderboards built by
+   rebuild()), then posts hours through the stream form and bulk imports more
+   (the two incremental write paths).
+2. Compares the per-stream, per-period (including custom ranges) and all-time
+   leaderboards with events.top_supporters() for every event kind.
+3. Runs leaderboards.rebuild() and checks it reproduces the incremental rows.
+4. Rebuilds in approximate mode with --capacity rows per scope and reports the
+   stored rows, the top-N recall and whether every true amount lies within
+   [amount - error, amount].
+5. Times the all-time leaderboard from supporter_total, from support_event and
+   by parsing every HourlyStat text column.
+
+    python benchmarks/check_leaderboards.py [--streams 2000] [--capacity 200]
+"""
+import argparse
+from collections import Counter
+from datetime import date, datetime, time as clock, timedelta
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+
+TOP = 10
+PERIODS = ('day', 'week', 'calendar_week', 'month', 'year', 'last_90_days')
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def post_hours(client, usernames):
+    response = client.post('/stream/new', data={'date': date.today().isoformat(), 'title': 'posted'})
+    stream_id = int(response.headers['Location'].rsplit('/', 1)[1])
+    for hour in range(4):
+        client.post(f'/stream/{stream_id}', data={
+            'hour': f'{hour}:00', 'viewers': '10', 'followers': '1',
+            'subs_usernames[]': usernames[hour:hour + 3], 'sub_donations_usernames[]': usernames[:1],
+            'bit_donations_usernames[]': usernames[:2], 'bit_donations_amounts[]': ['5000', '100'],
+        })
+    return stream_id
+
+
+def import_hours(usernames):
+    from services import data_insertion
+    lines = [json.dumps({
+        'date': date.today().isoformat(), 'title': 'imported', 'hour': f'{hour}:00', 'viewers': 10, 'followers': 0,
+        'subs': ','.join(usernames[hour:hour + 2]), 'donations': usernames[hour % len(usernames)],
+        'bit_donations': f'{usernames[0]}:2500;{usernames[hour % len(usernames)]}:100',
+    }) for hour in range(10)]
+    result = data_insertion.import_file(io.BytesIO('\n'.join(lines).encode()), fmt='jsonl')
+    assert result.imported == len(lines), result.to_dict()
+
+
+def custom_ranges(periods):
+    # Within one month, across a month boundary, and across several whole months
+    today = date.today()
+    first = today.replace(day=1)
+    return [
+        periods.resolve('custom', first - timedelta(days=20), first - timedelta(days=10)),
+        periods.resolve('custom', first - timedelta(days=45), first - timedelta(days=25)),
+        periods.resolve('custom', today - timedelta(days=200), today - timedelta(days=3)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=2000)
+    parser.add_argument('--capacity', type=int, default=200, help='Rows per scope and kind in approximate mode')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    synthetic.populate(os.path.join(workdir, 'leaderboards.db'), streams=args.streams)
+
+    from sqlalchemy import select
+    from app import app
+    from extensions import db
+    from models import HourlyStat, SupporterTotal
+    from services import events, leaderboards, periods
+
+    def ranking(rows):
+        return [(row.username, row.events, row.amount) for row in rows]
+
+    def stored_rows():
+        return set(db.session.execute(select(
+            SupporterTotal.scope, SupporterTotal.kind, SupporterTotal.username, SupporterTotal.events, SupporterTotal.amount,
+        )).all())
+
+    client = app.test_client()
+    with app.app_context():
+        usernames = [name for name, _, _ in events.top_supporters('sub', limit=5)]
+        posted = post_hours(client, usernames)
+        import_hours(usernames)
+
+        failures = 0
+        checked = 0
+        for kind in events.KIND_COLUMNS:
+            cases = [(f'stream {stream_id}', leaderboards.stream_top(stream_id, kind, TOP),
+                      events.top_supporters(kind, stream_id=stream_id, limit=TOP)) for stream_id in (1, args.streams, posted)]
+            for period in [periods.resolve(name) for name in PERIODS] + custom_ranges(periods):
+                since = datetime.combine(period.start, clock())
+                until = datetime.combine(period.end, clock()) if period.end else None
+                cases.append((f'{period.name} {period.key}', leaderboards.top_since(kind, period.start, TOP, end=period.end),
+                              events.top_supporters(kind, since=since, until=until, limit=TOP)))
+            cases.append(('all time', leaderboards.top(kind, limit=TOP), events.top_supporters(kind, limit=TOP)))
+            for name, got, expected in cases:
+                checked += 1
+                if ranking(got) != [tuple(row) for row in expected]:
+                    failures += 1
+                    print(f'MISMATCH {kind} {name}:\n  leaderboard {ranking(got)}\n  events      {[tuple(r) for r in expected]}')
+        print(f'{checked - failures}/{checked} leaderboards match support_event')
+
+        incremental = stored_rows()
+        leaderboards.rebuild()
+        rebuilt = stored_rows()
+        print(f'rebuild reproduces the incremental rows: {incremental == rebuilt} ({len(rebuilt)} rows)')
+        failures += incremental != rebuilt
+
+        app.config['LEADERBOARD_CAPACITY'] = args.capacity
+        year = periods.resolve('year')
+        _, rebuild_ms = timed(leaderboards.rebuild)
+        approximate_rows = db.session.scalar(select(db.func.count()).select_from(SupporterTotal))
+        print(f'approximate mode, capacity {args.capacity}: {approximate_rows} rows (exact {len(rebuilt)}), rebuilt in {rebuild_ms:.0f} ms')
+        for kind in events.KIND_COLUMNS:
+            for name, got, truth in (
+                ('all time', leaderboards.top(kind, limit=TOP), events.top_supporters(kind, limit=10 ** 9)),
+                ('year', leaderboards.top_since(kind, year.start, TOP),
+                 events.top_supporters(kind, since=datetime.combine(year.start, clock()), limit=10 ** 9)),
+            ):
+                true_amount = {row[0]: row[2] for row in truth}
+                recall = len({row.username for row in got} & {row[0] for row in truth[:TOP]}) / max(min(TOP, len(truth)), 1)
+                bounded = all(row.amount - row.error <= true_amount.get(row.username, 0) <= row.amount for row in got)
+                print(f'  {kind:<12} {name:<8} top-{TOP} recall {recall:.0%}, amounts within error: {bounded}')
+                failures += not bounded
+        app.config['LEADERBOARD_CAPACITY'] = None
+        leaderboards.rebuild()
+        db.session.commit()
+
+        _, table_ms = timed(lambda: leaderboards.top('bit', limit=TOP))
+        _, events_ms = timed(lambda: events.top_supporters('bit', limit=TOP))
+
+        def rescan():
+            totals = Counter()
+            for (blob,) in db.session.execute(select(HourlyStat.bit_donations)):
+                for username, amount in events.parse_bits(blob):
+                    totals[username] += amount
+            return totals.most_common(TOP)
+        _, rescan_ms = timed(rescan)
+        print(f'all-time bit leaderboard: supporter_total {table_ms:.1f} ms, support_event {events_ms:.1f} ms, '
+              f'text columns {rescan_ms:.1f} ms')
+    if failures:
+        raise SystemExit(f'{failures} checks failed')
+
+
+if __name__ == '__main__':
+    main()
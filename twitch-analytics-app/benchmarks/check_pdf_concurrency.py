@@ -0,0 +1,133 @@
+"""Check that concurrent PDF reports are built in memory, without writing any file.
+
+1. Points TMPDIR, the Flask instance_path and the working directory at empty
+   temporary directories (the database lives in another one), and turns off the
+   chart cache's disk level, the one place the app writes files by design.
+2. Builds --reports daily reports on --threads threads straight from
+   generate_report_pdf() with in-memory chart images, then downloads the PDF of
+   every stream of a benchmarks/synthetic.py database and of a few periods
+   through the routes on the same number of threads.
+3. Fails if any of the three directories is no longer empty, if a report is not
+   a complete PDF, or if it differs from the same report built on one thread.
+
+    python benchmarks/check_pdf_concurrency.py [--reports 200] [--threads 8] [--streams 40]
+"""
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+
+Row = namedtuple('Row', 'hour viewers followers subs donations sub_donations bit_donations')
+PERIODS = ('month', 'year', 'last_30_days')
+
+
+def make_report_input(seed, hours=8):
+    from services import aggregation, charts
+    viewers = [(seed * 7 + h * 13) % 90 + 10 for h in range(hours)]
+    stats = [Row(f'{h}:00', v, h, 'alice,bob', '', 'carol', 'dave:100') for h, v in enumerate(viewers)]
+    total = sum(viewers)
+    mean = total / hours
+    summary = aggregation.Summary(
+        count=hours, total=total, average=mean, minimum=min(viewers), maximum=max(viewers),
+        std=(sum((v - mean) ** 2 for v in viewers) / hours) ** 0.5,
+        peak_hour=stats[viewers.index(max(viewers))].hour, low_hour=stats[viewers.index(min(viewers))].hour,
+        first=viewers[0], last=viewers[-1],
+    )
+    chart = charts.render('trend', [s.hour for s in stats], viewers)
+    return stats, summary, chart
+
+
+def build(report_input):
+    from services.report_generation import generate_report_pdf
+    stats, summary, chart = report_input
+    return generate_report_pdf(stats, summary, 'day', chart).output(dest='S').encode('latin1')
+
+
+def comparable(pdf):
+    # FPDF stamps the wall-clock second into /CreationDate
+    return re.sub(rb'/CreationDate \(D:\d+\)', b'', pdf)
+
+
+def download(app, url):
+    response = app.test_client().get(url)
+    assert response.status_code == 200, (url, response.status_code)
+    return response.get_data()
+
+
+def check(name, results, expected):
+    failures = []
+    for i, (pdf, want) in enumerate(zip(results, expected)):
+        if not (pdf.startswith(b'%PDF-') and pdf.rstrip().endswith(b'%%EOF')):
+            failures.append(f'{name} {i} is not a complete PDF')
+        elif comparable(pdf) != comparable(want):
+            failures.append(f'{name} {i} differs from the single-threaded build')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reports', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--streams', type=int, default=40)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    watched = {name: os.path.join(root, name) for name in ('TMPDIR', 'instance_path', 'working directory')}
+    for path in watched.values():
+        os.mkdir(path)
+    os.environ['TMPDIR'] = watched['TMPDIR']
+    tempfile.tempdir = None  # Read TMPDIR again
+    os.chdir(watched['working directory'])
+    os.mkdir(os.path.join(root, 'db'))
+    synthetic.populate(os.path.join(root, 'db', 'pdf.db'), streams=args.streams)
+
+    from app import app
+    from services.chart_cache import chart_cache
+    from services.response_cache import response_cache
+    app.instance_path = watched['instance_path']
+    chart_cache.disk_dir = None
+
+    inputs = [make_report_input(seed) for seed in range(4)]  # Four distinct charts, reused
+    expected = [build(report_input) for report_input in inputs]
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(build, [inputs[i % len(inputs)] for i in range(args.reports)]))
+        elapsed = time.perf_counter() - start
+    failures = check('report', results, [expected[i % len(inputs)] for i in range(args.reports)])
+    print(f'{args.reports} reports on {args.threads} threads: {args.reports / elapsed:.1f} reports/s')
+
+    urls = [f'/stream/{stream_id}/pdf_download' for stream_id in range(1, args.streams + 1)]
+    urls += [f'/reports/pdf/{period}' for period in PERIODS]
+    expected = [download(app, url) for url in urls]
+    response_cache.clear()  # Render every PDF again
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(lambda url: download(app, url), urls))
+        elapsed = time.perf_counter() - start
+    failures += check('download', results, expected)
+    print(f'{len(urls)} PDF downloads on {args.threads} threads: {len(urls) / elapsed:.1f} downloads/s')
+
+    for name, path in watched.items():
+        written = os.listdir(path)
+        if written:
+            failures.append(f'files written to the {name}: {written}')
+        else:
+            print(f'{name}: empty')
+    for failure in failures[:10]:
+        print('FAIL', failure)
+    if failures:
+        raise SystemExit(f'{len(failures)} checks failed')
+
+
+if __name__ == '__main__':
+    main()
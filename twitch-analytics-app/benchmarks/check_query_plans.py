@@ -0,0 +1,172 @@
+"""EXPLAIN QUERY PLAN check for every route's SQL against a large database.
+
+1. Runs each analytics route through the Flask test client against a small
+   seeded database and records every SELECT it issues. Report jobs are
+   submitted, polled through /jobs/<id> until they finish and downloaded.
+2. Builds a SQLite database with the same schema and ROWS hourly stats
+   (default one million) spread over several years.
+3. Runs EXPLAIN QUERY PLAN for each recorded statement on the large database
+   and fails if any plan walks a whole table or index ("SCAN <table>")
+   instead of searching it.
+
+    python benchmarks/check_query_plans.py [rows]
+"""
+from datetime import date, datetime, timedelta
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+WORKDIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORKDIR, 'routes.db')
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, init_db  # noqa: E402
+from extensions import db  # noqa: E402
+
+FULL_SCAN = re.compile(r'^SCAN (\w+)')
+HOURS_PER_STREAM = 8
+
+
+def route_requests(stream_id):
+    periods = ('day', 'week', 'month', 'year')
+    requests = [
+        ('GET', '/', None), ('GET', f'/?after={date.today().isoformat()}_{stream_id + 1}', None),
+        ('GET', '/streams', None), ('GET', f'/stream/{stream_id}', None),
+    ]
+    requests += [('POST', '/reports', {'period': period}) for period in periods]
+    requests += [('GET', f'/reports/pdf/{period}', None) for period in periods]
+    requests += [('GET', f'/reports/pdf_preview/{period}', None) for period in periods]
+    requests += [
+        ('GET', f'/stream/{stream_id}/pdf_preview', None),
+        ('GET', f'/stream/{stream_id}/pdf_download', None),
+        ('JOB', f'/stream/{stream_id}/pdf_job', None),
+        ('JOB', '/reports/pdf/month/job', None),
+    ]
+    now = int(datetime.now().timestamp() * 1000)  # Time series x values are epoch milliseconds
+    requests += [('GET', f'/reports/series/{period}', None) for period in periods]
+    requests += [
+        ('GET', '/reports/series/year?unit=day&method=minmax', None),
+        ('GET', f'/reports/series/year?unit=auto&from={now - 30 * 86_400_000}&to={now}', None),
+        ('GET', f'/stream/{stream_id}/series', None),
+    ]
+    requests += [('GET', f'/reports/export/{period}', None) for period in ('month', 'last_365_days')]
+    requests += [
+        ('GET', '/compare/data', None),
+        ('GET', '/compare/data?period=year', None),
+        ('GET', f'/compare/data?stream_id={stream_id}&stream_id={stream_id + 1}', None),
+        ('GET', '/compare/chart?period=year', None),
+    ]
+    requests += [('GET', f'/leaderboards?period={period}', None) for period in periods + ('last_30_days', 'all')]
+    requests += [
+        ('GET', f'/leaderboards?period=custom&start={date.today() - timedelta(days=100)}&end={date.today()}', None),
+        ('GET', f'/leaderboards?stream_id={stream_id}', None),
+    ]
+    return requests
+
+
+def run_job(client, url):
+    # Submit a report job, poll its status until it finishes and download the PDF
+    payload = client.post(url).get_json()
+    while payload['status'] not in ('done', 'failed'):
+        time.sleep(0.005)
+        payload = client.get(payload['status_url']).get_json()
+    return client.get(payload['download_url'])
+
+
+def capture_route_queries():
+    app.config['CHART_CACHE_DIR'] = os.path.join(WORKDIR, 'chart_cache')
+    init_db()
+    client = app.test_client()
+    client.post('/stream/new', data={'date': date.today().isoformat(), 'title': 'plan check'})
+    for hour in range(3):
+        client.post('/stream/1', data={
+            'hour': f'{hour}:00', 'viewers': str(10 + hour), 'followers': '1',
+            'subs_usernames[]': ['alice'], 'bit_donations_usernames[]': ['bob'], 'bit_donations_amounts[]': ['100'],
+        })
+
+    captured = {}
+    current = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')) and 'sqlite_master' not in statement:
+            captured.setdefault((statement, tuple(parameters or ())), current['route'])
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        for method, url, data in route_requests(1):
+            current['route'] = f'{method} {url}'
+            response = run_job(client, url) if method == 'JOB' else client.open(url, method=method, data=data)
+            if response.is_streamed:
+                b''.join(response.response)
+            assert response.status_code == 200, (url, response.status_code)
+    finally:
+        with app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', record)
+    return captured
+
+
+def build_large_database(path, rows):
+    with app.app_context():
+        schema = [sql for (sql,) in db.session.execute(db.text(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'"
+        ))]
+    conn = sqlite3.connect(path)
+    for sql in schema:
+        conn.execute(sql)
+    rng = random.Random(42)
+    streams = rows // HOURS_PER_STREAM
+    first_day = date.today() - timedelta(days=streams // 3)
+    conn.executemany(
+        'INSERT INTO stream (id, date, title, streamer) VALUES (?, ?, ?, ?)',
+        ((i + 1, (first_day + timedelta(days=i // 3)).isoformat(), f'Stream {i + 1}', 'Da1lyVitamin') for i in range(streams)),
+    )
+
+    def stats():
+        for stream in range(streams):
+            day = datetime.combine(first_day + timedelta(days=stream // 3), datetime.min.time())
+            for hour in range(HOURS_PER_STREAM):
+                stamp = (day + timedelta(hours=hour)).isoformat(sep=' ')
+                yield (stream + 1, f'{hour}:00', rng.randint(0, 5000), rng.randint(0, 50), 'alice,bob', '', '', 'carol:100', stamp, stamp, stamp)
+
+    conn.executemany(
+        'INSERT INTO hourly_stat (stream_id, hour, viewers, followers, subs, donations, sub_donations, bit_donations, started_at, created_at, updated_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        stats(),
+    )
+    conn.execute('ANALYZE')
+    conn.commit()
+    return conn
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    captured = capture_route_queries()
+    conn = build_large_database(os.path.join(WORKDIR, 'large.db'), rows)
+    # Subquery and CTE scans (anon_1, subquery-3) read intermediate results, not tables
+    checked = set(db.metadata.tables)
+    failures = 0
+    for (statement, parameters), route in captured.items():
+        plan = [detail for *_, detail in conn.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+        scans = [
+            detail for detail in plan
+            if FULL_SCAN.match(detail) and FULL_SCAN.match(detail).group(1) in checked
+            # Walking an index in order under a LIMIT stops after one page
+            and not ('USING INDEX' in detail and ' LIMIT ' in statement)
+        ]
+        if scans:
+            failures += 1
+            print(f'FULL SCAN in {route}:\n  {" ".join(statement.split())}\n  plan: {plan}')
+    print(f'{len(captured)} distinct queries checked against {rows} rows, {failures} with full scans')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""Check the rollup tables against summaries computed from the raw hourly stats.
+
+1. Bulk imports a few years of backdated hours (the batched path), then posts
+   today's hours through the stream form (the incremental Welford path), out
+   of order and some past midnight, so started_at order and insertion order
+   differ. Then edits, moves to another day or stream, and deletes some hours
+   through the ORM, which recomputes the rollups they belonged to.
+2. Compares every stream rollup and the summaries of every report period, plus
+   custom ranges, with aggregation.summarize() over hourly_stat.
+3. Runs rollups.rebuild() and checks it reproduces the incremental rows.
+4. Times the report summaries both ways.
+
+    python benchmarks/check_rollups.py [imported rows]
+"""
+from datetime import date, timedelta
+import json
+import io
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+WORKDIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORKDIR, 'rollups.db')
+
+from sqlalchemy import select  # noqa: E402
+
+from app import app, init_db  # noqa: E402
+from extensions import db  # noqa: E402
+from models import HourlyStat, PeriodRollup, Stream, StreamRollup  # noqa: E402
+from services import aggregation, data_insertion, periods, rollups  # noqa: E402
+
+HOURS_PER_STREAM = 8
+POSTED_STREAMS = 20
+EDITED_HOURS = 40
+
+
+def post_hours(client, rng):
+    for _ in range(POSTED_STREAMS):
+        response = client.post('/stream/new', data={'date': date.today().isoformat(), 'title': 'posted'})
+        stream_id = int(response.headers['Location'].rsplit('/', 1)[1])
+        hours = rng.sample(range(24), HOURS_PER_STREAM)  # Out of order, as people fill the form in
+        for hour in hours:
+            client.post(f'/stream/{stream_id}', data={
+                'hour': f'{hour}:00', 'viewers': str(rng.randrange(0, 60)), 'followers': str(rng.randrange(5)),
+            })
+
+
+def import_hours(rows, rng):
+    # Backdated streams ending yesterday, one per day, in time order
+    streams = -(-rows // HOURS_PER_STREAM)
+    first_day = date.today() - timedelta(days=streams)
+    lines = []
+    for index in range(rows):
+        day = first_day + timedelta(days=index // HOURS_PER_STREAM)
+        hour = 12 + index % HOURS_PER_STREAM
+        lines.append(json.dumps({
+            'date': day.isoformat(), 'title': f'imported {day}', 'hour': f'{hour}:00',
+            'viewers': rng.randrange(0, 5000), 'followers': rng.randrange(50),
+        }))
+    result = data_insertion.import_file(io.BytesIO('\n'.join(lines).encode()), fmt='jsonl')
+    assert result.imported == rows and not result.failed, result.to_dict()
+
+
+def edit_hours(rng, edits=EDITED_HOURS):
+    stat_ids = db.session.scalars(select(HourlyStat.id)).all()
+    stream_ids = db.session.scalars(select(Stream.id)).all()
+    for number, stat_id in enumerate(rng.sample(stat_ids, edits)):
+        stat = db.session.get(HourlyStat, stat_id)
+        change = number % 4
+        if change == 0:
+            stat.viewers = rng.randrange(0, 6000)
+        elif change == 1:
+            stat.started_at -= timedelta(days=rng.randrange(1, 60), hours=rng.randrange(24))
+            stat.hour = f'{stat.started_at.hour}:00'
+        elif change == 2:
+            stat.stream_id = rng.choice(stream_ids)
+        else:
+            db.session.delete(stat)
+        if number % 10 == 9:
+            db.session.flush()  # Several flushes in one transaction
+    db.session.commit()
+
+
+def same_summary(label, rollup, raw):
+    assert (rollup is None) == (raw is None), label
+    if raw is None:
+        return
+    for field in ('count', 'total', 'minimum', 'maximum', 'peak_hour', 'low_hour', 'first', 'last'):
+        assert getattr(rollup, field) == getattr(raw, field), (label, field, rollup, raw)
+    assert math.isclose(rollup.average, raw.average, rel_tol=1e-12), (label, rollup, raw)
+    assert math.isclose(rollup.std, raw.std, rel_tol=1e-9, abs_tol=1e-9), (label, rollup, raw)
+
+
+def report_periods():
+    today = date.today()
+    first = today.replace(day=1)
+    selected = [periods.resolve(name) for name in periods.NAMES if name != periods.CUSTOM] + [
+        periods.resolve('custom', first - timedelta(days=20), first - timedelta(days=10)),
+        periods.resolve('custom', first - timedelta(days=45), first - timedelta(days=25)),
+        periods.resolve('custom', today - timedelta(days=200), today - timedelta(days=3)),
+    ]
+    selected.append(periods.Period('all', date(1970, 1, 1), None))
+    return selected
+
+
+def rollup_rows():
+    def rows(model):
+        return sorted(tuple(getattr(row, column.name) for column in model.__table__.columns)
+                      for row in db.session.scalars(select(model)))
+    return rows(StreamRollup), rows(PeriodRollup)
+
+
+def same_rows(incremental, rebuilt):
+    assert len(incremental) == len(rebuilt)
+    for a, b in zip(incremental, rebuilt):
+        assert len(a) == len(b) and all(
+            math.isclose(x, y, rel_tol=1e-9, abs_tol=1e-6) if isinstance(x, float) else x == y
+            for x, y in zip(a, b)
+        ), (a, b)
+
+
+def timed(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = random.Random(12)
+    app.config['CHART_CACHE_DIR'] = os.path.join(WORKDIR, 'chart_cache')
+    init_db()
+    with app.app_context():
+        import_hours(rows, rng)
+    post_hours(app.test_client(), rng)
+    with app.app_context():
+        edit_hours(rng)
+        for stream_id in db.session.scalars(select(Stream.id)):
+            same_summary(
+                f'stream {stream_id}', rollups.stream_summary(stream_id),
+                aggregation.summarize(HourlyStat.stream_id == stream_id),
+            )
+        for period in report_periods():
+            same_summary(f'{period.name} {period.key}', rollups.summary_since(period.start, period.end),
+                         aggregation.summarize(*period.criteria))
+        print(f'rollups match raw summaries for {db.session.query(Stream).count()} streams and {len(report_periods())} periods')
+
+        incremental = rollup_rows()
+        rollups.rebuild()
+        db.session.commit()
+        same_rows(incremental[0], rollup_rows()[0])
+        same_rows(incremental[1], rollup_rows()[1])
+        print('rebuild reproduces the incremental rollups')
+
+        for period in report_periods():
+            raw = timed(lambda: aggregation.summarize(*period.criteria), repeat=3)
+            rollup = timed(lambda: rollups.summary_since(period.start, period.end))
+            print(f'{period.name:>13} summary: raw {raw * 1000:9.2f} ms   rollups {rollup * 1000:6.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Reproducible synthetic Twitch data for benchmarks.
+
+Fills an app database with streams, hourly stats and the SupportEvent rows
+parsed from them, then rebuilds the rollups and leaderboards and runs ANALYZE, so every route
+sees the same kind of data the app writes itself. Streams end today and go
+back one day per STREAMS_PER_DAY streams, so day/week/month/year reports all
+find rows. Viewer counts follow a per-stream audience with a mid-stream peak;
+subs, donations, gifted subs and bit donations are Poisson counts per hour with
+usernames drawn from a skewed pool of regulars, so the text payloads have
+realistic lengths and repeat supporters.
+
+The same seed and sizes always give the same database.
+
+    python benchmarks/synthetic.py out.db [--streams 2000] [--hours 8] [--events 6] [--seed 1]
+"""
+import argparse
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate
+import math
+import os
+import random
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+STREAMS_PER_DAY = 1
+START_HOUR = 18
+USERNAME_POOL = 20_000
+BIT_AMOUNTS = (100, 100, 100, 250, 500, 500, 1000, 2500, 5000, 10000)
+# Share of the per-hour support events per kind
+EVENT_MIX = {'subs': 0.45, 'donations': 0.15, 'sub_donations': 0.1, 'bit_donations': 0.3}
+
+
+def _poisson(rng, mean):
+    # Knuth's method; the means used here are small
+    limit, count, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+class Generator:
+    def __init__(self, streams=2000, hours=8, events=6.0, seed=1, end=None):
+        self.streams = streams
+        self.hours = hours
+        self.events = events  # Mean support events per hour, across all kinds
+        self.rng = random.Random(seed)
+        self.end = end or date.today()
+        self.usernames = [f'{self.rng.choice(("xx_", "the", "", "not", "its"))}viewer{n}' for n in range(USERNAME_POOL)]
+        # Zipf-like weights: a few regulars show up in most streams
+        self._cum_weights = list(accumulate(1 / (rank + 1) for rank in range(USERNAME_POOL)))
+
+    def _names(self, count):
+        return self.rng.choices(self.usernames, cum_weights=self._cum_weights, k=count)
+
+    def stream_rows(self):
+        for index in range(self.streams):
+            day = self.end - timedelta(days=(self.streams - 1 - index) // STREAMS_PER_DAY)
+            yield index + 1, day.isoformat(), f'Stream {index + 1}: {self.rng.choice(("Ranked", "Chill", "Speedrun", "Q&A"))}', 'Da1lyVitamin'
+
+    def stat_rows(self):
+        """(id, stream_id, hour, viewers, followers, subs, donations, sub_donations, bit_donations, started_at) tuples."""
+        rng = self.rng
+        stat_id = 0
+        for stream_id, day, _, _ in self.stream_rows():
+            audience = rng.lognormvariate(6, 0.6)
+            start = datetime.combine(date.fromisoformat(day), time(START_HOUR))
+            for hour in range(self.hours):
+                stat_id += 1
+                shape = math.sin(math.pi * (hour + 0.5) / self.hours)
+                viewers = max(0, int(audience * (0.4 + 0.6 * shape) * rng.uniform(0.85, 1.15)))
+                followers = _poisson(rng, viewers * 0.01)
+                blobs = {}
+                for column, share in EVENT_MIX.items():
+                    names = self._names(_poisson(rng, self.events * share))
+                    if column == 'bit_donations':
+                        blobs[column] = ';'.join(f'{name}:{rng.choice(BIT_AMOUNTS)}' for name in names)
+                    else:
+                        blobs[column] = ','.join(names)
+                stamp = (start + timedelta(hours=hour)).isoformat(sep=' ', timespec='microseconds')  # As SQLAlchemy stores it
+                yield (
+                    stat_id, stream_id, f'{(START_HOUR + hour) % 24}:00', viewers, followers,
+                    blobs['subs'], blobs['donations'], blobs['sub_donations'], blobs['bit_donations'], stamp,
+                )
+
+
+def populate(database_path, streams=2000, hours=8, events=6.0, seed=1, end=None):
+    """Create the schema in database_path and fill it; returns the number of hourly stats."""
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(database_path)
+    from app import app, init_db
+    from extensions import db
+    from services import events as support_events, leaderboards, rollups
+
+    if os.environ['DATABASE_URL'] != app.config['SQLALCHEMY_DATABASE_URI']:
+        raise RuntimeError('populate() must run before the app is imported with another DATABASE_URL')
+    init_db()
+    generator = Generator(streams, hours, events, seed, end)
+    conn = sqlite3.connect(database_path)
+    conn.executemany('INSERT INTO stream (id, date, title, streamer) VALUES (?, ?, ?, ?)', generator.stream_rows())
+    batch, events_batch = [], []
+    for row in generator.stat_rows():
+        batch.append(row + (row[-1], row[-1]))  # Written as the hour ends: created_at = updated_at = started_at
+        stat_id, stream_id, started_at = row[0], row[1], row[-1]
+        blobs = dict(zip(EVENT_MIX, row[5:9]))
+        for kind, column in support_events.KIND_COLUMNS.items():
+            blob = blobs[column]
+            if not blob:
+                continue
+            pairs = support_events.parse_bits(blob) if kind == 'bit' else [(name, 1) for name in support_events.parse_usernames(blob)]
+            events_batch.extend((stream_id, stat_id, kind, name, amount, started_at, started_at) for name, amount in pairs)
+        if len(batch) >= 5000:
+            _flush(conn, batch, events_batch)
+    _flush(conn, batch, events_batch)
+    conn.commit()
+    conn.close()
+    with app.app_context():
+        rollups.rebuild()
+        leaderboards.rebuild()
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+    return streams * hours
+
+
+def _flush(conn, batch, events_batch):
+    conn.executemany(
+        'INSERT INTO hourly_stat (id, stream_id, hour, viewers, followers, subs, donations, sub_donations, bit_donations, '
+        'started_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        batch,
+    )
+    conn.executemany(
+        'INSERT INTO support_event (stream_id, hourly_stat_id, kind, username, amount, started_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        events_batch,
+    )
+    batch.clear()
+    events_batch.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database')
+    parser.add_argument('--streams', type=int, default=2000)
+    parser.add_argument('--hours', type=int, default=8, help='Hours per stream')
+    parser.add_argument('--events', type=float, default=6.0, help='Mean support events per hour')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if os.path.exists(args.database):
+        parser.error(f'{args.database} already exists')
+    rows = populate(args.database, args.streams, args.hours, args.events, args.seed)
+    print(f'Wrote {args.streams} streams and {rows} hourly stats to {args.database}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,45 @@
+import argparse
+import multiprocessing
 import threading
-import webview
 import os
 import sys
 
 # Ensure src is in the Python path for imports
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "src")))
 
-def run_flask():
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Twitch Analytics App")
+    parser.add_argument("--server", help="waitress (default) or dev; also $APP_SERVER")
+    parser.add_argument("--threads", type=int, help="Worker threads for waitress; also $APP_THREADS")
+    parser.add_argument("--host", help="Also $APP_HOST")
+    parser.add_argument("--port", type=int, help="Also $APP_PORT")
+    parser.add_argument("--headless", action="store_true", help="Serve without opening the desktop window")
+    parser.add_argument("--no-prewarm", dest="prewarm", action="store_false",
+                        help="Skip loading the chart and PDF modules in the background at start")
+    return parser.parse_args()
+
+def run_flask(options):
     os.environ["FLASK_ENV"] = "production"
-    from app import app  # Now imports from src/app.py due to sys.path change
-    app.run(port=5000, debug=False, use_reloader=False)
+    from app import app, init_db  # Now imports from src/app.py due to sys.path change
+    import serving
+    init_db()
+    serving.serve(app, **options)
 
 if __name__ == '__main__':
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-    webview.create_window("Twitch Analytics App", "http://127.0.0.1:5000", width=1200, height=800)
-    webview.start()
+    # Bulk PDF exports spawn worker processes; in the frozen app those re-run this executable
+    multiprocessing.freeze_support()
+    args = parse_args()
+    import serving
+    options = serving.settings(args.server, args.threads, args.host, args.port)
+    if args.headless:
+        if args.prewarm:
+            serving.prewarm_in_background()
+        run_flask(options)
+    else:
+        import webview
+        flask_thread = threading.Thread(target=run_flask, args=(options,), daemon=True)
+        flask_thread.start()
+        webview.create_window("Twitch Analytics App", f"http://127.0.0.1:{options['port']}", width=1200, height=800)
+        # Prewarm runs on pywebview's worker thread once the window is shown
+        webview.start(serving.prewarm if args.prewarm else None)
@@ -1,6 +1,10 @@
 import os
-from flask import Flask, render_template
+from datetime import date, timedelta
+import click
+from flask import Flask, Response, render_template
 from extensions import db
+import serving
+from services.metrics import counting_engine_options, metrics
 
 app = Flask(__name__)
 
@@ -8,26 +12,192 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///twitch_data.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')  # Change for production
+app.config.setdefault('REPORT_JOB_WORKERS', 2)
+# Supporters kept per leaderboard scope; unset keeps exact counts for everyone
+leaderboard_capacity = os.environ.get('APP_LEADERBOARD_CAPACITY')
+app.config.setdefault('LEADERBOARD_CAPACITY', int(leaderboard_capacity) if leaderboard_capacity else None)
+# Streams older than this many days are moved to the archive on start; unset keeps every hour in the database
+retention_days = os.environ.get('APP_RETENTION_DAYS')
+app.config.setdefault('RETENTION_DAYS', int(retention_days) if retention_days else None)
+# Processes rendering bulk PDF exports; 0 renders them in the request thread
+export_workers = os.environ.get('APP_EXPORT_WORKERS')
+app.config.setdefault('EXPORT_WORKERS', int(export_workers) if export_workers else os.cpu_count() or 1)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = counting_engine_options(serving.engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'], serving.threads_setting(), app.config['REPORT_JOB_WORKERS'],
+), app.config['SQLALCHEMY_DATABASE_URI'])
 
 db.init_app(app)
+with app.app_context():
+    serving.tune_sqlite(db.engine)
+metrics.init_app(app)
 
 import models  # Import models after db.init_app(app)
-from routes.analytics import analytics_bp  # Import blueprints after models
+import migrations
+from services.chart_cache import chart_cache
+chart_cache.init_app(app)
+from services.response_cache import response_cache
+response_cache.init_app(app)
+from services import periods
+from services.periods import report_data
+report_data.init_app(app)
+from services.jobs import report_jobs
+report_jobs.init_app(app)
+from services.archive import archive
+archive.init_app(app)
+from services.bulk_export import exporter
+exporter.init_app(app)
+from routes.analytics import analytics_bp, home  # Import blueprints after models
 
 # Register a named route for the homepage so url_for('home') works everywhere
-@app.route('/')
-def home():
-    from models import Stream
-    streams = Stream.query.order_by(Stream.date.desc()).all()
-    return render_template('home.html', streams=streams)
+app.add_url_rule('/', 'home', home)
 
 app.register_blueprint(analytics_bp)  # No url_prefix
 
+def init_db():
+    # Create tables and bring older twitch_data.db files up to the current schema
+    with app.app_context():
+        migrations.upgrade()
+        if app.config['RETENTION_DAYS'] is not None:
+            archive.compact(date.today() - timedelta(days=app.config['RETENTION_DAYS']))
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    init_db()
+    print(f'Database schema at version {len(migrations.MIGRATIONS)}')
+
+@app.cli.command('import-stats')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json', 'jsonl']), help='Defaults to the file extension or content.')
+def import_stats_command(path, fmt):
+    """Bulk import hourly stats from a CSV, JSON or JSON lines file."""
+    from services import data_insertion
+    init_db()
+    with app.app_context(), open(path, 'rb') as f:
+        result = data_insertion.import_file(
+            f, fmt=fmt, filename=path,
+            progress=lambda r: click.echo(f'{r.imported} rows imported, {r.failed} rejected', err=True),
+        )
+    for error in result.errors:
+        click.echo(f"row {error['row']}: {error['error']}", err=True)
+    if result.errors and result.failed > len(result.errors):
+        click.echo(f'... and {result.failed - len(result.errors)} more rejected rows', err=True)
+    click.echo(f'Imported {result.imported} rows ({result.streams_created} new streams), rejected {result.failed}')
+    if result.aborted:
+        raise click.ClickException(f'Import stopped early: {result.aborted}')
+
+@app.cli.command('ingest')
+@click.argument('path', required=False, type=click.Path(dir_okay=False))
+@click.option('--follow', is_flag=True, help='Keep reading the file as it grows.')
+@click.option('--websocket', metavar='HOST:PORT', help='Receive events on a local WebSocket instead of reading a file.')
+@click.option('--stream-id', type=int, help='Stream of events without a stream_id; by default one stream per event date.')
+@click.option('--flush-interval', type=float, default=5.0, show_default=True, help='Seconds between batched writes.')
+@click.option('--name', help='Checkpoint name; defaults to the source.')
+def ingest_command(path, follow, websocket, stream_id, flush_interval, name):
+    """Aggregate live events into hourly stats, resuming from the last checkpoint."""
+    import asyncio
+    import signal
+    from services import ingestion
+    if bool(path) == bool(websocket):
+        raise click.UsageError('Give either a JSON lines file or --websocket')
+    if websocket:
+        host, _, port = websocket.rpartition(':')
+        source = ingestion.WebSocketSource(host or '127.0.0.1', int(port))
+    else:
+        source = ingestion.JsonLinesSource(path, follow=follow)
+    init_db()
+    ingestor = ingestion.Ingestor(
+        app, source, name=name, stream_id=stream_id, flush_interval=flush_interval,
+        progress=lambda stats: click.echo(f'{stats.events} events, {stats.rows} hours written', err=True),
+    )
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, ingestor.stop)
+        return await ingestor.run()
+
+    stats = asyncio.run(run())
+    click.echo(f'Ingested {stats.events} events into {stats.rows} hours in {stats.flushes} transactions '
+               f'({stats.invalid} invalid, {stats.late} late)')
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Regenerate the rollup tables from the hourly stats and the leaderboards from the support events."""
+    from services import leaderboards, rollups
+    init_db()
+    with app.app_context():
+        streams, periods = rollups.rebuild()
+        supporters = leaderboards.rebuild()
+        db.session.commit()
+    click.echo(f'Rebuilt {streams} stream and {periods} period rollups and {supporters} leaderboard rows')
+
+@app.cli.command('compact')
+@click.option('--days', type=click.IntRange(min=0), help='Archive streams older than this many days; defaults to $APP_RETENTION_DAYS.')
+@click.option('--vacuum', is_flag=True, help='Shrink the database file afterwards.')
+def compact_command(days, vacuum):
+    """Move the hourly stats of old streams into the monthly archive files."""
+    days = days if days is not None else app.config['RETENTION_DAYS']
+    if days is None:
+        raise click.UsageError('Give --days or set APP_RETENTION_DAYS')
+    init_db()
+    with app.app_context():
+        streams, hours = archive.compact(
+            date.today() - timedelta(days=days),
+            progress=lambda streams, hours: click.echo(f'{hours} hours of {streams} streams archived', err=True),
+        )
+        if vacuum:
+            with db.engine.connect() as connection:
+                connection.exec_driver_sql('VACUUM')
+    click.echo(f'Archived {hours} hours of {streams} streams older than {days} days')
+
+@app.cli.command('export-reports')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--period', 'name', type=click.Choice(periods.NAMES), default=periods.CUSTOM, show_default=True)
+@click.option('--start', help='First stream date of a custom range (YYYY-MM-DD).')
+@click.option('--end', help='Last stream date of a custom range (YYYY-MM-DD).')
+@click.option('--workers', type=click.IntRange(min=0), help='Rendering processes; defaults to $APP_EXPORT_WORKERS or the CPU count, 0 renders in this process.')
+def export_reports_command(output, name, start, end, workers):
+    """Write the PDF report of every stream dated in a period into one ZIP file."""
+    from services import bulk_export
+    try:
+        period = periods.resolve(name, start, end)
+    except ValueError as error:
+        raise click.UsageError(str(error))
+    init_db()
+    selected = bulk_export.BulkExporter(workers) if workers is not None else exporter
+    with app.app_context(), open(output, 'wb') as f:
+        try:
+            for chunk in selected.zip_chunks(
+                period, progress=lambda done, total: click.echo(f'{done} of {total} stream reports written', err=True),
+            ):
+                f.write(chunk)
+        finally:
+            selected.shutdown()
+    click.echo(f'Wrote {output} with the stream reports from {period.subtitle}')
+
+@app.cli.command('serve')
+@click.option('--server', type=click.Choice(serving.SERVERS), help=f'Defaults to $APP_SERVER or {serving.DEFAULT_SERVER}.')
+@click.option('--threads', type=click.IntRange(min=1), help=f'Worker threads, defaults to $APP_THREADS or {serving.DEFAULT_THREADS}.')
+@click.option('--host', help=f'Defaults to $APP_HOST or {serving.DEFAULT_HOST}.')
+@click.option('--port', type=int, help=f'Defaults to $APP_PORT or {serving.DEFAULT_PORT}.')
+@click.option('--prewarm/--no-prewarm', default=True, help='Load the chart and PDF modules in the background at start.')
+def serve_command(server, threads, host, port, prewarm):
+    """Serve the app headless with a production WSGI server."""
+    init_db()
+    if prewarm:
+        serving.prewarm_in_background()
+    serving.serve(app, server, threads, host, port)
+
 # Health check route for production readiness
 @app.route('/health')
 def health():
     return 'OK', 200
 
+# Prometheus scrape endpoint: per-route latency, response size, SQL and render timings
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Custom error handler for user-friendly error messages
 @app.errorhandler(500)
 def internal_error(error):
@@ -38,7 +208,6 @@ def not_found_error(error):
     return render_template('404.html'), 404
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
+    init_db()
     # Set debug=False for production
     app.run(debug=True)
\ No newline at end of file
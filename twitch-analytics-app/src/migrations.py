@@ -0,0 +1,138 @@
+from sqlalchemy import inspect, select, text
+
+from extensions import db
+from models import HourlyStat, PeriodRollup, Stream, StreamRollup
+from services import events, leaderboards, rollups, timebuckets
+
+# Schema migrations for existing SQLite databases. Each step runs once, in order;
+# the number of applied steps is stored in SQLite's PRAGMA user_version.
+
+BACKFILL_BATCH = 5000
+
+
+def backfill_support_events():
+    # Split the legacy comma/semicolon text columns into SupportEvent rows
+    rows = (
+        db.session.query(
+            HourlyStat.id, HourlyStat.stream_id, HourlyStat.started_at, HourlyStat.created_at,
+            HourlyStat.subs, HourlyStat.donations, HourlyStat.sub_donations, HourlyStat.bit_donations,
+        )
+        .order_by(HourlyStat.id)
+        .execution_options(yield_per=BACKFILL_BATCH)
+    )
+    batch = []
+    for row in rows:
+        batch.extend(events.event_mappings(row))
+        if len(batch) >= BACKFILL_BATCH:
+            events.bulk_insert_events(batch)
+            batch = []
+    events.bulk_insert_events(batch)
+
+
+def add_column(table, name, ddl):
+    # ALTER TABLE only when create_all() has not already built the column
+    columns = {column['name'] for column in inspect(db.session.connection()).get_columns(table)}
+    if name not in columns:
+        db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+        return True
+    return False
+
+
+def add_hourly_stat_updated_at():
+    if add_column('hourly_stat', 'updated_at', 'DATETIME'):
+        db.session.execute(text('UPDATE hourly_stat SET updated_at = created_at'))
+
+
+def create_indexes():
+    # Build any index declared on the models that an older database is missing
+    connection = db.session.connection()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    db.session.execute(text('ANALYZE'))
+
+
+def build_rollups():
+    # Older databases have hourly stats but no rollup rows yet
+    rollups.rebuild()
+
+
+def build_leaderboards():
+    leaderboards.rebuild()
+
+
+def add_started_at():
+    # Typed start time of every hour, parsed from its stream's date and hour label.
+    # Idempotent; only rows without one are filled in.
+    add_column('hourly_stat', 'started_at', 'DATETIME')
+    add_column('support_event', 'started_at', 'DATETIME')
+    # In id order, so each stream is anchored on its first recorded hour
+    starts = timebuckets.HourStarts()
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(HourlyStat.id, HourlyStat.stream_id, Stream.date, HourlyStat.hour, HourlyStat.created_at)
+            .outerjoin(Stream, Stream.id == HourlyStat.stream_id)
+            .where(HourlyStat.started_at.is_(None), HourlyStat.id > last_id)
+            .order_by(HourlyStat.id)
+            .limit(BACKFILL_BATCH)
+        ).all()
+        if not rows:
+            break
+        updates = []
+        for stat_id, stream_id, stream_date, hour, created_at in rows:
+            start = starts.start(stream_id, stream_date, hour) if stream_date else created_at  # Orphaned rows keep their write time
+            if start is not None:
+                updates.append((start.isoformat(sep=' ', timespec='microseconds'), stat_id))  # As SQLAlchemy stores it
+        # Plain SQL: the ORM would also bump updated_at, which databases this old may not have yet
+        db.session.connection().exec_driver_sql('UPDATE hourly_stat SET started_at = ? WHERE id = ?', updates)
+        last_id = rows[-1][0]
+    db.session.execute(text(
+        'UPDATE support_event SET started_at = '
+        '(SELECT started_at FROM hourly_stat WHERE hourly_stat.id = support_event.hourly_stat_id) '
+        'WHERE started_at IS NULL'
+    ))
+
+
+def order_by_started_at():
+    # Periods, leaderboards and rollups move from created_at and hour labels to started_at
+    add_started_at()
+    for name in ('ix_hourly_stat_stream_hour', 'ix_hourly_stat_created_at', 'ix_support_event_kind_created_at'):
+        db.session.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    # Rollup rows gained the started_at of their edge hours; they are rebuilt from scratch
+    connection = db.session.connection()
+    for model in (StreamRollup, PeriodRollup):
+        model.__table__.drop(connection, checkfirst=True)
+        model.__table__.create(connection)
+    create_indexes()
+    build_rollups()
+    build_leaderboards()
+
+
+MIGRATIONS = [
+    backfill_support_events,
+    add_hourly_stat_updated_at,
+    create_indexes,
+    build_rollups,
+    build_leaderboards,
+    order_by_started_at,
+]
+
+
+def schema_version():
+    return db.session.execute(text('PRAGMA user_version')).scalar()
+
+
+def upgrade():
+    """Create missing tables and apply pending migration steps. Safe to call on every start."""
+    db.create_all()
+    version = schema_version()
+    if version < MIGRATIONS.index(order_by_started_at):
+        # The earlier steps run against today's models, which read started_at
+        add_started_at()
+    for number, step in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        step()
+        db.session.execute(text(f'PRAGMA user_version = {number}'))
+        db.session.commit()
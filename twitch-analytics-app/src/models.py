@@ -8,6 +8,10 @@ class Stream(db.Model):
     streamer = db.Column(db.String(100), nullable=False, default="Da1lyVitamin")
     hourly_stats = db.relationship('HourlyStat', backref='stream', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_stream_date', 'date'),
+    )
+
 class HourlyStat(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     stream_id = db.Column(db.Integer, db.ForeignKey('stream.id'), nullable=False)
@@ -18,4 +22,84 @@ class HourlyStat(db.Model):
     donations = db.Column(db.Text, nullable=True)
     sub_donations = db.Column(db.Text, nullable=True)
     bit_donations = db.Column(db.Text, nullable=True)  # username:amount;username:amount
+    # When the hour began: the stream's date plus the hour label, see services/timebuckets.py.
+    # Reports, rollups and charts select and order hours by it; created_at is when the row was written.
+    started_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_hourly_stat_stream_started_at', 'stream_id', 'started_at'),
+        db.Index('ix_hourly_stat_started_at', 'started_at'),
+    )
+
+class SupportEvent(db.Model):
+    # One row per sub, donation, gifted sub or bit donation parsed out of an HourlyStat
+    id = db.Column(db.Integer, primary_key=True)
+    stream_id = db.Column(db.Integer, db.ForeignKey('stream.id'), nullable=False)
+    hourly_stat_id = db.Column(db.Integer, db.ForeignKey('hourly_stat.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # sub, donation, sub_donation, bit
+    username = db.Column(db.String(100), nullable=False)
+    amount = db.Column(db.Integer, nullable=False, default=1)  # bits for bit events, 1 otherwise
+    started_at = db.Column(db.DateTime, nullable=True)  # Copied from the hourly stat
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_support_event_stream_kind_username', 'stream_id', 'kind', 'username'),
+        db.Index('ix_support_event_kind_started_at', 'kind', 'started_at'),
+    )
+
+class ViewerRollup:
+    # Running viewer statistics for a set of hourly stats, kept current by services/rollups.py
+    count = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Integer, nullable=False)
+    mean = db.Column(db.Float, nullable=False)
+    m2 = db.Column(db.Float, nullable=False)  # Welford sum of squared deviations from the mean
+    minimum = db.Column(db.Integer, nullable=False)
+    maximum = db.Column(db.Integer, nullable=False)
+    low_hour = db.Column(db.String(20), nullable=False)
+    peak_hour = db.Column(db.String(20), nullable=False)
+    first_hour = db.Column(db.String(20), nullable=False)
+    first_viewers = db.Column(db.Integer, nullable=False)
+    last_hour = db.Column(db.String(20), nullable=False)
+    last_viewers = db.Column(db.Integer, nullable=False)
+    # started_at of the hours above, which order them
+    low_at = db.Column(db.DateTime, nullable=False)
+    peak_at = db.Column(db.DateTime, nullable=False)
+    first_at = db.Column(db.DateTime, nullable=False)
+    last_at = db.Column(db.DateTime, nullable=False)
+    total_followers = db.Column(db.Integer, nullable=False)
+
+class StreamRollup(ViewerRollup, db.Model):
+    stream_id = db.Column(db.Integer, db.ForeignKey('stream.id'), primary_key=True)
+
+class PeriodRollup(ViewerRollup, db.Model):
+    # Hourly stats by the calendar day, week (Monday start) or month of their started_at
+    kind = db.Column(db.String(10), primary_key=True)  # day, week, month
+    start = db.Column(db.Date, primary_key=True)
+
+class SupporterTotal(db.Model):
+    # Events and amount per supporter, event kind and scope, kept current by services/leaderboards.py
+    scope = db.Column(db.String(30), primary_key=True)  # all, stream:<id>, day:/week:/month:<start date>
+    kind = db.Column(db.String(20), primary_key=True)  # sub, donation, sub_donation, bit
+    username = db.Column(db.String(100), primary_key=True)
+    events = db.Column(db.Integer, nullable=False)
+    amount = db.Column(db.Integer, nullable=False)
+    error = db.Column(db.Integer, nullable=False, default=0)  # Space-Saving overcount bound; 0 when exact
+
+    __table_args__ = (
+        db.Index('ix_supporter_total_rank', 'scope', 'kind', 'amount'),
+    )
+
+class ArchivePartition(db.Model):
+    # Hours of archived streams that started in one calendar month, stored as files by services/archive.py
+    month = db.Column(db.Date, primary_key=True)  # First day of the month
+    path = db.Column(db.String(100), nullable=False)  # Directory under ARCHIVE_DIR, a new one for every rewrite
+    rows = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class IngestCheckpoint(db.Model):
+    # Last applied position of a live ingestion source and its open hour buckets, saved with each flush
+    source = db.Column(db.String(200), primary_key=True)
+    state = db.Column(db.Text, nullable=False)  # JSON, see services/ingestion.py
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
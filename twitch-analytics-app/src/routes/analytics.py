@@ -1,32 +1,103 @@
-from flask import Blueprint, render_template, request, redirect, url_for, send_file, make_response, flash
-from models import Stream, HourlyStat
+from flask import Blueprint, render_template, request, redirect, url_for, send_file, make_response, flash, jsonify, abort, Response, stream_with_context
+from models import Stream, HourlyStat, SupportEvent
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from extensions import db
-from datetime import datetime, date
-from fpdf import FPDF
+from datetime import datetime, date, timedelta
+import hashlib
 import io
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import base64
-import numpy as np
+import json
+from services import aggregation, data_insertion, events, jobs, leaderboards, periods, rollups, timebuckets, timeseries
+from services.archive import Scope, archive, merged, stream_scope as archived_stream
+from services.jobs import report_jobs
+from services.chart_cache import chart_cache, period_scope, stream_scope
+from services.response_cache import response_cache
+from services.metrics import metrics
 
 analytics_bp = Blueprint('analytics', __name__)
 
+# services.charts (matplotlib, numpy) and services.report_generation (fpdf) are
+# imported inside the functions that need them, so the app starts without the
+# plotting stack; serving.prewarm() loads it in the background.
+
+HOME_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def stream_cursor(row):
+    return f'{row.date.isoformat()}_{row.id}'
+
+def parse_stream_cursor(cursor):
+    if not cursor:
+        return None
+    stream_date, _, stream_id = cursor.partition('_')
+    try:
+        return date.fromisoformat(stream_date), int(stream_id)
+    except ValueError:
+        abort(400)
+
+def stream_listing(limit):
+    # One extra row tells whether another page follows
+    rows = aggregation.stream_page(limit + 1, parse_stream_cursor(request.args.get('after')))
+    next_cursor = stream_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
 @analytics_bp.route('/')
 def home():
-    streams = Stream.query.order_by(Stream.date.desc()).all()
-    return render_template('home.html', streams=streams)
+    streams, next_cursor = stream_listing(HOME_PAGE_SIZE)
+    return render_template(
+        'home.html', streams=streams,
+        next_page_url=url_for('analytics.home', after=next_cursor) if next_cursor else None,
+        next_json_url=url_for('analytics.stream_list', after=next_cursor) if next_cursor else None,
+    )
+
+@analytics_bp.route('/streams')
+def stream_list():
+    # JSON pages of the home page listing for infinite scroll
+    limit = request.args.get('limit', HOME_PAGE_SIZE, type=int)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        abort(400)
+    streams, next_cursor = stream_listing(limit)
+    return jsonify({
+        'streams': [{
+            'id': row.id,
+            'date': row.date.isoformat(),
+            'title': row.title,
+            'streamer': row.streamer,
+            'hours': row.hours,
+            'peak_viewers': row.peak_viewers,
+            'total_followers': row.total_followers,
+            'url': url_for('analytics.stream', stream_id=row.id),
+        } for row in streams],
+        'next': url_for('analytics.stream_list', after=next_cursor, limit=limit) if next_cursor else None,
+    })
 
 @analytics_bp.route('/clear_streams', methods=['POST'])
 def clear_streams():
+    rollups.clear()
+    leaderboards.clear()
+    archived = archive.clear()
+    SupportEvent.query.delete()
     HourlyStat.query.delete()
     Stream.query.delete()
     db.session.commit()
+    archive.remove(archived)
+    chart_cache.invalidate()  # Stream and hour ids can be reused, and with them data fingerprints
+    response_cache.clear()  # Stream ids can be reused after this
     return redirect(url_for('analytics.home'))
 
+@analytics_bp.route('/import', methods=['POST'])
+def import_stats():
+    # Bulk upload of hourly stats as CSV, a JSON array or JSON lines (multipart field "file")
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'error': 'No file uploaded'}), 400
+    fmt = request.form.get('format') or None
+    if fmt is not None and fmt not in data_insertion.FORMATS:
+        return jsonify({'error': f'Unknown format {fmt!r}'}), 400
+    result = data_insertion.import_file(upload.stream, fmt=fmt, filename=upload.filename)
+    return jsonify(result.to_dict()), 400 if result.aborted else 200
+
 @analytics_bp.route('/stream/new', methods=['GET', 'POST'])
 def new_stream():
     if request.method == 'POST':
@@ -53,262 +124,347 @@ def stream(stream_id):
         bit_donations = request.form.getlist('bit_donations_usernames[]')
         bit_amounts = request.form.getlist('bit_donations_amounts[]')
         # Store as JSON string or comma-separated for simplicity
+        starts = timebuckets.HourStarts()
+        starts.load([stream.id])
         stat = HourlyStat(
-            stream_id=stream.id, hour=hour, viewers=viewers, followers=followers,
+            stream_id=stream.id, hour=hour, started_at=starts.start(stream.id, stream.date, hour), viewers=viewers, followers=followers,
             subs=",".join(subs), donations=",".join(donations),
             sub_donations=",".join(sub_donations),
             bit_donations=";".join([f"{u}:{a}" for u, a in zip(bit_donations, bit_amounts)])
         )
         db.session.add(stat)
+        db.session.flush()  # Assigns stat.id for the normalized event rows
+        mappings = events.event_mappings(stat)
+        events.bulk_insert_events(mappings)
+        leaderboards.record(mappings)
+        rollups.record([stat])
         db.session.commit()
         return redirect(url_for('analytics.home'))  # Go to home after submit
-    stats = HourlyStat.query.filter_by(stream_id=stream.id).order_by(HourlyStat.hour).all()
-    # Calculate totals
-    total_viewers = sum(s.viewers for s in stats)
-    total_followers = sum(s.followers for s in stats)
-    # ...add more totals as needed...
-    return render_template('stream.html', stream=stream, stats=stats, total_viewers=total_viewers, total_followers=total_followers)
+
+    def render():
+        stats = stream_stats(stream)
+        # Totals come from the stream's rollup row instead of summing every hour
+        rollup = rollups.stream_rollup(stream.id)
+        total_viewers = rollup.total if rollup else 0
+        total_followers = rollup.total_followers if rollup else 0
+        return render_template('stream.html', stream=stream, stats=stats, total_viewers=total_viewers, total_followers=total_followers)
+
+    return stream_response('stream', stream, render)
+
+def stream_stats(stream):
+    # The stream's hours in time order, archived ones included
+    live = HourlyStat.query.filter_by(stream_id=stream.id).order_by(HourlyStat.started_at, HourlyStat.id)
+    return list(merged(live, archive.rows(archived_stream(stream))))
+
+def stream_fingerprint(stream):
+    return aggregation.fingerprint(HourlyStat.stream_id == stream.id) + archive.version(archived_stream(stream))
+
+def stream_response(view, stream, build, **response_args):
+    # Rendered once per version of the stream and its hours; clients holding that version get a 304
+    fingerprint = stream_fingerprint(stream)
+    version = (stream.date, stream.title, stream.streamer) + fingerprint
+    last_modified = fingerprint[3]  # Latest updated_at
+    return response_cache.respond((view, stream.id), version, last_modified, build, **response_args)
+
+def request_period(name):
+    # Period named by a route or form, with start/end arguments for custom ranges
+    try:
+        period = periods.resolve(name, request.values.get('start'), request.values.get('end'))
+    except ValueError as error:
+        abort(400, str(error))
+    if period is None:
+        abort(404)
+    return period
+
+def period_args(period):
+    # url_for() arguments that select period again
+    if period.name == periods.CUSTOM:
+        return {'period': period.name, 'start': period.start.isoformat(), 'end': period.last_day.isoformat()}
+    return {'period': period.name}
+
+def cached_chart(kind, scope, *criteria, archived=None):
+    # Rendered PNG for the rows matching criteria (and the archived hours in scope archived), reused until those rows change
+    from services import charts
+
+    def render():
+        _, hours, columns = timeseries.load(*criteria, by_time=False, archived=archived)
+        with metrics.phase('chart'):
+            return charts.render(kind, hours, columns['viewers'])
+
+    return chart_cache.get_or_render(kind, scope, aggregation.fingerprint(*criteria) + archive.version(archived), render)
 
 @analytics_bp.route('/reports', methods=['GET', 'POST'])
 def reports():
     stats = []
-    period = ''
-    chart = None
+    trend = []
+    period = None
     analysis_text = ""
     if request.method == 'POST':
-        period = request.form['period']
-        today = date.today()
-        if period == 'day':
-            stats = HourlyStat.query.filter(HourlyStat.created_at >= today).all()
-        elif period == 'week':
-            week_ago = today.fromordinal(today.toordinal() - 7)
-            stats = HourlyStat.query.filter(HourlyStat.created_at >= week_ago).all()
-        elif period == 'month':
-            month_ago = today.replace(day=1)
-            stats = HourlyStat.query.filter(HourlyStat.created_at >= month_ago).all()
-        elif period == 'year':
-            year_ago = today.replace(month=1, day=1)
-            stats = HourlyStat.query.filter(HourlyStat.created_at >= year_ago).all()
-        # Generate chart
-        if stats:
-            hours = [s.hour for s in stats]
-            viewers = [s.viewers for s in stats]
-            plt.figure(figsize=(8, 4))
-            plt.plot(hours, viewers, marker='o')
-            plt.title('Viewers Over Time')
-            plt.xlabel('Hour')
-            plt.ylabel('Viewers')
-            plt.tight_layout()
-            img = io.BytesIO()
-            plt.savefig(img, format='png')
-            img.seek(0)
-            chart = base64.b64encode(img.getvalue()).decode()
-            plt.close()
+        period = request_period(request.form['period'])
+        data = periods.report_data.get(period)
+        summary = data.summary
+        # The chart is drawn client-side from reports_series
+        if summary:
+            stats = data.rows
+            trend = [(timebuckets.label(bucket.start, period.unit), bucket) for bucket in data.buckets]
             # Example analysis
-            avg_viewers = sum(viewers) / len(viewers)
-            analysis_text = f"Average viewers: {avg_viewers:.2f}. " \
-                            f"Peak viewers: {max(viewers)} at {hours[viewers.index(max(viewers))]}."
-    return render_template('reports.html', stats=stats, period=period, chart=chart, analysis_text=analysis_text)
+            analysis_text = f"Average viewers: {summary.average:.2f}. " \
+                            f"Peak viewers: {summary.maximum} at {summary.peak_hour}."
+    return render_template(
+        'reports.html', stats=stats, trend=trend, period=period, analysis_text=analysis_text,
+        period_names=periods.NAMES, period_labels=periods.LABELS, period_args=period_args(period) if period else {},
+    )
+
+# Event kind -> leaderboard heading, in page order
+LEADERBOARD_KINDS = {
+    'sub': 'Top Subscribers',
+    'sub_donation': 'Top Gifters',
+    'bit': 'Top Bit Donors',
+    'donation': 'Top Donors',
+}
+# Custom ranges are reachable with ?period=custom&start=&end= but not offered in the menu
+LEADERBOARD_PERIODS = periods.FIXED + tuple(periods.ROLLING) + ('all',)
+LEADERBOARD_LABELS = dict(periods.LABELS, all='All Time')
+LEADERBOARD_SIZE = 10
+
+@analytics_bp.route('/leaderboards')
+def leaderboard():
+    # Per stream with ?stream_id=<id>, otherwise for ?period= (default this month)
+    stream_id = request.args.get('stream_id', type=int)
+    period = request.args.get('period', 'month')
+    stream = None
+    if stream_id is not None:
+        stream = Stream.query.get_or_404(stream_id)
+        boards = {kind: leaderboards.stream_top(stream.id, kind, LEADERBOARD_SIZE) for kind in LEADERBOARD_KINDS}
+    elif period == 'all':
+        boards = {kind: leaderboards.top(kind, leaderboards.ALL_TIME, LEADERBOARD_SIZE) for kind in LEADERBOARD_KINDS}
+    else:
+        selected = request_period(period)
+        boards = {
+            kind: leaderboards.top_since(kind, selected.start, LEADERBOARD_SIZE, end=selected.end) for kind in LEADERBOARD_KINDS
+        }
+    return render_template(
+        'leaderboards.html', boards=boards, titles=LEADERBOARD_KINDS, periods=LEADERBOARD_PERIODS, labels=LEADERBOARD_LABELS,
+        period=period, stream=stream, approximate=leaderboards.capacity() is not None,
+    )
 
 @analytics_bp.route('/stream/<int:stream_id>/pdf_preview')
 def stream_pdf_preview(stream_id):
     stream = Stream.query.get_or_404(stream_id)
-    stats = HourlyStat.query.filter_by(stream_id=stream.id).order_by(HourlyStat.hour).all()
-    # Generate chart for preview
-    chart = None
-    if stats:
-        hours = [s.hour for s in stats]
-        viewers = [s.viewers for s in stats]
-        plt.figure(figsize=(8, 4))
-        plt.plot(hours, viewers, marker='o')
-        plt.title('Viewers Over Time')
-        plt.xlabel('Hour')
-        plt.ylabel('Viewers')
-        plt.tight_layout()
-        img = io.BytesIO()
-        plt.savefig(img, format='png')
-        img.seek(0)
-        chart = base64.b64encode(img.getvalue()).decode()
-        plt.close()
-    return render_template('stream_pdf_preview.html', stream=stream, stats=stats, chart=chart)
+
+    def render():
+        stats = stream_stats(stream)
+        # The chart is drawn client-side from stream_series
+        return render_template('stream_pdf_preview.html', stream=stream, stats=stats)
+
+    return stream_response('stream_pdf_preview', stream, render)
+
+def series_response(scope, criteria, by_time=True, span=None, archived=None):
+    # Downsampled viewer and follower series as JSON, with ETags like the pages that show them.
+    # ?resolution=<points per line>&method=lttb|minmax; ?from=&to= (in x units) zooms in.
+    # Time series take ?unit=hour|day|week|month for calendar buckets, or unit=auto for
+    # every hour while the range (span ms without from/to) holds no more than resolution.
+    resolution = request.args.get('resolution', timeseries.DEFAULT_RESOLUTION, type=int)
+    resolution = min(max(resolution, 3), timeseries.MAX_RESOLUTION)
+    method = request.args.get('method', 'lttb')
+    if method not in timeseries.METHODS:
+        abort(400, f'Unknown method {method!r}')
+    start = request.args.get('from', type=int)
+    end = request.args.get('to', type=int)
+    unit = request.args.get('unit') if by_time else None
+    if unit == 'auto':
+        unit = timeseries.auto_unit(end - start if start is not None and end is not None else span, resolution)
+    elif unit is not None and unit not in timebuckets.UNITS:
+        abort(400, f'Unknown unit {unit!r}')
+
+    def build():
+        if unit is None:
+            xs, labels, columns = timeseries.load(*criteria, by_time=by_time, start=start, end=end, archived=archived)
+        else:
+            xs, labels, columns = timeseries.load_buckets(unit, *criteria, start=start, end=end, archived=archived)
+        with metrics.phase('downsample'):
+            return json.dumps(timeseries.payload(xs, labels, columns, resolution, method, unit), separators=(',', ':'))
+
+    return response_cache.respond(
+        ('series', scope, resolution, method, start, end, unit), aggregation.fingerprint(*criteria) + archive.version(archived), None, build,
+        mimetype='application/json',
+    )
+
+@analytics_bp.route('/stream/<int:stream_id>/series')
+def stream_series(stream_id):
+    stream = Stream.query.get_or_404(stream_id)
+    return series_response(stream_scope(stream.id), (HourlyStat.stream_id == stream.id,), by_time=False, archived=archived_stream(stream))
+
+@analytics_bp.route('/reports/series/<period>')
+def reports_series(period):
+    period = request_period(period)
+    span = ((period.end or date.today() + timedelta(days=1)) - period.start).total_seconds() * 1000
+    return series_response(period_scope(period.name, period.key), period.criteria, span=span, archived=period.archived)
+
+def compared_streams():
+    # Streams named by ?stream_id= (repeatable), otherwise those dated in ?period= (default last 30 days)
+    from services import comparison
+    stream_ids = request.args.getlist('stream_id', type=int)
+    if stream_ids:
+        return comparison.streams(Stream.id.in_(stream_ids))
+    return comparison.streams(*request_period(request.args.get('period', 'last_30_days')).stream_criteria)
+
+@analytics_bp.route('/compare/data')
+def compare_data():
+    from services import comparison
+    return jsonify(comparison.payload(comparison.compare(compared_streams())))
+
+@analytics_bp.route('/compare/chart')
+def compare_chart():
+    from services import charts, comparison
+    selected = compared_streams()
+    ids = [stream.id for stream in selected]
+    archived = Scope(selected[0].date, selected[-1].date + timedelta(days=2)) if selected else None
+    fingerprint = aggregation.fingerprint(HourlyStat.stream_id.in_(ids)) + archive.version(archived)
+    scope = 'compare:' + hashlib.sha1(','.join(map(str, ids)).encode()).hexdigest()[:16]
+
+    def render():
+        with metrics.phase('chart'):
+            return charts.comparison_chart(comparison.compare(selected))
+
+    return Response(chart_cache.get_or_render('compare', scope, fingerprint, render), mimetype='image/png')
+
+# Everything but a single day spans several streams; those reports are paginated per
+# stream and streamed to the client page by page
+def streamed(period):
+    return period.name != 'day'
+
+def period_pdf_response(period, disposition, filename, with_chart=False):
+    if streamed(period):
+        response = Response(stream_with_context(period_report_chunks(period, with_chart)), mimetype='application/pdf')
+    else:
+        response = make_response(build_period_report(period, with_chart))
+        response.headers['Content-Type'] = 'application/pdf'
+    response.headers.set('Content-Disposition', disposition, filename=filename)
+    return response
 
 @analytics_bp.route('/reports/pdf/<period>')
 def reports_pdf(period):
-    stats = []
-    today = date.today()
-    if period == 'day':
-        stats = HourlyStat.query.filter(HourlyStat.created_at >= today).all()
-    elif period == 'week':
-        week_ago = today.fromordinal(today.toordinal() - 7)
-        stats = HourlyStat.query.filter(HourlyStat.created_at >= week_ago).all()
-    elif period == 'month':
-        month_ago = today.replace(day=1)
-        stats = HourlyStat.query.filter(HourlyStat.created_at >= month_ago).all()
-    elif period == 'year':
-        year_ago = today.replace(month=1, day=1)
-        stats = HourlyStat.query.filter(HourlyStat.created_at >= year_ago).all()
-    # Generate PDF
-    pdf = generate_report_pdf(stats, period)
-    response = make_response(pdf.output(dest='S').encode('latin1'))
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename="{period}_report.pdf"'
-    return response
+    return period_pdf_response(request_period(period), 'attachment', f'{period}_report.pdf')
 
 @analytics_bp.route('/reports/pdf_preview/<period>')
 def reports_pdf_preview(period):
-    today = date.today()
-    if period == 'day':
-        stats = HourlyStat.query.filter(HourlyStat.created_at >= today).all()
-    elif period == 'week':
-        week_ago = today.fromordinal(today.toordinal() - 7)
-        stats = HourlyStat.query.filter(HourlyStat.created_at >= week_ago).all()
-    elif period == 'month':
-        month_ago = today.replace(day=1)
-        stats = HourlyStat.query.filter(HourlyStat.created_at >= month_ago).all()
-    elif period == 'year':
-        year_ago = today.replace(month=1, day=1)
-        stats = HourlyStat.query.filter(HourlyStat.created_at >= year_ago).all()
-    else:
-        stats = []
-    chart_img_bytes = None
-    if stats and len(stats) > 0:
-        hours = [s.hour for s in stats]
-        viewers = [s.viewers for s in stats]
-        x = np.arange(len(hours))
-        plt.figure(figsize=(8, 4))
-        plt.bar(x, viewers, color='#9147ff', alpha=0.7, label='Viewers')
-        if len(viewers) > 1:
-            z = np.polyfit(x, viewers, 2)
-            p = np.poly1d(z)
-            plt.plot(x, p(x), color='#00ffe7', linewidth=3, linestyle='-', label='Trend')
-        plt.xticks(x, hours, rotation=45)
-        plt.title('Viewers Per Hour', fontsize=16, fontweight='bold', color='#9147ff')
-        plt.xlabel('Hour', fontsize=12)
-        plt.ylabel('Viewers', fontsize=12)
-        plt.legend()
-        plt.grid(axis='y', alpha=0.3)
-        plt.tight_layout()
-        img = io.BytesIO()
-        plt.savefig(img, format='png', transparent=True)
-        img.seek(0)
-        chart_img_bytes = img.getvalue()
-        plt.close()
-    pdf = generate_report_pdf(stats, period, chart_img_bytes)
-    pdf_output = io.BytesIO()
-    pdf_bytes = pdf.output(dest='S').encode('utf-8')
-    pdf_output.write(pdf_bytes)
-    pdf_output.seek(0)
-    response = make_response(pdf_output.read())
-    response.headers.set('Content-Type', 'application/pdf')
-    response.headers.set('Content-Disposition', 'inline', filename=f'report_{period}_preview.pdf')
-    return response
+    return period_pdf_response(request_period(period), 'inline', f'report_{period}_preview.pdf', with_chart=True)
 
 @analytics_bp.route('/stream/<int:stream_id>/pdf_download')
 def stream_pdf_download(stream_id):
     stream = Stream.query.get_or_404(stream_id)
-    stats = HourlyStat.query.filter_by(stream_id=stream.id).order_by(HourlyStat.hour).all()
+    response = stream_response('stream_pdf_download', stream, lambda: build_stream_report(stream.id), mimetype='application/pdf')
+    response.headers.set('Content-Disposition', 'attachment', filename=f'stream_{stream_id}_report.pdf')
+    return response
+
+@analytics_bp.route('/reports/export/<period>')
+def reports_export(period):
+    # Every stream's own report, rendered in parallel and streamed as one ZIP
+    selected = request_period(period)
+    from services.bulk_export import exporter
+    response = Response(stream_with_context(exporter.zip_chunks(selected)), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename=f'{period}_stream_reports.zip')
+    return response
+
+def period_report_chunks(period, with_chart=False, progress=None):
+    # Summaries are queried up front; table rows of large periods are fetched lazily while pages are written
+    report = progress or (lambda percent, message=None: None)
+    report(10, 'Summarizing stats')
+    data = periods.report_data.get(period)
+    rollup = data.summary
+    stream_summaries = data.stream_summaries if rollup else {}
     chart_img_bytes = None
-    if stats and len(stats) > 0:
-        hours = [s.hour for s in stats]
-        viewers = [s.viewers for s in stats]
-        x = np.arange(len(hours))
-        plt.figure(figsize=(8, 4))
-        plt.bar(x, viewers, color='#9147ff', alpha=0.7, label='Viewers')
-        # Modern smooth trend line
-        if len(viewers) > 1:
-            z = np.polyfit(x, viewers, 2)
-            p = np.poly1d(z)
-            plt.plot(x, p(x), color='#00ffe7', linewidth=3, linestyle='-', label='Trend')
-        plt.xticks(x, hours, rotation=45)
-        plt.title('Viewers Per Hour', fontsize=16, fontweight='bold', color='#9147ff')
-        plt.xlabel('Hour', fontsize=12)
-        plt.ylabel('Viewers', fontsize=12)
-        plt.legend()
-        plt.grid(axis='y', alpha=0.3)
-        plt.tight_layout()
-        img = io.BytesIO()
-        plt.savefig(img, format='png', transparent=True)
-        img.seek(0)
-        chart_img_bytes = img.getvalue()
-        plt.close()
-    pdf = generate_report_pdf(stats, "day", chart_img_bytes)
-    pdf_output = io.BytesIO()
-    pdf_bytes = pdf.output(dest='S').encode('utf-8')
-    pdf_output.write(pdf_bytes)
-    pdf_output.seek(0)
-    return send_file(pdf_output, as_attachment=True, download_name=f'stream_{stream_id}_report.pdf', mimetype='application/pdf')
-
-def generate_report_pdf(stats, period, chart_img_bytes=None):
-    pdf = FPDF()
-    pdf.add_page()
-    # Use Arial for now (closest built-in to Inter for FPDF)
-    pdf.set_font("Arial", size=12)
-    def safe(val):
-        return str(val) if val is not None else "-"
-    if stats and len(stats) > 0:
-        if period == "day":
-            pdf.set_font("Arial", "B", 20)
-            pdf.set_text_color(145, 71, 255)
-            pdf.cell(0, 15, txt="Daily Twitch Analytics Report", ln=True, align='C')
-            pdf.set_text_color(0, 0, 0)
-            pdf.set_font("Arial", size=12)
-            pdf.ln(5)
-            hours = [safe(s.hour) for s in stats]
-            viewers = [s.viewers for s in stats]
-            avg_viewers = sum(viewers) / len(viewers)
-            peak_viewers = max(viewers)
-            peak_hour = hours[viewers.index(peak_viewers)]
-            min_viewers = min(viewers)
-            min_hour = hours[viewers.index(min_viewers)]
-            std_viewers = np.std(viewers)
-            trend = "increasing" if viewers[-1] > viewers[0] else "decreasing" if viewers[-1] < viewers[0] else "stable"
-            summary = (
-                f"Summary:\n"
-                f"- Average viewers: {avg_viewers:.2f}\n"
-                f"- Peak viewers: {peak_viewers} at {peak_hour}\n"
-                f"- Lowest viewers: {min_viewers} at {min_hour}\n"
-                f"- Viewer standard deviation: {std_viewers:.2f}\n"
-                f"- Trend: {trend}\n"
-            )
-            analysis = (
-                "Analysis:\n"
-                f"- The stream started with {viewers[0]} viewers and ended with {viewers[-1]} viewers.\n"
-                f"- The trend for this stream was {trend}.\n"
-                f"- Viewer engagement {'increased' if trend == 'increasing' else 'decreased' if trend == 'decreasing' else 'remained stable'} throughout the session.\n"
-                f"- Recommendation: Focus on content during peak hours ({peak_hour}) and consider engagement strategies for low periods ({min_hour}).\n"
-                f"- Prediction: If current trends continue, next stream may reach a peak of {int(peak_viewers * 1.05)} viewers."
-            )
-            pdf.multi_cell(0, 10, summary)
-            pdf.multi_cell(0, 10, analysis)
-            pdf.ln(5)
-            if chart_img_bytes:
-                chart_path = "chart.png"
-                with open(chart_path, "wb") as f:
-                    f.write(chart_img_bytes)
-                pdf.image(chart_path, x=10, y=pdf.get_y(), w=180)
-                pdf.ln(70)
-                os.remove(chart_path)
-            pdf.set_fill_color(145, 71, 255)
-            pdf.set_text_color(255, 255, 255)
-            pdf.set_font("Arial", "B", 10)
-            headers = ["Hour", "Viewers", "Followers", "Subs", "Donations", "Sub Donos", "Bit Donos"]
-            for h in headers:
-                pdf.cell(28, 10, h, 1, 0, 'C', 1)
-            pdf.ln()
-            pdf.set_font("Arial", size=10)
-            pdf.set_text_color(0, 0, 0)
-            for stat in stats:
-                pdf.cell(28, 10, safe(stat.hour), 1)
-                pdf.cell(28, 10, safe(stat.viewers), 1)
-                pdf.cell(28, 10, safe(stat.followers), 1)
-                pdf.cell(28, 10, safe(stat.subs), 1)
-                pdf.cell(28, 10, safe(stat.donations), 1)
-                pdf.cell(28, 10, safe(stat.sub_donations), 1)
-                pdf.cell(28, 10, safe(stat.bit_donations), 1)
-                pdf.ln()
-        # ...existing week/month/year logic unchanged...
-    else:
-        pdf.set_font("Arial", "B", 16)
-        pdf.set_text_color(0, 0, 0)
-        pdf.cell(0, 10, "No data for this period.", ln=True)
-    return pdf
+    if rollup and with_chart:
+        report(50, 'Rendering chart')
+        chart_img_bytes = cached_chart('trend', period_scope(period.name, period.key), *period.criteria, archived=period.archived)
+    report(70, 'Building PDF')
+    from services.report_generation import stream_period_report
+    return metrics.timed_iter('pdf', stream_period_report(
+        period.name, period.subtitle, rollup, stream_summaries, data.stream_rows(),
+        chart_img_bytes, progress=report,
+    ))
+
+def build_period_report(period, with_chart=False, progress=None):
+    # PDF bytes for a period report; progress(percent, message) is used by background jobs
+    if streamed(period):
+        return b''.join(period_report_chunks(period, with_chart, progress))
+    report = progress or (lambda percent, message=None: None)
+    stats = []
+    report(10, 'Summarizing stats')
+    data = periods.report_data.get(period)
+    summary = data.summary
+    chart_img_bytes = None
+    if summary:
+        report(30, 'Loading hourly stats')
+        stats = data.rows
+        if with_chart:
+            report(50, 'Rendering chart')
+            chart_img_bytes = cached_chart('trend', period_scope(period.name, period.key), *period.criteria, archived=period.archived)
+    report(70, 'Building PDF')
+    from services.report_generation import generate_report_pdf
+    with metrics.phase('pdf'):
+        pdf = generate_report_pdf(stats, summary, period.name, chart_img_bytes, progress=report)
+        return pdf.output(dest='S').encode('latin1')
+
+def build_stream_report(stream_id, progress=None):
+    report = progress or (lambda percent, message=None: None)
+    report(10, 'Summarizing stats')
+    stream = db.session.get(Stream, stream_id)
+    summary = rollups.stream_summary(stream.id)
+    stats = []
+    chart_img_bytes = None
+    if summary:
+        report(30, 'Loading hourly stats')
+        stats = list(merged(aggregation.stat_rows(HourlyStat.stream_id == stream.id), archive.rows(archived_stream(stream))))
+        report(50, 'Rendering chart')
+        chart_img_bytes = cached_chart('trend', stream_scope(stream.id), HourlyStat.stream_id == stream.id, archived=archived_stream(stream))
+    report(70, 'Building PDF')
+    from services.report_generation import generate_report_pdf
+    with metrics.phase('pdf'):
+        pdf = generate_report_pdf(stats, summary, "day", chart_img_bytes, progress=report)
+        return pdf.output(dest='S').encode('latin1')
+
+# Background report jobs: POST returns a job id at once, the client polls the status
+# URL and downloads the cached PDF when it is done.
+def job_payload(job):
+    payload = job.to_dict()
+    payload['status_url'] = url_for('analytics.job_status', job_id=job.id)
+    payload['download_url'] = url_for('analytics.job_download', job_id=job.id)
+    return payload
+
+@analytics_bp.route('/reports/pdf/<period>/job', methods=['POST'])
+def reports_pdf_job(period):
+    selected = request_period(period)
+    fingerprint = selected.fingerprint()
+    job = report_jobs.submit(
+        ('period', selected, fingerprint), f'{period}_report.pdf',
+        lambda job: build_period_report(selected, progress=job.report),
+    )
+    return jsonify(job_payload(job)), 202
+
+@analytics_bp.route('/stream/<int:stream_id>/pdf_job', methods=['POST'])
+def stream_pdf_job(stream_id):
+    stream = Stream.query.get_or_404(stream_id)
+    fingerprint = stream_fingerprint(stream)
+    job = report_jobs.submit(
+        ('stream', stream.id, fingerprint), f'stream_{stream.id}_report.pdf',
+        lambda job: build_stream_report(stream_id, progress=job.report),
+    )
+    return jsonify(job_payload(job)), 202
+
+@analytics_bp.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = report_jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job_payload(job))
+
+@analytics_bp.route('/jobs/<job_id>/download')
+def job_download(job_id):
+    job = report_jobs.get(job_id)
+    if job is None:
+        abort(404)
+    if job.status != jobs.DONE:
+        return jsonify(job_payload(job)), 409
+    return send_file(io.BytesIO(job.result), as_attachment=True, download_name=job.filename, mimetype='application/pdf')
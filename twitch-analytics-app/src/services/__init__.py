@@ -0,0 +1 @@
+# Makes services a package
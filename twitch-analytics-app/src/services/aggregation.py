@@ -0,0 +1,171 @@
+from collections import namedtuple
+import math
+
+from sqlalchemy import func, literal_column, or_, select, tuple_
+
+from extensions import db
+from models import Stream, HourlyStat, StreamRollup
+
+# Compact per-group viewer statistics computed by the database.
+Summary = namedtuple('Summary', [
+    'count', 'total', 'average', 'minimum', 'maximum', 'std',
+    'peak_hour', 'low_hour', 'first', 'last',
+])
+
+# fingerprint() of a set of hourly stats
+Fingerprint = namedtuple('Fingerprint', ['count', 'id_sum', 'max_id', 'updated_at'])
+
+# Columns rendered in report tables; returned as plain rows, not HourlyStat objects.
+ROW_COLUMNS = (
+    HourlyStat.id, HourlyStat.stream_id, HourlyStat.hour, HourlyStat.viewers, HourlyStat.followers,
+    HourlyStat.subs, HourlyStat.donations, HourlyStat.sub_donations, HourlyStat.bit_donations, HourlyStat.started_at,
+    Stream.title.label('stream_title'), Stream.date.label('stream_date'),
+)
+
+
+# Share of hourly_stat a reporting period is assumed to select. Stock SQLite builds
+# keep no STAT4 histograms, so for an open range on started_at the planner guesses
+# a quarter of the table and prefers a full scan over the started_at index.
+PERIOD_LIKELIHOOD = 0.01
+
+
+def started_since(start):
+    """Criterion for hours that started on or after start, hinted as selective to the planner."""
+    return func.likelihood(HourlyStat.started_at >= start, literal_column(repr(PERIOD_LIKELIHOOD)))
+
+
+def _variance(count, total, total_sq):
+    # Population variance from integer moments, exact until the final division
+    return max(count * total_sq - total * total, 0) / (count * count)
+
+
+def summarize_groups(group_column, *criteria, order_by=HourlyStat.started_at):
+    """Viewer statistics per value of group_column, pushed down into two SQL queries.
+
+    The first query is a GROUP BY over sum/count/min/max/sum of squares. The second
+    ranks rows inside each group with window functions so the peak hour, the lowest
+    hour and the first/last rows (by order_by, then id) come back without loading the group.
+    Pass group_column=None to summarize everything matching criteria as one group.
+    """
+    keys = [group_column] if group_column is not None else []
+    viewers = HourlyStat.viewers
+    moments = (
+        db.session.query(
+            *keys,
+            func.count(HourlyStat.id), func.sum(viewers), func.min(viewers),
+            func.max(viewers), func.sum(viewers * viewers),
+        )
+        .filter(*criteria)
+    )
+    if keys:
+        moments = moments.group_by(group_column)
+
+    partition = {'partition_by': keys} if keys else {}
+    ranked = (
+        select(
+            *[k.label('group_key') for k in keys],
+            HourlyStat.hour, viewers,
+            func.row_number().over(order_by=(viewers.desc(), order_by, HourlyStat.id), **partition).label('peak_rank'),
+            func.row_number().over(order_by=(viewers.asc(), order_by, HourlyStat.id), **partition).label('low_rank'),
+            func.row_number().over(order_by=(order_by, HourlyStat.id), **partition).label('first_rank'),
+            func.row_number().over(order_by=(order_by.desc(), HourlyStat.id.desc()), **partition).label('last_rank'),
+        )
+        .select_from(HourlyStat)
+        .where(*criteria)
+        .subquery()
+    )
+    extremes = {}
+    edge_rows = db.session.execute(
+        select(ranked).where(or_(
+            ranked.c.peak_rank == 1, ranked.c.low_rank == 1,
+            ranked.c.first_rank == 1, ranked.c.last_rank == 1,
+        ))
+    )
+    for row in edge_rows:
+        key = row.group_key if keys else None
+        edge = extremes.setdefault(key, {})
+        if row.peak_rank == 1:
+            edge['peak_hour'] = row.hour
+        if row.low_rank == 1:
+            edge['low_hour'] = row.hour
+        if row.first_rank == 1:
+            edge['first'] = row.viewers
+        if row.last_rank == 1:
+            edge['last'] = row.viewers
+
+    summaries = {}
+    for row in moments:
+        key, (count, total, minimum, maximum, total_sq) = (row[0], row[1:]) if keys else (None, row)
+        if not count:
+            continue
+        total, total_sq = int(total), int(total_sq)
+        edge = extremes.get(key, {})
+        summaries[key] = Summary(
+            count=count, total=total, average=total / count,
+            minimum=minimum, maximum=maximum,
+            std=math.sqrt(_variance(count, total, total_sq)),
+            peak_hour=edge.get('peak_hour'), low_hour=edge.get('low_hour'),
+            first=edge.get('first'), last=edge.get('last'),
+        )
+    return summaries
+
+
+def summarize(*criteria, order_by=HourlyStat.started_at):
+    """Single Summary for all rows matching criteria, or None when there are none."""
+    return summarize_groups(None, *criteria, order_by=order_by).get(None)
+
+
+def fingerprint(*criteria):
+    """Cheap digest of the rows matching criteria: changes on insert, delete or update."""
+    return Fingerprint(
+        *db.session.query(
+            func.count(HourlyStat.id), func.sum(HourlyStat.id),
+            func.max(HourlyStat.id), func.max(HourlyStat.updated_at),
+        )
+        .filter(*criteria)
+        .one()
+    )
+
+
+def stat_rows(*criteria, order_by=HourlyStat.started_at):
+    """Report table rows as lightweight column tuples, joined with their stream."""
+    return (
+        db.session.query(*ROW_COLUMNS)
+        .join(Stream, Stream.id == HourlyStat.stream_id)
+        .filter(*criteria)
+        .order_by(order_by, HourlyStat.id)
+        .all()
+    )
+
+
+def iter_stream_rows(*criteria, order_by=HourlyStat.started_at, batch_size=500):
+    """Report table rows grouped by stream, fetched lazily batch_size rows at a time."""
+    return (
+        db.session.query(*ROW_COLUMNS)
+        .join(Stream, Stream.id == HourlyStat.stream_id)
+        .filter(*criteria)
+        .order_by(HourlyStat.stream_id, order_by, HourlyStat.id)
+        .execution_options(yield_per=batch_size)
+    )
+
+
+def stream_page(limit, after=None):
+    """One page of streams, newest first, with per-stream viewer and follower totals.
+
+    Keyset pagination on (date, id): after is the (date, id) of the last stream on
+    the previous page, so each page is an index range scan however deep it is.
+    The totals are read from each stream's rollup row.
+    """
+    query = (
+        select(
+            Stream.id, Stream.date, Stream.title, Stream.streamer,
+            func.coalesce(StreamRollup.count, 0).label('hours'),
+            StreamRollup.maximum.label('peak_viewers'),
+            func.coalesce(StreamRollup.total_followers, 0).label('total_followers'),
+        )
+        .outerjoin(StreamRollup, StreamRollup.stream_id == Stream.id)
+    )
+    if after is not None:
+        query = query.where(tuple_(Stream.date, Stream.id) < tuple_(*after))
+    return db.session.execute(query.order_by(Stream.date.desc(), Stream.id.desc()).limit(limit)).all()
+
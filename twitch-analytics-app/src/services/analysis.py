@@ -1,43 +1,169 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import String, case, func, select, type_coerce
+
+from extensions import db
+from models import Stream, HourlyStat
+from services import timebuckets
+from services.archive import archive
+
+# Columnar analysis of hourly stats.
+#
+# load_stats() pulls a period's rows into one DataFrame with a single query;
+# rollups() groups them once by (day, hour of day) and derives the daily,
+# weekly, monthly and hour-of-day tables from that small intermediate, so the
+# per-row work is one grouped reduction whatever the number of rollups. Hours
+# count on the day and at the clock hour they started, as in periods and
+# charts. Archived hours are merged in from an archive.Scope, as in timeseries.
+
+Rollups = namedtuple('Rollups', ['daily', 'weekly', 'monthly', 'hourly'])
+
+COUNT_COLUMNS = ('subs', 'donations', 'sub_donations', 'bit_donations')
+SUM_COLUMNS = ('viewers', 'followers') + COUNT_COLUMNS
+
+# Legacy viewer_data keys -> columns of the analyze_*_performance results
+LEGACY_TOTALS = {
+    'viewers': 'total_viewers',
+    'followers': 'total_followers',
+    'subscribers': 'total_subscribers',
+    'bit_donors': 'total_bit_donors',
+    'gift_subbers': 'total_gift_subbers',
+    'donors': 'total_donors',
+}
+
+
+def _entry_count(column, separator):
+    # Entries in a separator-joined username list, counted by SQLite
+    return case(
+        (func.coalesce(column, '') == '', 0),
+        else_=func.length(column) - func.length(func.replace(column, separator, '')) + 1,
+    )
+
+
+def _count_entries(value, separator):
+    # _entry_count() for an archived text value
+    return value.count(separator) + 1 if value else 0
+
+
+def _hour_of_day(clock):
+    clock = timebuckets.parse_clock(clock)
+    return -1 if clock is None else clock.hour
+
+
+def load_stats(*criteria, archived=None):
+    """Hourly stats matching criteria as a columnar DataFrame, read with one query.
+
+    Columns: day (datetime64 date the hour started), hour_of_day (clock hour it
+    started; -1 when it has no start time and its label no clock time), viewers,
+    followers and the number of subs, donations, gifted subs and bit donations in
+    each hour. Hours without a start time count on their stream's date. archived
+    is an archive.Scope of archived hours to append.
+    """
+    started = type_coerce(HourlyStat.started_at, String)  # Skip per-row datetime parsing; the text sorts as ISO
+    query = (
+        select(
+            # Dates and clock hours are parsed per distinct value below
+            func.coalesce(func.substr(started, 1, 10), type_coerce(Stream.date, String)),
+            case((started.is_(None), HourlyStat.hour), else_=func.substr(started, 12, 2)),
+            HourlyStat.viewers,
+            HourlyStat.followers,
+            _entry_count(HourlyStat.subs, ','),
+            _entry_count(HourlyStat.donations, ','),
+            _entry_count(HourlyStat.sub_donations, ','),
+            _entry_count(HourlyStat.bit_donations, ';'),
+        )
+        .join(Stream, Stream.id == HourlyStat.stream_id)
+        .where(*criteria)
+    )
+    rows = db.session.connection().execute(query).all()  # Core rows, no ORM loading overhead
+    columns = list(zip(*rows)) or [()] * 8
+    # Few distinct days and hour labels: convert the uniques, then index back
+    day_codes, days = pd.factorize(np.asarray(columns[0], dtype=object))
+    hour_codes, hours = pd.factorize(np.asarray(columns[1], dtype=object))
+    frame = pd.DataFrame({
+        'day': pd.to_datetime(pd.Index(days, dtype=object), format='%Y-%m-%d').values[day_codes],
+        # Code -1 (no label) picks the trailing -1
+        'hour_of_day': np.array([_hour_of_day(hour) for hour in hours] + [-1], dtype=np.int8)[hour_codes],
+    })
+    for name, values in zip(SUM_COLUMNS, columns[2:]):
+        frame[name] = np.fromiter(values, dtype=np.int64, count=len(values))
+    if archived is not None:
+        frame = pd.concat([frame, _archived_stats(archived)], ignore_index=True)
+    return frame
+
+
+def _archived_stats(scope):
+    # Archived hours always have a start time, so day and clock hour come from it
+    rows = list(archive.rows(scope, with_streams=False))
+    started = np.array([row.started_at for row in rows], dtype='datetime64[us]')
+    days = started.astype('datetime64[D]')
+    frame = pd.DataFrame({
+        'day': days.astype('datetime64[ns]'),
+        'hour_of_day': ((started - days) // np.timedelta64(1, 'h')).astype(np.int8),
+        'viewers': np.array([row.viewers for row in rows], dtype=np.int64),
+        'followers': np.array([row.followers for row in rows], dtype=np.int64),
+    })
+    for name in COUNT_COLUMNS:
+        separator = ';' if name == 'bit_donations' else ','
+        frame[name] = np.array([_count_entries(getattr(row, name), separator) for row in rows], dtype=np.int64)
+    return frame
+
+
+def _finish(table):
+    # Derived columns shared by every rollup table
+    table['avg_viewers'] = table['viewers'] / table['hours']
+    return table.rename(columns={'viewers': 'total_viewers', 'followers': 'total_followers'})
+
+
+def _regroup(cells, keys):
+    grouped = cells.groupby(keys, sort=True)
+    table = grouped[['hours', *SUM_COLUMNS]].sum()
+    table['peak_viewers'] = grouped['peak_viewers'].max()
+    return _finish(table)
+
+
+def rollups(frame):
+    """Daily, weekly (Monday start), monthly and hour-of-day tables for a load_stats() frame.
+
+    Every table has hours, total_viewers, avg_viewers, peak_viewers,
+    total_followers, subs, donations, sub_donations and bit_donations.
+    """
+    grouped = frame.groupby(['day', 'hour_of_day'], sort=False)
+    cells = grouped[list(SUM_COLUMNS)].sum()
+    cells['hours'] = grouped.size()
+    cells['peak_viewers'] = grouped['viewers'].max()
+    cells = cells.reset_index()
+
+    days = cells['day']
+    week = (days - pd.to_timedelta(days.dt.dayofweek, unit='D')).rename('week')
+    month = days.dt.to_period('M').rename('month')
+    hourly = _regroup(cells[cells['hour_of_day'] >= 0], 'hour_of_day')
+    return Rollups(
+        daily=_regroup(cells, 'day'),
+        weekly=_regroup(cells, week),
+        monthly=_regroup(cells, month),
+        hourly=hourly,
+    )
+
+
+def _legacy_totals(viewer_data, key):
+    frame = pd.DataFrame.from_records(viewer_data, columns=['date', *LEGACY_TOTALS])
+    if frame.empty:
+        return {}
+    # A record missing a key adds 0 to that total instead of a NaN int() would reject
+    totals = frame.fillna({column: 0 for column in LEGACY_TOTALS})
+    totals = totals.groupby(key(totals['date']), sort=False)[list(LEGACY_TOTALS)].sum().rename(columns=LEGACY_TOTALS)
+    return {
+        period: {column: int(value) for column, value in zip(totals.columns, values)}
+        for period, values in zip(totals.index, totals.itertuples(index=False))
+    }
+
+
 def analyze_daily_performance(viewer_data):
-    daily_analysis = {}
-    for entry in viewer_data:
-        date = entry['date']
-        if date not in daily_analysis:
-            daily_analysis[date] = {
-                'total_viewers': 0,
-                'total_followers': 0,
-                'total_subscribers': 0,
-                'total_bit_donors': 0,
-                'total_gift_subbers': 0,
-                'total_donors': 0
-            }
-        daily_analysis[date]['total_viewers'] += entry['viewers']
-        daily_analysis[date]['total_followers'] += entry['followers']
-        daily_analysis[date]['total_subscribers'] += entry['subscribers']
-        daily_analysis[date]['total_bit_donors'] += entry['bit_donors']
-        daily_analysis[date]['total_gift_subbers'] += entry['gift_subbers']
-        daily_analysis[date]['total_donors'] += entry['donors']
-    
-    return daily_analysis
+    return _legacy_totals(viewer_data, lambda dates: dates)
+
 
 def analyze_monthly_performance(viewer_data):
-    monthly_analysis = {}
-    for entry in viewer_data:
-        month = entry['date'][:7]  # Extracting YYYY-MM
-        if month not in monthly_analysis:
-            monthly_analysis[month] = {
-                'total_viewers': 0,
-                'total_followers': 0,
-                'total_subscribers': 0,
-                'total_bit_donors': 0,
-                'total_gift_subbers': 0,
-                'total_donors': 0
-            }
-        monthly_analysis[month]['total_viewers'] += entry['viewers']
-        monthly_analysis[month]['total_followers'] += entry['followers']
-        monthly_analysis[month]['total_subscribers'] += entry['subscribers']
-        monthly_analysis[month]['total_bit_donors'] += entry['bit_donors']
-        monthly_analysis[month]['total_gift_subbers'] += entry['gift_subbers']
-        monthly_analysis[month]['total_donors'] += entry['donors']
-    
-    return monthly_analysis
\ No newline at end of file
+    return _legacy_totals(viewer_data, lambda dates: dates.str[:7])  # Extracting YYYY-MM
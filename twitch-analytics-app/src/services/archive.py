@@ -0,0 +1,481 @@
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime, time, timedelta
+import heapq
+import math
+import os
+import shutil
+import threading
+import uuid
+
+from flask import current_app
+from sqlalchemy import delete, func, select
+
+from extensions import db
+from models import ArchivePartition, HourlyStat, Stream, SupportEvent
+from services.aggregation import Summary
+
+# Retention compaction of old streams into monthly columnar archive partitions.
+#
+# compact() moves the hours of streams dated before a cut-off out of hourly_stat,
+# and their support events out of support_event, into one partition per calendar
+# month of started_at. A partition is a directory holding one uncompressed .npy
+# file per numeric column, sorted by (started_at, id) so it can be memory-mapped
+# and range-searched, plus a compressed text.npz with the hour labels and
+# supporter lists. Streams, rollups and leaderboards stay in the database.
+#
+# Readers take a Scope (a started_at range, a stream, or both) and return what the
+# partitions hold for it in the shapes the SQL readers use, so reports over a range
+# that reaches into history merge both and read the same data as before compaction.
+# numpy is imported on first use; nothing is loaded while the archive is empty.
+
+ARCHIVE_BATCH = 20000  # Hours moved per transaction
+QUERY_CHUNK = 500  # Ids per IN (...) list, well under SQLite's parameter limit
+NUMERIC = {'id': 'int64', 'stream_id': 'int64', 'started_at': 'datetime64[us]', 'viewers': 'int64', 'followers': 'int64'}
+TEXT = ('hour', 'subs', 'donations', 'sub_donations', 'bit_donations')
+
+# Fields of aggregation.ROW_COLUMNS
+Row = namedtuple('Row', [
+    'id', 'stream_id', 'hour', 'viewers', 'followers', 'subs', 'donations', 'sub_donations', 'bit_donations',
+    'started_at', 'stream_title', 'stream_date',
+])
+
+
+# version() of the archived hours in a scope
+Version = namedtuple('Version', ['count', 'paths'])
+
+
+class Scope(namedtuple('Scope', ['start', 'end', 'stream_id'])):
+    """Archived hours that started in [start, end) (dates or datetimes, None for open ends), of one stream if stream_id is set."""
+
+    __slots__ = ()
+
+    def __new__(cls, start=None, end=None, stream_id=None):
+        return super().__new__(cls, start, end, stream_id)
+
+    def within(self, start=None, end=None):
+        """The part of the scope in [start, end)."""
+        if start is not None and self.start is not None:
+            start = max(_datetime(start), _datetime(self.start))
+        if end is not None and self.end is not None:
+            end = min(_datetime(end), _datetime(self.end))
+        return self._replace(start=self.start if start is None else start, end=self.end if end is None else end)
+
+
+def stream_scope(stream):
+    # Hours of a stream start on its date or, past midnight, the day after
+    return Scope(stream.date, stream.date + timedelta(days=2), stream.id)
+
+
+def _datetime(value):
+    return value if isinstance(value, datetime) else datetime.combine(value, time())
+
+
+def _month(value):
+    return date(value.year, value.month, 1)
+
+
+def merged(live, archived, by_stream=False):
+    """Live rows and archived Row tuples in one (started_at, id) order, or (stream_id, started_at, id) with by_stream."""
+    if by_stream:
+        return heapq.merge(archived, live, key=lambda row: (row.stream_id, row.started_at or datetime.min, row.id))
+    return heapq.merge(archived, live, key=lambda row: (row.started_at or datetime.min, row.id))
+
+
+class PartitionFiles:
+    """The columns of one partition directory: numeric ones memory-mapped, text decoded on first use."""
+
+    def __init__(self, path):
+        import numpy as np
+        self.path = path
+        self.columns = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in NUMERIC}
+        self._text = None
+        self._lock = threading.Lock()
+
+    def texts(self):
+        """{column: (text, character offsets)}; value i is text[offsets[i]:offsets[i + 1]]."""
+        with self._lock:
+            if self._text is None:
+                import numpy as np
+                with np.load(os.path.join(self.path, 'text.npz')) as packed:
+                    self._text = {
+                        name: (packed[name].tobytes().decode(), packed[f'{name}_offsets'].tolist()) for name in TEXT
+                    }
+            return self._text
+
+    def strings(self, name, index):
+        text, offsets = self.texts()[name]
+        return [text[offsets[i]:offsets[i + 1]] for i in index]
+
+
+def save_partition(path, columns, texts):
+    """Write numeric column arrays and text column lists as a new partition directory."""
+    import numpy as np
+    os.makedirs(path)
+    for name, dtype in NUMERIC.items():
+        np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(columns[name], dtype=dtype))
+    packed = {}
+    for name in TEXT:
+        values = texts[name]
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in values], out=offsets[1:])
+        packed[name] = np.frombuffer(''.join(values).encode(), dtype=np.uint8)
+        packed[f'{name}_offsets'] = offsets
+    np.savez_compressed(os.path.join(path, 'text.npz'), **packed)
+
+
+def _floor(started, unit):
+    # timebuckets.floor() over a datetime64 array
+    import numpy as np
+    if unit == 'hour':
+        floored = started.astype('datetime64[h]')
+    elif unit == 'day':
+        floored = started.astype('datetime64[D]')
+    elif unit == 'week':
+        days = started.astype('datetime64[D]')
+        floored = days - (days.astype(np.int64) + 3) % 7  # Day 0 (1970-01-01) was a Thursday
+    elif unit == 'month':
+        floored = started.astype('datetime64[M]')
+    else:
+        raise ValueError(f'Unknown unit {unit!r}')
+    return floored.astype('datetime64[us]')
+
+
+def _first_in_group(mask, group):
+    # Position of the first True of every group, for groups that each have one
+    import numpy as np
+    hits = np.flatnonzero(mask)
+    groups = group[hits]
+    return hits[np.r_[True, groups[1:] != groups[:-1]]]
+
+
+def summarize_groups(stream_ids, started, ids, viewers, label):
+    """{stream_id: Summary} over column arrays, with aggregation.summarize_groups()'s tie rules.
+
+    label(i) is the hour label of row i of the arrays.
+    """
+    import numpy as np
+    order = np.lexsort((ids, started, stream_ids))
+    streams, values = stream_ids[order], viewers[order].astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, streams[1:] != streams[:-1]])
+    counts = np.diff(np.r_[starts, len(streams)])
+    group = np.repeat(np.arange(len(starts)), counts)
+    minimum, maximum = np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts)
+    peak = _first_in_group(values == maximum[group], group)
+    low = _first_in_group(values == minimum[group], group)
+    summaries = {}
+    for stream_id, count, total, total_sq, low_viewers, peak_viewers, peak_at, low_at, first, last in zip(
+        streams[starts].tolist(), counts.tolist(), np.add.reduceat(values, starts).tolist(),
+        np.add.reduceat(values * values, starts).tolist(), minimum.tolist(), maximum.tolist(),
+        order[peak].tolist(), order[low].tolist(), values[starts].tolist(), values[starts + counts - 1].tolist(),
+    ):
+        summaries[stream_id] = Summary(
+            count=count, total=total, average=total / count, minimum=low_viewers, maximum=peak_viewers,
+            std=math.sqrt(max(count * total_sq - total * total, 0) / (count * count)),
+            peak_hour=label(peak_at), low_hour=label(low_at), first=first, last=last,
+        )
+    return summaries
+
+
+class Archive:
+    """Monthly partitions of archived hours under ARCHIVE_DIR, with an LRU of opened partitions."""
+
+    def __init__(self, max_open=24):
+        self.directory = None
+        self.max_open = max_open
+        self._open = OrderedDict()  # path -> PartitionFiles
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        # Defaults to <database>_archive next to the SQLite file, so the two move and are backed up together.
+        # Created on the first compaction.
+        self.directory = app.config.setdefault('ARCHIVE_DIR', None)
+        self.max_open = app.config.setdefault('ARCHIVE_MAX_OPEN', self.max_open)
+
+    def root(self):
+        if self.directory is None:
+            database = db.engine.url.database
+            if database and database != ':memory:':
+                self.directory = os.path.splitext(database)[0] + '_archive'
+            else:
+                self.directory = os.path.join(current_app.instance_path, 'archive')
+        return self.directory
+
+    def _files(self, path):
+        with self._lock:
+            files = self._open.get(path)
+            if files is not None:
+                self._open.move_to_end(path)
+                return files
+        files = PartitionFiles(os.path.join(self.root(), path))
+        with self._lock:
+            self._open[path] = files
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return files
+
+    def _forget(self, paths):
+        # Drop the memory maps first; Windows cannot delete a mapped file
+        with self._lock:
+            for path in paths:
+                self._open.pop(path, None)
+        for path in paths:
+            shutil.rmtree(os.path.join(self.root(), path), ignore_errors=True)
+
+    # Readers
+
+    def partitions(self, scope):
+        """[(month, path)] of the partitions that can hold hours in scope, oldest first."""
+        query = select(ArchivePartition.month, ArchivePartition.path).order_by(ArchivePartition.month)
+        if scope.start is not None:
+            query = query.where(ArchivePartition.month >= _month(scope.start))
+        if scope.end is not None:
+            query = query.where(ArchivePartition.month <= (scope.end.date() if isinstance(scope.end, datetime) else scope.end))
+        return db.session.execute(query).all()
+
+    def select(self, scope, partitions=None):
+        """[(PartitionFiles, row positions)] of the hours in scope, in (started_at, id) order."""
+        import numpy as np
+        selected = []
+        for _, path in self.partitions(scope) if partitions is None else partitions:
+            files = self._files(path)
+            started = files.columns['started_at']
+            low = np.searchsorted(started, np.datetime64(_datetime(scope.start), 'us')) if scope.start is not None else 0
+            high = np.searchsorted(started, np.datetime64(_datetime(scope.end), 'us')) if scope.end is not None else len(started)
+            index = np.arange(low, high)
+            if scope.stream_id is not None:
+                index = index[files.columns['stream_id'][low:high] == scope.stream_id]
+            if len(index):
+                selected.append((files, index))
+        return selected
+
+    @staticmethod
+    def _columns(selected, names):
+        import numpy as np
+        return {name: np.concatenate([files.columns[name][index] for files, index in selected]) for name in names}
+
+    def columns(self, scope, names=tuple(NUMERIC)):
+        """{name: numpy array} of the numeric columns of the hours in scope, in (started_at, id) order."""
+        import numpy as np
+        selected = self.select(scope)
+        if not selected:
+            return {name: np.empty(0, dtype=NUMERIC[name]) for name in names}
+        return self._columns(selected, names)
+
+    def version(self, scope):
+        """Version of the archived hours in scope (None for none), to add to aggregation.fingerprint()'s."""
+        partitions = self.partitions(scope) if scope is not None else []
+        if not partitions:
+            return Version(0, ())
+        return Version(sum(len(index) for _, index in self.select(scope, partitions)), tuple(path for _, path in partitions))
+
+    def rows(self, scope, by_stream=False, with_streams=True):
+        """Row tuples of the hours in scope in (started_at, id) order, or (stream_id, started_at, id) with by_stream.
+
+        Rows are built as they are read. Without with_streams, stream_title and
+        stream_date are None.
+        """
+        selected = self.select(scope)
+        if not selected:
+            return iter(())
+        return self._rows(selected, by_stream, with_streams)
+
+    def _rows(self, selected, by_stream, with_streams):
+        import numpy as np
+        columns = self._columns(selected, NUMERIC)
+        owner = np.concatenate([np.full(len(index), number) for number, (_, index) in enumerate(selected)])
+        position = np.concatenate([index for _, index in selected])
+        if by_stream:
+            order = np.lexsort((columns['id'], columns['started_at'], columns['stream_id']))
+            columns = {name: values[order] for name, values in columns.items()}
+            owner, position = owner[order], position[order]
+        values = {name: columns[name].tolist() for name in NUMERIC}
+        owner, position = owner.tolist(), position.tolist()
+        texts = [[files.texts()[name] for name in TEXT] for files, _ in selected]
+        streams = self._streams(set(values['stream_id'])) if with_streams else {}
+        for number, (stat_id, stream_id, started_at, viewers, followers) in enumerate(zip(
+            values['id'], values['stream_id'], values['started_at'], values['viewers'], values['followers'],
+        )):
+            at = position[number]
+            hour, subs, donations, sub_donations, bit_donations = (
+                text[offsets[at]:offsets[at + 1]] for text, offsets in texts[owner[number]]
+            )
+            title, stream_date = streams.get(stream_id, (None, None))
+            yield Row(stat_id, stream_id, hour, viewers, followers, subs, donations, sub_donations, bit_donations,
+                      started_at, title, stream_date)
+
+    @staticmethod
+    def _streams(stream_ids):
+        stream_ids = sorted(stream_ids)
+        streams = {}
+        for offset in range(0, len(stream_ids), QUERY_CHUNK):
+            streams.update((stream_id, (title, stream_date)) for stream_id, title, stream_date in db.session.execute(
+                select(Stream.id, Stream.title, Stream.date).where(Stream.id.in_(stream_ids[offset:offset + QUERY_CHUNK]))
+            ))
+        return streams
+
+    def points(self, scope, labels=False):
+        """(started_at, id, hour label or None, viewers, followers) tuples of the hours in scope, in time order."""
+        selected = self.select(scope)
+        if not selected:
+            return []
+        columns = self._columns(selected, ('started_at', 'id', 'viewers', 'followers'))
+        hours = [hour for files, index in selected for hour in files.strings('hour', index.tolist())] if labels else None
+        return zip(
+            columns['started_at'].tolist(), columns['id'].tolist(), hours or [None] * len(columns['id']),
+            columns['viewers'].tolist(), columns['followers'].tolist(),
+        )
+
+    def bucket_totals(self, unit, scope):
+        """{bucket start: (hours, total viewers, peak viewers, followers)} of the hours in scope, as timebuckets.buckets() groups them."""
+        import numpy as np
+        selected = self.select(scope)
+        if not selected:
+            return {}
+        columns = self._columns(selected, ('started_at', 'viewers', 'followers'))
+        keys = _floor(columns['started_at'], unit)  # Sorted, as started_at is
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        return {
+            key: (hours, total, peak, followers) for key, hours, total, peak, followers in zip(
+                keys[starts].tolist(), np.diff(np.r_[starts, len(keys)]).tolist(),
+                np.add.reduceat(columns['viewers'], starts).tolist(), np.maximum.reduceat(columns['viewers'], starts).tolist(),
+                np.add.reduceat(columns['followers'], starts).tolist(),
+            )
+        }
+
+    def stream_summaries(self, scope, *criteria, live=()):
+        """{stream_id: aggregation.Summary} of the hours in scope, per stream.
+
+        Streams in live also have live hours matching criteria; those are
+        summarized over both, so the result can replace their live summaries.
+        """
+        import numpy as np
+        selected = self.select(scope)
+        if not selected:
+            return {}
+        columns = self._columns(selected, ('stream_id', 'started_at', 'id', 'viewers'))
+        owner = np.concatenate([np.full(len(index), number) for number, (_, index) in enumerate(selected)])
+        position = np.concatenate([index for _, index in selected])
+        both = sorted(set(np.unique(columns['stream_id']).tolist()) & set(live))
+        live_hours = []
+        if both:
+            rows = []
+            for offset in range(0, len(both), QUERY_CHUNK):
+                rows += db.session.execute(
+                    select(HourlyStat.stream_id, HourlyStat.started_at, HourlyStat.id, HourlyStat.viewers, HourlyStat.hour)
+                    .where(*criteria, HourlyStat.stream_id.in_(both[offset:offset + QUERY_CHUNK]))
+                ).all()
+            if rows:
+                stream_ids, started, ids, viewers, live_hours = (list(column) for column in zip(*rows))
+                extra = {
+                    'stream_id': np.array(stream_ids, dtype=np.int64), 'id': np.array(ids, dtype=np.int64),
+                    'started_at': np.array(started, dtype='datetime64[us]'), 'viewers': np.array(viewers, dtype=np.int64),
+                }
+                columns = {name: np.concatenate([values, extra[name]]) for name, values in columns.items()}
+        archived = len(owner)
+
+        def label(row):
+            if row >= archived:
+                return live_hours[row - archived]
+            return selected[owner[row]][0].strings('hour', [position[row]])[0]
+
+        return summarize_groups(columns['stream_id'], columns['started_at'], columns['id'], columns['viewers'], label)
+
+    # Writers
+
+    def compact(self, before, batch=ARCHIVE_BATCH, progress=None):
+        """Move the hours of streams dated before the date before into the archive. Returns (streams, hours) moved.
+
+        Whole streams are taken in id order, about batch hours at a time. Each
+        batch rewrites the partitions it adds to and deletes its rows in one
+        transaction, so an hour is always either live or archived.
+        progress(streams, hours) is called after each batch.
+        """
+        counts = db.session.execute(
+            select(HourlyStat.stream_id, func.count(HourlyStat.id))
+            .join(Stream, Stream.id == HourlyStat.stream_id)
+            .where(Stream.date < before, HourlyStat.started_at.is_not(None))
+            .group_by(HourlyStat.stream_id)
+            .order_by(HourlyStat.stream_id)
+        ).all()
+        streams = hours = chunk_hours = 0
+        chunk = []
+        for number, (stream_id, count) in enumerate(counts):
+            chunk.append(stream_id)
+            chunk_hours += count
+            if chunk_hours < batch and number + 1 < len(counts):
+                continue
+            self._move(chunk[0], chunk[-1], before)
+            streams += len(chunk)
+            hours += chunk_hours
+            chunk, chunk_hours = [], 0
+            if progress:
+                progress(streams, hours)
+        return streams, hours
+
+    def _move(self, first, last, before):
+        import numpy as np
+        rows = db.session.execute(
+            select(
+                HourlyStat.id, HourlyStat.stream_id, HourlyStat.started_at, HourlyStat.viewers, HourlyStat.followers,
+                *(getattr(HourlyStat, name) for name in TEXT),
+            )
+            .join(Stream, Stream.id == HourlyStat.stream_id)
+            .where(HourlyStat.stream_id.between(first, last), Stream.date < before, HourlyStat.started_at.is_not(None))
+        ).all()
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(_month(row.started_at), []).append(row)
+        written, replaced = [], []
+        try:
+            for month, month_rows in sorted(by_month.items()):
+                partition = db.session.get(ArchivePartition, month)
+                columns = {name: [np.array([getattr(row, name) for row in month_rows], dtype=dtype)] for name, dtype in NUMERIC.items()}
+                texts = {name: [getattr(row, name) or '' for row in month_rows] for name in TEXT}
+                if partition is not None:
+                    files = self._files(partition.path)
+                    everything = range(len(files.columns['id']))
+                    for name in NUMERIC:
+                        columns[name].insert(0, np.asarray(files.columns[name]))
+                    for name in TEXT:
+                        texts[name] = files.strings(name, everything) + texts[name]
+                    replaced.append(partition.path)
+                else:
+                    partition = ArchivePartition(month=month)
+                    db.session.add(partition)
+                columns = {name: np.concatenate(values) for name, values in columns.items()}
+                order = np.lexsort((columns['id'], columns['started_at']))
+                path = f'{month:%Y-%m}-{uuid.uuid4().hex[:12]}'
+                os.makedirs(self.root(), exist_ok=True)
+                save_partition(
+                    os.path.join(self.root(), path),
+                    {name: values[order] for name, values in columns.items()},
+                    {name: [values[i] for i in order.tolist()] for name, values in texts.items()},
+                )
+                written.append(path)
+                partition.path, partition.rows, partition.updated_at = path, len(order), datetime.utcnow()
+            ids = [row.id for row in rows]
+            for offset in range(0, len(ids), QUERY_CHUNK):
+                chunk = ids[offset:offset + QUERY_CHUNK]
+                # stream_id keeps the delete on the support_event stream index
+                db.session.execute(delete(SupportEvent).where(
+                    SupportEvent.stream_id.between(first, last), SupportEvent.hourly_stat_id.in_(chunk),
+                ))
+                db.session.execute(delete(HourlyStat).where(HourlyStat.id.in_(chunk)))
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            self._forget(written)
+            raise
+        self._forget(replaced)
+
+    def clear(self):
+        """Delete every partition row; the caller commits, then passes the returned paths to remove()."""
+        paths = db.session.scalars(select(ArchivePartition.path)).all()
+        db.session.execute(delete(ArchivePartition))
+        return paths
+
+    def remove(self, paths):
+        self._forget(paths)
+
+
+archive = Archive()
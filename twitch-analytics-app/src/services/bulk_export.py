@@ -0,0 +1,183 @@
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from itertools import groupby
+import multiprocessing
+from operator import attrgetter
+import threading
+import zipfile
+
+from sqlalchemy import func, select, tuple_
+
+from extensions import db
+from models import HourlyStat, Stream
+from services import aggregation, rollups
+from services.archive import Scope, archive, merged
+
+# Bulk export of per-stream PDF reports as one ZIP archive.
+#
+# The main process reads the streams dated in a period EXPORT_CHUNK at a time,
+# with one query for their summaries and one for their hours, and sends each
+# stream's rows to a process pool that renders its chart and PDF, the CPU-bound
+# part of a report. Reports come back in stream order and are written into a ZIP
+# that is yielded as it grows, so neither the PDFs nor the archive are held in
+# memory. Workers are spawned rather than forked: they never touch the database,
+# and a forked child would inherit the server's threads and SQLite connections.
+
+EXPORT_CHUNK = 100  # Streams loaded per query
+# Columns of the report table (report_generation.TABLE_FIELDS)
+Hour = namedtuple('Hour', ['hour', 'viewers', 'followers', 'subs', 'donations', 'sub_donations', 'bit_donations'])
+_table_row = attrgetter(*Hour._fields)
+
+
+def render_report(task):
+    """PDF bytes of one stream's report, as build_stream_report() renders it; runs in a pool worker."""
+    from services import charts
+    from services.report_generation import generate_report_pdf
+    summary, rows = task
+    stats = [Hour(*row) for row in rows]
+    chart_img_bytes = None
+    if summary:
+        chart_img_bytes = charts.render('trend', [stat.hour for stat in stats], [stat.viewers or 0 for stat in stats])
+    pdf = generate_report_pdf(stats, summary, 'day', chart_img_bytes)
+    return pdf.output(dest='S').encode('latin1')
+
+
+def filename(stream):
+    return f'{stream.date}_stream_{stream.id}_report.pdf'
+
+
+def count(period):
+    return db.session.scalar(select(func.count(Stream.id)).where(*period.stream_criteria))
+
+
+def tasks(period):
+    """(stream, render_report() task) for every stream dated in period, in (date, id) order."""
+    after = None
+    while True:
+        query = select(Stream.id, Stream.date, Stream.title).where(*period.stream_criteria)
+        if after is not None:
+            query = query.where(tuple_(Stream.date, Stream.id) > tuple_(*after))
+        streams = db.session.execute(query.order_by(Stream.date, Stream.id).limit(EXPORT_CHUNK)).all()
+        if not streams:
+            return
+        after = streams[-1].date, streams[-1].id
+        ids = [stream.id for stream in streams]
+        summaries = rollups.stream_summaries(ids)
+        # Hours of a stream start on its date or the day after, so one archive range covers the chunk
+        selected = set(ids)
+        archived = (
+            row for row in archive.rows(Scope(streams[0].date, streams[-1].date + timedelta(days=2)), by_stream=True, with_streams=False)
+            if row.stream_id in selected
+        )
+        live = aggregation.iter_stream_rows(HourlyStat.stream_id.in_(ids))
+        hours = {
+            stream_id: [_table_row(row) for row in rows]
+            for stream_id, rows in groupby(merged(live, archived, by_stream=True), key=attrgetter('stream_id'))
+        }
+        for stream in streams:
+            summary = summaries.get(stream.id)
+            yield stream, (summary, hours.get(stream.id, []) if summary else [])
+
+
+class _Sink:
+    # Write-only file for ZipFile; take() returns what was written since the last call
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class BulkExporter:
+    """Renders stream reports on a process pool shared by every export.
+
+    max_workers=0 renders them one by one in the calling thread instead. At most
+    two reports per worker are in flight, so a slow reader of the ZIP holds back
+    the rendering instead of queueing PDFs in memory.
+    """
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_workers = app.config.setdefault('EXPORT_WORKERS', self.max_workers)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def reports(self, period):
+        """Yield (stream, PDF bytes) for every stream dated in period, in (date, id) order."""
+        if not self.max_workers:
+            for stream, task in tasks(period):
+                yield stream, render_report(task)
+            return
+        pool = self._pool()
+        pending = deque()
+        try:
+            for stream, task in tasks(period):
+                pending.append((stream, pool.submit(render_report, task)))
+                if len(pending) >= 2 * self.max_workers:
+                    stream, future = pending.popleft()
+                    yield stream, future.result()
+            while pending:
+                stream, future = pending.popleft()
+                yield stream, future.result()
+        except BrokenProcessPool:
+            # A worker died; the next export starts a new pool
+            with self._lock:
+                if self._executor is pool:
+                    self._executor = None
+            raise
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def zip_chunks(self, period, progress=None):
+        """Yield a ZIP archive of the reports of every stream dated in period, about one report per chunk.
+
+        progress(done, total) is called after every EXPORT_CHUNK reports and at the end.
+        """
+        total = count(period)
+        done = 0
+        sink = _Sink()
+        # PDF content streams are already deflated, so entries are stored as they are
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as bundle:
+            for stream, pdf in self.reports(period):
+                bundle.writestr(filename(stream), pdf)
+                done += 1
+                if progress and done % EXPORT_CHUNK == 0:
+                    progress(done, total)
+                yield sink.take()
+        if progress:
+            progress(done, total)
+        yield sink.take()
+
+
+exporter = BulkExporter()
@@ -0,0 +1,171 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import HourlyStat
+
+
+class ChartCache:
+    """Two-level LRU cache of rendered chart PNGs.
+
+    Entries are keyed by a hash of (chart kind, scope, data fingerprint), so a chart
+    is only reused while the rows it was drawn from are unchanged. The scope
+    ("stream:<id>", "period:<name>:<start>" or "compare:<ids hash>") is kept in
+    the file name; when a commit changes a stream's hours, that stream's scope
+    and every period and comparison scope are dropped (see changed()).
+    """
+
+    def __init__(self, max_entries=64, max_disk_entries=512):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.disk_dir = None
+        self._memory = OrderedDict()  # key -> png bytes
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.disk_dir = app.config.setdefault('CHART_CACHE_DIR', os.path.join(app.instance_path, 'chart_cache'))
+        os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(kind, scope, fingerprint):
+        digest = hashlib.sha256(repr((kind, scope, fingerprint)).encode()).hexdigest()
+        return f"{scope.replace(':', '_')}-{digest}"
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.png')
+
+    def get(self, key):
+        with self._lock:
+            png = self._memory.get(key)
+            if png is not None:
+                self._memory.move_to_end(key)
+                return png
+        if self.disk_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                png = f.read()
+            os.utime(path)  # Disk LRU order is file mtime
+        except OSError:
+            return None
+        self._remember(key, png)
+        return png
+
+    def put(self, key, png):
+        self._remember(key, png)
+        if self.disk_dir is None:
+            return
+        path = self._path(key)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        self._evict_disk()
+
+    def get_or_render(self, kind, scope, fingerprint, render):
+        """Cached PNG for (kind, scope, fingerprint); render() is only called on a miss."""
+        key = self.make_key(kind, scope, fingerprint)
+        png = self.get(key)
+        if png is None:
+            png = render()
+            if png is not None:
+                self.put(key, png)
+        return png
+
+    def invalidate(self, scope=None):
+        """Drop the entries of one scope, of every scope under a prefix ending in ':', or all."""
+        if scope is None:
+            file_prefix = ''
+        elif scope.endswith(':'):
+            file_prefix = scope.replace(':', '_')
+        else:
+            file_prefix = scope.replace(':', '_') + '-'
+        with self._lock:
+            for key in [k for k in self._memory if k.startswith(file_prefix)]:
+                del self._memory[key]
+        if self.disk_dir is None:
+            return
+        for name in os.listdir(self.disk_dir):
+            if name.startswith(file_prefix) and name.endswith('.png'):
+                try:
+                    os.remove(os.path.join(self.disk_dir, name))
+                except OSError:
+                    pass
+
+    def _remember(self, key, png):
+        with self._lock:
+            self._memory[key] = png
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        try:
+            entries = [entry for entry in os.scandir(self.disk_dir) if entry.name.endswith('.png')]
+        except OSError:
+            return
+        if len(entries) <= self.max_disk_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+chart_cache = ChartCache()
+
+
+def stream_scope(stream_id):
+    return f'stream:{stream_id}'
+
+
+def period_scope(period, start):
+    return f'period:{period}:{start}'
+
+
+CHANGED_STREAMS = 'chart_cache.changed_streams'
+
+
+def changed(session, stream_ids):
+    """Drop the charts of stream_ids, and every period and comparison chart, when session commits.
+
+    ORM flushes of HourlyStat rows are collected automatically; Core bulk writes call this.
+    """
+    session.info.setdefault(CHANGED_STREAMS, set()).update(stream_ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed(session, flush_context):
+    # The session still lists what was flushed; history keeps the stream an edited hour moved from
+    stream_ids = set()
+    for target in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(target, HourlyStat):
+            stream_ids.update(inspect(target).attrs.stream_id.history.sum())
+    if stream_ids:
+        changed(session, stream_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed(session):
+    stream_ids = session.info.pop(CHANGED_STREAMS, None)
+    if not stream_ids:
+        return
+    for stream_id in stream_ids:
+        chart_cache.invalidate(stream_scope(stream_id))
+    chart_cache.invalidate('period:')
+    chart_cache.invalidate('compare:')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed(session):
+    session.info.pop(CHANGED_STREAMS, None)
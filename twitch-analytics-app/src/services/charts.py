@@ -0,0 +1,130 @@
+import io
+import threading
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from services import timeseries
+
+# Chart renderer built on the object-oriented Figure/FigureCanvasAgg API.
+# Nothing here touches matplotlib.pyplot's global figure manager, so charts can
+# be rendered from several request threads at once.
+
+TWITCH_PURPLE = '#9147ff'
+TREND_CYAN = '#00ffe7'
+# Longer series are downsampled first, to about one point per two pixels; the
+# bars of trend charts keep each bucket's highest and lowest hour
+MAX_POINTS = {'trend': 200}
+DOWNSAMPLE_METHODS = {'trend': 'minmax'}
+MAX_TICKS = 24
+
+# Pre-styled figure templates, one per chart kind
+TEMPLATES = {
+    'trend': {
+        'figsize': (8, 4),
+        'title': 'Viewers Per Hour',
+        'title_style': {'fontsize': 16, 'fontweight': 'bold', 'color': TWITCH_PURPLE},
+        'label_style': {'fontsize': 12},
+        'grid': {'axis': 'y', 'alpha': 0.3},
+        'transparent': True,
+    },
+}
+
+_local = threading.local()
+
+
+def _figure(kind):
+    # Each thread keeps one Figure per template and reuses it for every render;
+    # figures are never shared between threads.
+    figures = getattr(_local, 'figures', None)
+    if figures is None:
+        figures = _local.figures = {}
+    fig = figures.get(kind)
+    if fig is None:
+        fig = Figure(figsize=TEMPLATES[kind]['figsize'])
+        FigureCanvasAgg(fig)
+        fig.add_subplot()
+        figures[kind] = fig
+    ax = fig.axes[0]
+    ax.clear()
+    return fig, ax
+
+
+def _apply_template(ax, template, xlabel='Hour', ylabel='Viewers'):
+    ax.set_title(template['title'], **template['title_style'])
+    ax.set_xlabel(xlabel, **template['label_style'])
+    ax.set_ylabel(ylabel, **template['label_style'])
+    if template['grid']:
+        ax.grid(**template['grid'])
+
+
+def _png(fig, template):
+    fig.tight_layout()
+    img = io.BytesIO()
+    fig.savefig(img, format='png', transparent=template['transparent'])
+    return img.getvalue()
+
+
+def trend_chart(hours, viewers):
+    """Viewers per hour as bars with a quadratic polyfit trend line."""
+    template = TEMPLATES['trend']
+    fig, ax = _figure('trend')
+    x = np.arange(len(hours))
+    ax.bar(x, viewers, color=TWITCH_PURPLE, alpha=0.7, label='Viewers')
+    if len(viewers) > 1:
+        # Quadratic fit, linear when there are only two points
+        trend = np.poly1d(np.polyfit(x, viewers, min(2, len(viewers) - 1)))
+        ax.plot(x, trend(x), color=TREND_CYAN, linewidth=3, linestyle='-', label='Trend')
+    step = max(1, -(-len(hours) // MAX_TICKS))  # Label at most MAX_TICKS bars
+    ax.set_xticks(x[::step], hours[::step], rotation=45)
+    _apply_template(ax, template)
+    ax.legend()
+    return _png(fig, template)
+
+
+def comparison_chart(comparison):
+    """Viewer percentile bands and retention by hour since start, and the weekday x hour of day heatmap, in one PNG."""
+    from services.comparison import PERCENTILES, WEEKDAYS, percentile_bands, retention
+    # A new figure each time: the heatmap's colorbar adds an axes to it
+    fig = Figure(figsize=(15, 4.5))
+    FigureCanvasAgg(fig)
+    bands_ax, retention_ax, heatmap_ax = fig.subplots(1, 3, gridspec_kw={'width_ratios': (1, 1, 1.4)})
+    fig.suptitle(f'Comparing {len(comparison.streams)} Streams', fontsize=14, fontweight='bold', color=TWITCH_PURPLE)
+    hours = np.arange(comparison.viewers.shape[1])
+    low, quartile, median, upper, high = (percentile_bands(comparison.viewers)[p] for p in PERCENTILES)
+    bands_ax.fill_between(hours, low, high, color=TWITCH_PURPLE, alpha=0.15, label='10th-90th percentile')
+    bands_ax.fill_between(hours, quartile, upper, color=TWITCH_PURPLE, alpha=0.35, label='25th-75th percentile')
+    bands_ax.plot(hours, median, color=TWITCH_PURPLE, linewidth=2, label='Median')
+    bands_ax.set(title='Viewers by Hour of Stream', xlabel='Hours since start', ylabel='Viewers')
+    bands_ax.legend(fontsize=8)
+
+    live, relative = retention(comparison)
+    retention_ax.fill_between(hours, relative[25] * 100, relative[75] * 100, color=TREND_CYAN, alpha=0.3, label='25th-75th percentile')
+    retention_ax.plot(hours, relative[50] * 100, color='#008b8b', linewidth=2, label='Median viewers')
+    retention_ax.plot(hours, live * 100, color=TWITCH_PURPLE, linestyle='--', label='Streams still live')
+    retention_ax.set(title='Retention', xlabel='Hours since start', ylabel='% of first hour')
+    retention_ax.legend(fontsize=8)
+
+    image = heatmap_ax.imshow(np.ma.masked_invalid(comparison.slot_viewers), aspect='auto', cmap='magma')
+    heatmap_ax.set_yticks(range(7), WEEKDAYS)
+    heatmap_ax.set_xticks(range(0, 24, 3))
+    heatmap_ax.set(title='Average Viewers by Weekday and Hour', xlabel='Hour of day')
+    fig.colorbar(image, ax=heatmap_ax, label='Viewers')
+    fig.tight_layout()
+    img = io.BytesIO()
+    fig.savefig(img, format='png')
+    return img.getvalue()
+
+
+RENDERERS = {
+    'trend': trend_chart,
+}
+
+
+def render(kind, hours, viewers):
+    if len(viewers) > MAX_POINTS[kind]:
+        indices = timeseries.DOWNSAMPLERS[DOWNSAMPLE_METHODS[kind]](range(len(viewers)), viewers, MAX_POINTS[kind])
+        hours = [hours[i] for i in indices]
+        viewers = [viewers[i] for i in indices]
+    return RENDERERS[kind](hours, viewers)
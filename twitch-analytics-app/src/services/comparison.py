@@ -0,0 +1,169 @@
+from collections import namedtuple
+from datetime import timedelta
+import warnings
+
+from sqlalchemy import select
+
+from extensions import db
+from models import HourlyStat, Stream
+from services.archive import QUERY_CHUNK, Scope, archive
+
+# Cross-stream comparison of any number of streams.
+#
+# load() reads the viewers and followers of the selected streams' hours, live and
+# archived, as flat NumPy columns. compare() scatters them into dense matrices
+# with bincount: streams x hours since the stream started, and weekday x hour of
+# day. Retention curves, slot averages and percentile bands are reductions over
+# a matrix axis, so comparing more streams only adds rows. numpy is imported on
+# first use.
+
+MAX_HOURS = 48  # Hours since start compared; later hours of longer streams are left out
+PERCENTILES = (10, 25, 50, 75, 90)
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+US_PER_HOUR = 3600 * 10 ** 6
+
+Comparison = namedtuple('Comparison', [
+    'streams',  # [(id, date, title)], one per matrix row
+    'viewers',  # streams x hours since start; NaN where a stream has no hour
+    'followers',
+    'slot_hours',  # 7 x 24 hours recorded per weekday (Monday first) and hour of day
+    'slot_viewers',  # 7 x 24 average viewers per hour; NaN for slots without hours
+    'slot_followers',
+])
+
+
+def streams(*criteria):
+    """[(id, date, title)] of the streams matching criteria, in (date, id) order."""
+    query = select(Stream.id, Stream.date, Stream.title).where(*criteria).order_by(Stream.date, Stream.id)
+    return db.session.execute(query).all()
+
+
+def load(selected):
+    """(stream_id, started_at as int64 microseconds, viewers, followers) arrays of the hours of selected streams.
+
+    Hours without a start time cannot be aligned and are left out.
+    """
+    import numpy as np
+    ids = [stream.id for stream in selected]
+    columns = [[], [], [], []]
+    for offset in range(0, len(ids), QUERY_CHUNK):
+        rows = db.session.execute(
+            select(HourlyStat.stream_id, HourlyStat.started_at, HourlyStat.viewers, HourlyStat.followers)
+            .where(HourlyStat.stream_id.in_(ids[offset:offset + QUERY_CHUNK]), HourlyStat.started_at.is_not(None))
+        )
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+    stream_id = np.array(columns[0], dtype=np.int64)
+    started = np.array(columns[1], dtype='datetime64[us]').astype(np.int64)
+    viewers = np.array([value or 0 for value in columns[2]], dtype=np.float64)
+    followers = np.array([value or 0 for value in columns[3]], dtype=np.float64)
+    if selected:
+        # Hours of a stream start on its date or the day after
+        first, last = min(stream.date for stream in selected), max(stream.date for stream in selected)
+        archived = archive.columns(Scope(first, last + timedelta(days=2)), ('stream_id', 'started_at', 'viewers', 'followers'))
+        keep = np.isin(archived['stream_id'], ids)
+        stream_id = np.concatenate([stream_id, archived['stream_id'][keep]])
+        started = np.concatenate([started, archived['started_at'][keep].astype(np.int64)])
+        viewers = np.concatenate([viewers, archived['viewers'][keep]])
+        followers = np.concatenate([followers, archived['followers'][keep]])
+    return stream_id, started, viewers, followers
+
+
+def _averages(index, values, size):
+    # (count, mean) of the values per index in [0, size); the mean is NaN where none fall
+    import numpy as np
+    counts = np.bincount(index, minlength=size)
+    sums = np.bincount(index, weights=values, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return counts, sums / counts
+
+
+def compare(selected):
+    """Comparison of the selected streams (rows of streams())."""
+    import numpy as np
+    stream_id, started, viewers, followers = load(selected)
+    ids = np.array([stream.id for stream in selected], dtype=np.int64)
+    sorter = np.argsort(ids)
+    row = sorter[np.searchsorted(ids, stream_id, sorter=sorter)] if len(ids) else stream_id
+
+    # Hours since each stream's first hour
+    first = np.full(len(ids), np.iinfo(np.int64).max)
+    np.minimum.at(first, row, started)
+    since = (started - first[row]) // US_PER_HOUR
+    kept = since < MAX_HOURS
+    width = int(since[kept].max()) + 1 if kept.any() else 0
+    cell = row[kept] * width + since[kept]
+    _, viewer_matrix = _averages(cell, viewers[kept], len(ids) * width)
+    _, follower_matrix = _averages(cell, followers[kept], len(ids) * width)
+
+    # Weekday and hour of day of each hour; 1970-01-01 was a Thursday
+    hours = started // US_PER_HOUR
+    slot = (hours // 24 + 3) % 7 * 24 + hours % 24
+    slot_hours, slot_viewers = _averages(slot, viewers, 7 * 24)
+    _, slot_followers = _averages(slot, followers, 7 * 24)
+    return Comparison(
+        streams=list(selected),
+        viewers=viewer_matrix.reshape(len(ids), width),
+        followers=follower_matrix.reshape(len(ids), width),
+        slot_hours=slot_hours.reshape(7, 24),
+        slot_viewers=slot_viewers.reshape(7, 24),
+        slot_followers=slot_followers.reshape(7, 24),
+    )
+
+
+def percentile_bands(matrix):
+    """{percentile: curve} over the rows of matrix per column, ignoring NaN; NaN for empty columns."""
+    import numpy as np
+    if not matrix.size:
+        return {p: np.full(matrix.shape[1], np.nan) for p in PERCENTILES}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN columns
+        return dict(zip(PERCENTILES, np.nanpercentile(matrix, PERCENTILES, axis=0)))
+
+
+def retention(comparison):
+    """(share of streams still live, {percentile: viewers relative to the stream's first hour}) per hour since start."""
+    import numpy as np
+    viewers = comparison.viewers
+    if not viewers.size:
+        return np.zeros(viewers.shape[1]), percentile_bands(viewers)
+    # A stream is live up to its last recorded hour
+    recorded = ~np.isnan(viewers)
+    length = np.where(recorded.any(axis=1), viewers.shape[1] - np.argmax(recorded[:, ::-1], axis=1), 0)
+    live = (length[:, None] > np.arange(viewers.shape[1])).mean(axis=0)
+    opening = viewers[:, :1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        relative = np.where(opening > 0, viewers / opening, np.nan)
+    return live, percentile_bands(relative)
+
+
+def _json(values, digits=2):
+    # Rounded nested lists with None for NaN
+    import numpy as np
+    rounded = np.round(values, digits).astype(object)
+    rounded[np.isnan(values)] = None
+    return rounded.tolist()
+
+
+def payload(comparison):
+    """JSON-ready matrices, curves and bands of a Comparison."""
+    live, relative = retention(comparison)
+    bands = percentile_bands(comparison.viewers)
+    return {
+        'streams': [{'id': stream.id, 'date': stream.date.isoformat(), 'title': stream.title} for stream in comparison.streams],
+        'hours_since_start': list(range(comparison.viewers.shape[1])),
+        'viewers': _json(comparison.viewers),
+        'followers': _json(comparison.followers),
+        'bands': {str(p): _json(curve) for p, curve in bands.items()},
+        'retention': {
+            'live': _json(live, 4),
+            'relative': {str(p): _json(curve, 4) for p, curve in relative.items()},
+        },
+        'heatmap': {
+            'weekdays': list(WEEKDAYS),
+            'hours': list(range(24)),
+            'hours_recorded': comparison.slot_hours.tolist(),
+            'viewers': _json(comparison.slot_viewers),
+            'followers': _json(comparison.slot_followers),
+        },
+    }
@@ -1,31 +1,541 @@
+import csv
+from datetime import datetime
+from functools import lru_cache
+import io
+import json
+
+from sqlalchemy import or_
+
+from extensions import db
+from models import Stream, HourlyStat, SupportEvent
+from services import chart_cache, events, leaderboards, rollups, timebuckets
+
+# Bulk import of hourly stats from CSV, JSON arrays or JSON lines.
+#
+# Rows are parsed from the file as it is read, validated one by one, and inserted
+# BATCH_SIZE at a time with a single executemany INSERT per table and one commit
+# per batch. Invalid rows are skipped and reported with their row number. The
+# leaderboards and rollups of all the batches are updated in one pass at the end,
+# so until the import finishes they lag behind the hours already committed.
+
+BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+READ_CHUNK = 64 * 1024
+
+FORMATS = ('csv', 'json', 'jsonl')
+EXTENSIONS = {'.csv': 'csv', '.json': 'json', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+USERNAME_COLUMNS = ('subs', 'donations', 'sub_donations')
+RESERVED = ',;:'  # Separators of the stored username lists
+
+HOUR_LENGTH = HourlyStat.__table__.c.hour.type.length
+TITLE_LENGTH = Stream.__table__.c.title.type.length
+STREAMER_LENGTH = Stream.__table__.c.streamer.type.length
+DEFAULT_STREAMER = Stream.__table__.c.streamer.default.arg
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.streams_created = 0
+        self.errors = []
+        self.aborted = None  # Set when the file itself is malformed; earlier batches stay imported
+
+    def error(self, row, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'error': message})
+
+    def to_dict(self):
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'streams_created': self.streams_created,
+            'errors': sorted(self.errors, key=lambda error: error['row']),
+            'errors_truncated': self.failed > len(self.errors),
+            'aborted': self.aborted,
+        }
+
+
+def detect_format(filename=None, head=''):
+    for extension, fmt in EXTENSIONS.items():
+        if filename and filename.lower().endswith(extension):
+            return fmt
+    head = head.lstrip()
+    if head.startswith('['):
+        return 'json'
+    if head.startswith('{'):
+        return 'jsonl'
+    return 'csv'
+
+
+def iter_json_array(stream, chunk_size=READ_CHUNK):
+    """Yield the elements of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if pos >= len(buffer) or buffer[pos] != '[':
+        raise ValueError('Expected a JSON array')
+    pos += 1
+    skip_whitespace()
+    if pos < len(buffer) and buffer[pos] == ']':
+        return
+    while True:
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        # A value that ends at the buffer edge may be cut short (e.g. a number)
+        if end == len(buffer) and not eof:
+            fill()
+            continue
+        pos = end
+        yield item
+        skip_whitespace()
+        if pos >= len(buffer):
+            raise ValueError('Unterminated JSON array')
+        if buffer[pos] == ']':
+            return
+        if buffer[pos] != ',':
+            raise ValueError(f"Expected ',' or ']' in JSON array, got {buffer[pos]!r}")
+        pos += 1
+        skip_whitespace()
+
+
+def iter_records(stream, fmt):
+    """Yield (row number, record or RowError) from a text stream."""
+    if fmt == 'csv':
+        for number, record in enumerate(csv.DictReader(stream), start=1):
+            if None in record:
+                yield number, RowError('More values than header columns')
+            else:
+                yield number, record
+    elif fmt == 'jsonl':
+        number = 0
+        for line in stream:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                yield number, json.loads(line)
+            except ValueError as exc:
+                yield number, RowError(f'Invalid JSON: {exc}')
+    elif fmt == 'json':
+        yield from enumerate(iter_json_array(stream), start=1)
+    else:
+        raise ValueError(f'Unknown import format {fmt!r}, expected one of {", ".join(FORMATS)}')
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _count(record, name):
+    value = record.get(name)
+    # Fast paths for the common "123" (CSV) and 123 (JSON)
+    if type(value) is str and value.isdecimal():
+        return int(value)
+    if type(value) is int and value >= 0:
+        return value
+    if _blank(value):
+        raise RowError(f'{name} is required')
+    if isinstance(value, bool):
+        raise RowError(f'{name} must be a whole number, got {value!r}')
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{name} must be a whole number, got {value!r}')
+    if isinstance(value, float) and value != number:
+        raise RowError(f'{name} must be a whole number, got {value!r}')
+    if number < 0:
+        raise RowError(f'{name} must not be negative')
+    return number
+
+
+def _username(value, name):
+    username = str(value).strip()
+    if not username or any(ch in username for ch in RESERVED):
+        raise RowError(f'Invalid username {value!r} in {name}')
+    return username
+
+
+def _usernames(value, name):
+    # "alice,bob" from CSV or ["alice", "bob"] from JSON
+    if not value or _blank(value):
+        return ''
+    if type(value) is str:
+        # Fast path: split items cannot hold ',', so only the other separators need checking
+        joined = ','.join(item for item in map(str.strip, value.split(',')) if item)
+        if ';' not in joined and ':' not in joined:
+            return joined
+    items = value.split(',') if isinstance(value, str) else value
+    if not isinstance(items, list):
+        raise RowError(f'{name} must be a list of usernames')
+    return ','.join(_username(item, name) for item in items if not _blank(item))
+
+
+def _bits(value):
+    # "alice:100;bob:5", {"alice": 100}, [["alice", 100]] or [{"username": ..., "amount": ...}]
+    if not value or _blank(value):
+        return ''
+    if isinstance(value, str):
+        pairs = []
+        for entry in value.split(';'):
+            if entry.strip():
+                username, sep, amount = entry.rpartition(':')
+                if not sep:
+                    raise RowError(f'bit_donations entry {entry!r} is not username:amount')
+                pairs.append((username, amount))
+    elif isinstance(value, dict):
+        pairs = list(value.items())
+    elif isinstance(value, list):
+        pairs = []
+        for entry in value:
+            if isinstance(entry, dict):
+                pairs.append((entry.get('username'), entry.get('amount')))
+            elif isinstance(entry, (list, tuple)) and len(entry) == 2:
+                pairs.append(tuple(entry))
+            else:
+                raise RowError(f'Invalid bit_donations entry {entry!r}')
+    else:
+        raise RowError('bit_donations must be a string, list or object')
+    parts = []
+    for username, amount in pairs:
+        try:
+            amount = int(amount)
+        except (TypeError, ValueError):
+            raise RowError(f'Invalid bit amount {amount!r}')
+        if amount <= 0:
+            raise RowError(f'Bit amount must be positive, got {amount}')
+        parts.append(f'{_username(username, "bit_donations")}:{amount}')
+    return ';'.join(parts)
+
+
+def _datetime(value, name):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise RowError(f'{name} must be an ISO date/time, got {value!r}')
+
+
+@lru_cache(maxsize=4096)
+def _date(value):
+    # Rows of one stream repeat its date string
+    return _datetime(value, 'date').date()
+
+
+def parse_row(record):
+    """Validate one record; returns (stream key, HourlyStat insert mapping) or raises RowError.
+
+    The stream key is ('id', stream_id) or ('new', date, title, streamer).
+    """
+    if not isinstance(record, dict):
+        raise RowError('Row must be an object')
+    hour = record.get('hour')
+    if _blank(hour):
+        raise RowError('hour is required')
+    hour = str(hour).strip()  # A JSON hour may be a number, 0 included
+    if len(hour) > HOUR_LENGTH:
+        raise RowError(f'hour is longer than {HOUR_LENGTH} characters')
+    stream_date = record.get('date')
+    if not _blank(record.get('stream_id')):
+        stream_key = ('id', _count(record, 'stream_id'))
+    elif not _blank(stream_date):
+        if not isinstance(stream_date, str):
+            raise RowError(f'date must be an ISO date, got {stream_date!r}')
+        title = str(record.get('title') or '').strip()
+        streamer = str(record.get('streamer') or '').strip() or DEFAULT_STREAMER
+        if len(title) > TITLE_LENGTH or len(streamer) > STREAMER_LENGTH:
+            raise RowError('title or streamer is too long')
+        stream_key = ('new', _date(stream_date.strip()), title, streamer)
+    else:
+        raise RowError('stream_id or date is required')
+    created_at = record.get('created_at')
+    created_at = None if _blank(created_at) else _datetime(created_at, 'created_at')
+    started_at = record.get('started_at')
+    started_at = None if _blank(started_at) else _datetime(started_at, 'started_at')
+    mapping = {
+        'hour': hour,
+        'viewers': _count(record, 'viewers'),
+        'followers': _count(record, 'followers'),
+        'bit_donations': _bits(record.get('bit_donations')),
+        'started_at': started_at,
+        'created_at': created_at,
+    }
+    for name in USERNAME_COLUMNS:
+        mapping[name] = _usernames(record.get(name), name)
+    return stream_key, mapping
+
+
+class StreamResolver:
+    """Maps stream keys to (id, date), creating streams for new (date, title, streamer).
+
+    Keys are resolved a batch at a time: one query for the referenced ids, one for
+    the referenced dates, and one executemany INSERT for the streams still missing.
+    """
+
+    def __init__(self, result):
+        self.result = result
+        self.streams = {}  # stream key -> (id, date)
+
+    def resolve(self, keys):
+        keys = {key for key in keys if key not in self.streams}
+        ids = [key[1] for key in keys if key[0] == 'id']
+        if ids:
+            for stream_id, stream_date in db.session.query(Stream.id, Stream.date).filter(Stream.id.in_(ids)):
+                self.streams[('id', stream_id)] = (stream_id, stream_date)
+        new = {key for key in keys if key[0] == 'new'}
+        if new:
+            dates = {key[1] for key in new}
+            existing = (
+                db.session.query(Stream.id, Stream.date, Stream.title, Stream.streamer)
+                .filter(Stream.date.in_(dates))
+                .order_by(Stream.id.desc())  # The oldest duplicate wins
+            )
+            for stream_id, stream_date, title, streamer in existing:
+                key = ('new', stream_date, title or '', streamer)
+                if key in new:
+                    self.streams[key] = (stream_id, stream_date)
+            missing = sorted(key for key in new if key not in self.streams)
+            if missing:
+                stream_ids = insert_with_ids(Stream.__tablename__, STREAM_COLUMNS, [(key[1].isoformat(), key[2], key[3]) for key in missing])
+                for key, stream_id in zip(missing, stream_ids):
+                    self.streams[key] = (stream_id, key[1])
+                self.result.streams_created += len(missing)
+
+    def get(self, key):
+        return self.streams.get(key)
+
+
+STAT_COLUMNS = (
+    'id', 'stream_id', 'hour', 'viewers', 'followers',
+    'subs', 'donations', 'sub_donations', 'bit_donations', 'started_at', 'created_at', 'updated_at',
+)
+EVENT_COLUMNS = ('stream_id', 'hourly_stat_id', 'kind', 'username', 'amount', 'started_at', 'created_at')
+STREAM_COLUMNS = ('id', 'date', 'title', 'streamer')
+
+
+def _insert_sql(table, columns):
+    return f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+
+
+def _db_datetime(value):
+    # Same text format SQLAlchemy's SQLite DateTime type stores
+    return value.isoformat(sep=' ', timespec='microseconds')
+
+
+def insert_with_ids(table, columns, rows):
+    """executemany INSERT of rows (tuples for columns[1:]) and return their new ids in order.
+
+    SQLite cannot return ids from a batched INSERT in parameter order, so the first
+    row is inserted alone with RETURNING. That write takes the database's write
+    lock until commit, so the remaining rows can safely be given the next ids.
+    Rows go straight to the DB-API cursor: at import volumes the per-row parameter
+    processing of an ORM or Core insert costs more than SQLite itself.
+    """
+    connection = db.session.connection()
+    first_id = connection.exec_driver_sql(_insert_sql(table, columns[1:]) + ' RETURNING id', rows[0]).scalar_one()
+    ids = range(first_id, first_id + len(rows))
+    if len(rows) > 1:
+        connection.exec_driver_sql(_insert_sql(table, columns), [(row_id, *row) for row_id, row in zip(ids[1:], rows[1:])])
+    return list(ids)
+
+
+def insert_batch(batch):
+    """Insert HourlyStat mappings and their SupportEvent rows and return the new event ids in order; the caller commits."""
+    rows = []
+    for mapping in batch:
+        created_at = _db_datetime(mapping['created_at'])
+        rows.append((
+            mapping['stream_id'], mapping['hour'], mapping['viewers'], mapping['followers'],
+            mapping['subs'], mapping['donations'], mapping['sub_donations'], mapping['bit_donations'],
+            _db_datetime(mapping['started_at']), created_at, created_at,
+        ))
+    ids = insert_with_ids(HourlyStat.__tablename__, STAT_COLUMNS, rows)
+    event_rows = []
+    for stat_id, mapping, row in zip(ids, batch, rows):
+        stream_id, started_at, created_at = row[0], row[-3], row[-1]
+        for kind, column in events.KIND_COLUMNS.items():
+            blob = mapping[column]
+            if not blob:
+                continue
+            pairs = events.parse_bits(blob) if kind == 'bit' else [(username, 1) for username in events.parse_usernames(blob)]
+            event_rows.extend((stream_id, stat_id, kind, username, amount, started_at, created_at) for username, amount in pairs)
+    if not event_rows:
+        return []
+    return insert_with_ids(SupportEvent.__tablename__, ('id',) + EVENT_COLUMNS, event_rows)
+
+
+class PendingTotals:
+    """Leaderboard and rollup updates of inserted batches, applied in one pass by write().
+
+    Bulk import commits its hours a batch at a time but sums their support events
+    and folds their rollups once at the end, instead of once per batch.
+    """
+
+    def __init__(self):
+        self.event_ranges = []  # [first, last] support_event ids of the batches
+        self.rollups = rollups.Pending()
+
+    def add(self, batch, event_ids):
+        if event_ids:
+            if self.event_ranges and self.event_ranges[-1][1] + 1 == event_ids[0]:
+                self.event_ranges[-1][1] = event_ids[-1]
+            else:
+                self.event_ranges.append([event_ids[0], event_ids[-1]])
+        self.rollups.add(batch)
+
+    def write(self):
+        """Add the pending events to their leaderboards and fold the pending rollups; the caller commits."""
+        if self.event_ranges:
+            leaderboards.record_events(or_(*(SupportEvent.id.between(first, last) for first, last in self.event_ranges)))
+            self.event_ranges = []
+        self.rollups.write()
+
+
+def write_batch(batch, totals=None):
+    """Insert HourlyStat mappings with stream_id, started_at and created_at set, with their events, leaderboards and rollups; the caller commits.
+
+    With totals (a PendingTotals), the leaderboards and rollups are left to its write().
+    """
+    event_ids = insert_batch(batch)
+    chart_cache.changed(db.session, {mapping['stream_id'] for mapping in batch})
+    pending = totals or PendingTotals()
+    pending.add(batch, event_ids)
+    if totals is None:
+        pending.write()
+
+
+def import_records(records, batch_size=BATCH_SIZE, progress=None):
+    """Validate and insert (row number, record) pairs in batched transactions."""
+    result = ImportResult()
+    totals = PendingTotals()
+    streams = StreamResolver(result)
+    starts = timebuckets.HourStarts()
+    pending = []  # (row number, stream key, mapping)
+    now = datetime.utcnow()
+
+    def flush():
+        keys = {key for _, key, _ in pending}
+        streams.resolve(keys)
+        starts.load(streams.get(key)[0] for key in keys if streams.get(key))
+        batch = []
+        for number, key, mapping in pending:
+            stream = streams.get(key)
+            if stream is None:
+                result.error(number, f'Stream {key[1]} does not exist')
+                continue
+            mapping['stream_id'], stream_date = stream
+            if mapping['started_at'] is None:
+                # Backfilled rows belong to the period of their stream, not the import day
+                mapping['started_at'] = starts.start(mapping['stream_id'], stream_date, mapping['hour'])
+            if mapping['created_at'] is None:
+                mapping['created_at'] = now
+            batch.append(mapping)
+        if batch:
+            write_batch(batch, totals)
+        db.session.commit()
+        result.imported += len(batch)
+        pending.clear()
+        if progress:
+            progress(result)
+
+    try:
+        try:
+            for number, record in records:
+                if isinstance(record, RowError):
+                    result.error(number, str(record))
+                    continue
+                try:
+                    stream_key, mapping = parse_row(record)
+                except RowError as exc:
+                    result.error(number, str(exc))
+                    continue
+                pending.append((number, stream_key, mapping))
+                if len(pending) >= batch_size:
+                    flush()
+        except (ValueError, csv.Error) as exc:
+            # Broken JSON array, undecodable bytes or similar: keep the rows read so far
+            result.aborted = str(exc)
+        if pending:
+            flush()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        # Leaderboards and rollups of the committed batches, in one pass
+        totals.write()
+        db.session.commit()
+    return result
+
+
+class _Rewound:
+    """A text stream with an already-read head put back in front of it."""
+
+    def __init__(self, head, stream):
+        self._head = io.StringIO(head)
+        self._stream = stream
+
+    def read(self, size=-1):
+        data = self._head.read(size)
+        if size is None or size < 0:
+            return data + self._stream.read()
+        return data or self._stream.read(size)
+
+    def __iter__(self):
+        yield from self._head
+        yield from self._stream
+
+
+def import_file(stream, fmt=None, filename=None, batch_size=BATCH_SIZE, progress=None):
+    """Import hourly stats from a binary or text file object in CSV, JSON or JSON lines format."""
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt is None:
+        fmt = detect_format(filename)
+        if fmt == 'csv' and not (filename and filename.lower().endswith('.csv')):
+            # Sniff the content; complete the line so CSV and JSON lines parsing can resume from it
+            try:
+                head = stream.read(READ_CHUNK)
+                head += stream.readline()
+            except ValueError as exc:  # Undecodable bytes (UnicodeDecodeError) in the head
+                result = ImportResult()
+                result.aborted = str(exc)
+                return result
+            fmt = detect_format(head=head)
+            stream = _Rewound(head, stream)
+    return import_records(iter_records(stream, fmt), batch_size=batch_size, progress=progress)
+
+
 def insert_data(viewer_data):
-    from src.database.models import ViewerCount, Follower, Subscriber, BitDonor, GiftSubber, Donor
-    from src.database import db
-
-    # Extract data from the input
-    date = viewer_data.get('date')
-    viewer_count = viewer_data.get('viewer_count')
-    followers = viewer_data.get('followers')
-    subscribers = viewer_data.get('subscribers')
-    bit_donors = viewer_data.get('bit_donors')
-    gift_subbers = viewer_data.get('gift_subbers')
-    overall_donors = viewer_data.get('overall_donors')
-
-    # Create instances of the models
-    viewer_count_entry = ViewerCount(date=date, count=viewer_count)
-    follower_entry = Follower(date=date, count=followers)
-    subscriber_entry = Subscriber(date=date, count=subscribers)
-    bit_donor_entry = BitDonor(date=date, count=bit_donors)
-    gift_subber_entry = GiftSubber(date=date, count=gift_subbers)
-    donor_entry = Donor(date=date, count=overall_donors)
-
-    # Insert data into the database
-    db.session.add(viewer_count_entry)
-    db.session.add(follower_entry)
-    db.session.add(subscriber_entry)
-    db.session.add(bit_donor_entry)
-    db.session.add(gift_subber_entry)
-    db.session.add(donor_entry)
-
-    # Commit the session to save the data
-    db.session.commit()
\ No newline at end of file
+    """Import a single hourly stat given as a dict in the bulk import format."""
+    return import_records([(1, viewer_data)])
@@ -0,0 +1,77 @@
+from sqlalchemy import func, insert
+
+from extensions import db
+from models import SupportEvent
+
+# Event kind -> HourlyStat text column it is parsed from
+KIND_COLUMNS = {
+    'sub': 'subs',
+    'donation': 'donations',
+    'sub_donation': 'sub_donations',
+    'bit': 'bit_donations',
+}
+
+
+def parse_usernames(blob):
+    # "alice,bob" -> ["alice", "bob"]
+    if not blob:
+        return []
+    return [name.strip() for name in blob.split(',') if name.strip()]
+
+
+def parse_bits(blob):
+    # "alice:100;bob:50" -> [("alice", 100), ("bob", 50)]; malformed entries are skipped
+    pairs = []
+    if not blob:
+        return pairs
+    for entry in blob.split(';'):
+        username, _, amount = entry.rpartition(':')
+        username = username.strip()
+        if not username:
+            continue
+        try:
+            pairs.append((username, int(amount)))
+        except ValueError:
+            continue
+    return pairs
+
+
+def event_mappings(stat):
+    """Insert mappings for every event in a stat's text columns.
+
+    stat can be an HourlyStat or any row exposing the same attribute names;
+    created_at is optional (archived rows have none).
+    """
+    base = {
+        'stream_id': stat.stream_id, 'hourly_stat_id': stat.id, 'started_at': stat.started_at,
+        'created_at': getattr(stat, 'created_at', None),
+    }
+    mappings = []
+    for kind, column in KIND_COLUMNS.items():
+        blob = getattr(stat, column)
+        if kind == 'bit':
+            pairs = parse_bits(blob)
+        else:
+            pairs = [(username, 1) for username in parse_usernames(blob)]
+        mappings.extend(dict(base, kind=kind, username=username, amount=amount) for username, amount in pairs)
+    return mappings
+
+
+def bulk_insert_events(mappings):
+    # Single executemany INSERT; the caller owns the transaction
+    if mappings:
+        db.session.execute(insert(SupportEvent), mappings)
+    return len(mappings)
+
+
+def top_supporters(kind, since=None, stream_id=None, limit=10, until=None):
+    """[(username, events, amount)] ranked by total amount for one event kind."""
+    amount = func.sum(SupportEvent.amount)
+    query = db.session.query(SupportEvent.username, func.count(SupportEvent.id), amount).filter(SupportEvent.kind == kind)
+    if stream_id is not None:
+        query = query.filter(SupportEvent.stream_id == stream_id)
+    if since is not None:
+        query = query.filter(SupportEvent.started_at >= since)
+    if until is not None:
+        query = query.filter(SupportEvent.started_at < until)
+    return query.group_by(SupportEvent.username).order_by(amount.desc(), SupportEvent.username).limit(limit).all()
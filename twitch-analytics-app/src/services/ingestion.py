@@ -0,0 +1,461 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import os
+
+from sqlalchemy.dialects.sqlite import insert
+
+from extensions import db
+from models import IngestCheckpoint
+from services import data_insertion, events
+
+# Live ingestion of chat and event feed events into hourly stats.
+#
+# A source yields lists of (position, event) pairs; an Ingestor aggregates them in memory
+# into one bucket per stream and clock hour, and on a timer writes the buckets
+# whose hour has ended as HourlyStat rows (with their support events, rollups
+# and leaderboards) in a single transaction. The same transaction saves a
+# checkpoint: the position of the last applied event plus the still-open
+# buckets. After a crash the ingestor restores the open buckets and resumes a
+# replayable source right after that position, so every event is counted once.
+#
+# Events are JSON objects with a type and optional at (ISO time, default now in
+# UTC) and stream_id (default: the ingestor's stream, or a stream per date):
+#
+#   {"type": "viewers", "count": 532, "at": "2025-03-01T20:14:00"}
+#   {"type": "follow", "username": "alice"}           (optional "count")
+#   {"type": "sub" | "donation" | "sub_donation", "username": "bob"}
+#   {"type": "bit", "username": "carol", "amount": 500}
+#
+# An hour's viewers are the mean of its viewer samples, or the stream's latest
+# sample when it has none. An hour is written once events more than
+# `lateness` past its end have been seen, or once the source has been idle for
+# `idle_timeout` seconds past it; events that arrive for a written hour are
+# counted as late and dropped.
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 5.0
+QUEUE_SIZE = 64  # Lists of events
+READ_SIZE = 64 * 1024
+LATENESS = timedelta(minutes=2)
+IDLE_TIMEOUT = 300.0
+USERNAME_KINDS = ('sub', 'donation', 'sub_donation')
+RESERVED = data_insertion.RESERVED
+HOUR = timedelta(hours=1)
+_END = object()
+
+
+class EventError(ValueError):
+    pass
+
+
+class JsonLinesSource:
+    """Events from a JSON lines file; the position is a byte offset.
+
+    With follow=True the file is polled for new lines (tail -f) instead of
+    ending at end of file, and a line is only read once its newline is written.
+    """
+
+    replayable = True
+
+    def __init__(self, path, follow=False, poll_interval=0.5):
+        self.path = os.path.abspath(path)
+        self.name = f'file:{self.path}'
+        self.follow = follow
+        self.poll_interval = poll_interval
+
+    async def batches(self, position=None):
+        offset = int(position or 0)
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                lines = f.readlines(READ_SIZE)
+                if lines and not lines[-1].endswith(b'\n') and self.follow:
+                    f.seek(-len(lines.pop()), os.SEEK_CUR)  # Not completely written yet
+                if not lines:
+                    if not self.follow:
+                        return
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                batch = []
+                for line in lines:
+                    offset += len(line)
+                    if not line.strip():
+                        continue
+                    try:
+                        batch.append((offset, json.loads(line.decode())))
+                    except ValueError as exc:
+                        batch.append((offset, EventError(f'Invalid JSON at byte {offset - len(line)}: {exc}')))
+                yield batch
+
+
+class WebSocketSource:
+    """Events sent as JSON text messages to a local WebSocket server.
+
+    Needs the websockets package. Messages are read no faster than they are
+    consumed, so a busy ingestor slows its senders down over TCP. The source
+    cannot be replayed: events received after the last checkpoint are lost if
+    the process dies.
+    """
+
+    replayable = False
+
+    def __init__(self, host='127.0.0.1', port=8765, queue_size=1000):
+        self.host = host
+        self.port = port
+        self.name = f'ws:{host}:{port}'
+        self.queue_size = queue_size
+
+    async def batches(self, position=None):
+        from websockets.asyncio.server import serve
+
+        received = asyncio.Queue(self.queue_size)
+
+        async def handler(connection):
+            async for message in connection:
+                await received.put(message)
+
+        async with serve(handler, self.host, self.port):
+            logger.info('Listening for events on ws://%s:%s', self.host, self.port)
+            while True:
+                messages = [await received.get()]
+                while not received.empty():
+                    messages.append(received.get_nowait())
+                batch = []
+                for message in messages:
+                    try:
+                        batch.append((None, json.loads(message)))
+                    except ValueError as exc:
+                        batch.append((None, EventError(f'Invalid JSON message: {exc}')))
+                yield batch
+
+
+class Bucket:
+    """Aggregated events of one stream and clock hour."""
+
+    __slots__ = ('samples', 'viewers', 'followers', 'usernames', 'bits')
+
+    def __init__(self, samples=0, viewers=0, followers=0, usernames=None, bits=None):
+        self.samples = samples  # Viewer samples and their sum
+        self.viewers = viewers
+        self.followers = followers
+        self.usernames = usernames or {kind: [] for kind in USERNAME_KINDS}
+        self.bits = bits or []  # [username, amount]
+
+    def to_json(self):
+        return [self.samples, self.viewers, self.followers, self.usernames, self.bits]
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(*value)
+
+    def mapping(self, start, last_viewers):
+        """HourlyStat insert mapping without stream_id."""
+        mapping = {
+            'hour': f'{start.hour}:00',
+            'viewers': round(self.viewers / self.samples) if self.samples else last_viewers,
+            'followers': self.followers,
+            'bit_donations': ';'.join(f'{username}:{amount}' for username, amount in self.bits),
+            'started_at': start,
+            'created_at': datetime.now(timezone.utc).replace(tzinfo=None),
+        }
+        for kind in USERNAME_KINDS:
+            mapping[events.KIND_COLUMNS[kind]] = ','.join(self.usernames[kind])
+        return mapping
+
+
+class IngestStats:
+    def __init__(self):
+        self.events = 0
+        self.invalid = 0
+        self.late = 0
+        self.rows = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.queue_high_water = 0
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def _stream_key_json(key):
+    return [key[0], key[1].isoformat(), key[2], key[3]] if key[0] == 'new' else list(key)
+
+
+def _stream_key(value):
+    return ('new', datetime.fromisoformat(value[1]).date(), value[2], value[3]) if value[0] == 'new' else tuple(value)
+
+
+def _count(event, name, default=None):
+    value = event.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise EventError(f'{name} must be a whole number, got {value!r}')
+    return value
+
+
+def _username(event):
+    username = str(event.get('username') or '').strip()
+    if not username or len(username) > 100 or any(ch in username for ch in RESERVED):
+        raise EventError(f'Invalid username {event.get("username")!r}')
+    return username
+
+
+class Ingestor:
+    """Aggregates events from a source into hourly stats written in batched transactions.
+
+    Backpressure: the source feeds a bounded queue, and while a write is in
+    progress at most batch_size ended hours are held before the consumer waits
+    for it, which in turn stops the source once the queue is full.
+    """
+
+    def __init__(self, app, source, name=None, stream_id=None, title='', streamer=data_insertion.DEFAULT_STREAMER,
+                 flush_interval=FLUSH_INTERVAL, batch_size=data_insertion.BATCH_SIZE, queue_size=QUEUE_SIZE,
+                 lateness=LATENESS, idle_timeout=IDLE_TIMEOUT, progress=None):
+        self.app = app
+        self.source = source
+        self.name = name or source.name
+        self.stream_id = stream_id
+        self.title = title
+        self.streamer = streamer
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.lateness = lateness
+        self.idle_timeout = idle_timeout
+        self.progress = progress
+        self.stats = IngestStats()
+        self.position = None  # Of the last applied event
+        self.watermark = None  # Latest event time seen
+        self.buckets = {}  # (stream key, hour start) -> Bucket
+        self.ended = []  # [(stream key, HourlyStat mapping)] whose hour has ended, not yet written
+        self.last_viewers = {}  # stream key -> latest viewer sample
+        self._close_at = None  # When the earliest open bucket ends, plus lateness
+        self._checkpointed = 0  # stats.events when the last checkpoint was taken
+        self._writing = None
+        self._stopping = False
+        self._reader = None
+
+    # Checkpoints
+
+    def _state(self):
+        return json.dumps({
+            'position': self.position,
+            'watermark': self.watermark.isoformat() if self.watermark else None,
+            'buckets': [[_stream_key_json(key), start.isoformat(), bucket.to_json()] for (key, start), bucket in self.buckets.items()],
+            'last_viewers': [[_stream_key_json(key), viewers] for key, viewers in self.last_viewers.items()],
+        })
+
+    def restore(self):
+        with self.app.app_context():
+            checkpoint = db.session.get(IngestCheckpoint, self.name)
+            state = json.loads(checkpoint.state) if checkpoint else None
+            db.session.rollback()
+        if state is None:
+            return False
+        self.position = state['position']
+        self.watermark = datetime.fromisoformat(state['watermark']) if state['watermark'] else None
+        for key, start, bucket in state['buckets']:
+            self.buckets[_stream_key(key), datetime.fromisoformat(start)] = Bucket.from_json(bucket)
+        self.last_viewers = {_stream_key(key): viewers for key, viewers in state['last_viewers']}
+        self._schedule_close()
+        return True
+
+    # Aggregation
+
+    def _stream(self, event, at):
+        stream_id = event.get('stream_id', self.stream_id)
+        if stream_id is not None:
+            return ('id', _count({'stream_id': stream_id}, 'stream_id'))
+        return ('new', at.date(), self.title, self.streamer)
+
+    def apply(self, position, event):
+        self.position = position
+        self.stats.events += 1
+        try:
+            if isinstance(event, EventError):
+                raise event
+            if not isinstance(event, dict):
+                raise EventError('Event must be an object')
+            kind = event.get('type')
+            at = event.get('at')
+            if at is None:
+                at = datetime.now(timezone.utc).replace(tzinfo=None)
+            else:
+                try:
+                    at = datetime.fromisoformat(str(at))
+                except ValueError:
+                    raise EventError(f'at must be an ISO date/time, got {at!r}')
+                if at.tzinfo is not None:
+                    at = at.astimezone(timezone.utc).replace(tzinfo=None)
+            stream = self._stream(event, at)
+            start = at.replace(minute=0, second=0, microsecond=0)
+            if self.watermark is not None and start + HOUR + self.lateness <= self.watermark:
+                self.stats.late += 1
+                return
+            key = (stream, start)
+            bucket = self.buckets.get(key)
+            new_bucket = bucket is None
+            if new_bucket:
+                bucket = Bucket()
+            if kind == 'viewers':
+                count = _count(event, 'count')
+                bucket.samples += 1
+                bucket.viewers += count
+                self.last_viewers[stream] = count
+            elif kind == 'follow':
+                bucket.followers += _count(event, 'count', 1)
+            elif kind in USERNAME_KINDS:
+                bucket.usernames[kind].append(_username(event))
+            elif kind == 'bit':
+                amount = _count(event, 'amount')
+                if not amount:
+                    raise EventError('amount must be positive')
+                bucket.bits.append([_username(event), amount])
+            else:
+                raise EventError(f'Unknown event type {kind!r}')
+        except EventError as exc:
+            self.stats.invalid += 1
+            if self.stats.invalid <= 10:
+                logger.warning('Skipped event at %s: %s', position, exc)
+            return
+        if new_bucket:
+            self.buckets[key] = bucket
+            self._schedule_close()
+        if self.watermark is None or at > self.watermark:
+            self.watermark = at
+            if self._close_at is not None and at >= self._close_at:
+                self.close_ended()
+
+    def _schedule_close(self):
+        self._close_at = min((start for _, start in self.buckets), default=None)
+        if self._close_at is not None:
+            self._close_at += HOUR + self.lateness
+
+    def close_ended(self, everything=False):
+        """Move the buckets whose hour has ended (or all of them) to the write queue."""
+        for key in sorted(self.buckets, key=lambda key: key[1]):
+            stream, start = key
+            if everything or start + HOUR + self.lateness <= self.watermark:
+                self.ended.append((stream, self.buckets.pop(key).mapping(start, self.last_viewers.get(stream, 0))))
+        self._schedule_close()
+
+    # Writes
+
+    def _write(self, ended, state):
+        with self.app.app_context():
+            try:
+                streams = data_insertion.StreamResolver(data_insertion.ImportResult())
+                streams.resolve(stream for stream, _ in ended)
+                batch = []
+                for stream_key, mapping in ended:
+                    stream = streams.get(stream_key)
+                    if stream is None:
+                        logger.warning('Dropped the %s hour of stream %s, which does not exist', mapping['started_at'], stream_key[1])
+                        continue
+                    batch.append(dict(mapping, stream_id=stream[0]))
+                if batch:
+                    data_insertion.write_batch(batch)
+                statement = insert(IngestCheckpoint.__table__).values(
+                    source=self.name, state=state, updated_at=datetime.now(timezone.utc).replace(tzinfo=None),
+                )
+                db.session.execute(statement.on_conflict_do_update(
+                    index_elements=['source'], set_={'state': statement.excluded.state, 'updated_at': statement.excluded.updated_at},
+                ))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            return len(batch)
+
+    async def _write_async(self, ended, state, version):
+        try:
+            rows = await asyncio.to_thread(self._write, ended, state)
+        except Exception:
+            logger.exception('Writing %d hours failed; retrying with the next flush', len(ended))
+            self.stats.failed_flushes += 1
+            self.ended[:0] = ended
+            return
+        self._checkpointed = version
+        self.stats.rows += rows
+        self.stats.flushes += 1
+        if self.progress:
+            self.progress(self.stats)
+
+    async def flush(self, wait=False):
+        """Start writing the ended hours and a checkpoint, unless nothing changed since the last one."""
+        if self._writing is not None:
+            if not self._writing.done() and not wait and len(self.ended) < self.batch_size:
+                return
+            await self._writing  # Backpressure: stop consuming until the previous write lands
+            self._writing = None
+        if not self.ended and self.stats.events == self._checkpointed:
+            return
+        ended, self.ended = self.ended, []
+        self._writing = asyncio.create_task(self._write_async(ended, self._state(), self.stats.events))
+        if wait:
+            await self._writing
+            self._writing = None
+
+    # Running
+
+    async def _read(self, queue):
+        async for batch in self.source.batches(self.position if self.source.replayable else None):
+            await queue.put(batch)
+            self.stats.queue_high_water = max(self.stats.queue_high_water, queue.qsize())
+        await queue.put(_END)
+
+    def stop(self):
+        """Stop reading, write what has been aggregated and keep the open hours in the checkpoint."""
+        self._stopping = True
+        if self._reader is not None:
+            self._reader.cancel()
+
+    async def run(self):
+        """Ingest until the source ends (writing every open hour) or stop() is called."""
+        await asyncio.to_thread(self.restore)
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(self.queue_size)
+        self._reader = asyncio.create_task(self._read(queue))
+        deadline = loop.time() + self.flush_interval
+        last_event = loop.time()
+        ended = False
+        try:
+            while not self._stopping:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    if self._reader.done() and not self._reader.cancelled() and self._reader.exception():
+                        raise self._reader.exception()
+                    try:
+                        item = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+                    except asyncio.TimeoutError:
+                        item = None
+                if item is _END:
+                    ended = True
+                    break
+                if item is not None:
+                    for position, event in item:
+                        self.apply(position, event)
+                    last_event = loop.time()
+                now = loop.time()
+                if now >= deadline or len(self.ended) >= self.batch_size:
+                    if now - last_event >= self.idle_timeout and self.buckets:
+                        # Nothing arrived for a while: let wall-clock time end the open hours
+                        clock = datetime.now(timezone.utc).replace(tzinfo=None)
+                        self.watermark = max(self.watermark or clock, clock)
+                        self.close_ended()
+                    await self.flush()
+                    deadline = loop.time() + self.flush_interval
+        finally:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except (asyncio.CancelledError, Exception):
+                pass
+        if ended:
+            self.close_ended(everything=True)
+        await self.flush(wait=True)
+        return self.stats
+
@@ -0,0 +1,113 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import uuid
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job:
+    def __init__(self, key, filename):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.filename = filename
+        self.status = QUEUED
+        self.progress = 0
+        self.message = 'Queued'
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def report(self, progress, message=None):
+        # Called from the worker thread; plain attribute writes are atomic enough for polling
+        self.progress = max(0, min(100, int(progress)))
+        if message:
+            self.message = message
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'error': self.error,
+            'filename': self.filename,
+        }
+
+
+class JobQueue:
+    """Runs report builders on a small thread pool inside the Flask app context.
+
+    Jobs with the same key share one run: a second request for a queued, running or
+    finished job gets the existing job back instead of building the report again.
+    Finished results are kept in memory for download until max_finished newer
+    jobs have completed.
+    """
+
+    def __init__(self, max_workers=2, max_finished=32):
+        self.max_workers = max_workers
+        self.max_finished = max_finished
+        self.app = None
+        self._executor = None
+        self._jobs = {}
+        self._by_key = {}
+        self._finished = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.max_workers = app.config.setdefault('REPORT_JOB_WORKERS', self.max_workers)
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='report-job')
+        return self._executor
+
+    def submit(self, key, filename, build):
+        """Queue build(job) -> bytes under key, or return the job already registered for it."""
+        with self._lock:
+            job = self._by_key.get(key)
+            if job is not None and job.status != FAILED:
+                return job
+            job = Job(key, filename)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            self._pool().submit(self._run, job, build)
+            return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _run(self, job, build):
+        job.status = RUNNING
+        job.report(0, 'Starting')
+        try:
+            with self.app.app_context():
+                job.result = build(job)
+            job.status = DONE
+            job.report(100, 'Ready')
+        except Exception as exc:
+            self.app.logger.exception('Report job %s failed', job.id)
+            job.status = FAILED
+            job.error = str(exc)
+            job.message = 'Failed'
+        job.finished_at = time.time()
+        self._retire(job)
+
+    def _retire(self, job):
+        # Bound the memory held by finished PDFs
+        with self._lock:
+            self._finished[job.id] = job
+            while len(self._finished) > self.max_finished:
+                _, old = self._finished.popitem(last=False)
+                self._jobs.pop(old.id, None)
+                if self._by_key.get(old.key) is old:
+                    del self._by_key[old.key]
+
+
+report_jobs = JobQueue()
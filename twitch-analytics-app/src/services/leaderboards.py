@@ -0,0 +1,291 @@
+from collections import defaultdict
+from datetime import date, datetime
+from functools import lru_cache
+import heapq
+
+from flask import current_app
+from sqlalchemy import and_, bindparam, delete, func, literal, or_, select
+from sqlalchemy.dialects.sqlite import insert
+
+from extensions import db
+from models import SupportEvent, SupporterTotal
+from services import events as support_events, rollups
+from services.archive import Scope, archive
+
+# Top supporter leaderboards per stream, per calendar day, month and year, and all-time.
+#
+# Every write path adds its new support events to supporter_total rows keyed by
+# (scope, kind, username), so a leaderboard is one indexed read of a scope (or a
+# GROUP BY over at most 31 + 11 period scopes) instead of a scan of support_event
+# or the HourlyStat text columns. Bulk writes sum the rows they just inserted into
+# support_event inside SQLite with record_events(); single hours use record().
+# With LEADERBOARD_CAPACITY set, each (scope, kind) keeps at most that many rows
+# as a Space-Saving summary, for histories with more supporters than are worth
+# storing per scope.
+
+ALL_TIME = 'all'
+REBUILD_BATCH = 20000
+QUERY_CHUNK = 500  # Scopes per IN (...) list, well under SQLite's parameter limit
+EVENT_FIELDS = ('stream_id', 'kind', 'username', 'amount', 'started_at')
+
+
+def stream_scope(stream_id):
+    return f'stream:{stream_id}'
+
+
+def period_scope(period, start):
+    return f'{period}:{start.isoformat()}'
+
+
+@lru_cache(maxsize=1024)
+def _day_scopes(day):
+    # Calendar scopes of the events of hours that started on day (a date or its ISO text)
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return (period_scope('day', day), period_scope('month', day.replace(day=1)), period_scope('year', day.replace(month=1, day=1)), ALL_TIME)
+
+
+def capacity():
+    """Rows kept per scope and kind, or None for exact counts."""
+    return current_app.config.get('LEADERBOARD_CAPACITY')
+
+
+class SpaceSaving:
+    """Weighted Space-Saving summary (Metwally et al.) with at most capacity counters.
+
+    counters maps username -> [events, amount, error]. When the summary is full,
+    a new username takes over the counter with the smallest amount and adds to
+    it, so the heaviest supporters are always kept, amounts never undercount, and
+    error bounds how much a counter overcounts.
+    """
+
+    def __init__(self, capacity, counters=None):
+        self.capacity = capacity
+        self.counters = counters if counters is not None else {}
+        self.evicted = set()
+        self._heap = [(counter[1], username) for username, counter in self.counters.items()]
+        heapq.heapify(self._heap)
+
+    def add(self, username, events, amount):
+        counter = self.counters.get(username)
+        if counter is None:
+            if len(self.counters) < self.capacity:
+                counter = self.counters[username] = [0, 0, 0]
+            else:
+                victim = self._pop_min()
+                counter = self.counters[username] = self.counters.pop(victim)
+                counter[2] = counter[1]
+                self.evicted.add(victim)
+            self.evicted.discard(username)
+        counter[0] += events
+        counter[1] += amount
+        heapq.heappush(self._heap, (counter[1], username))
+
+    def _pop_min(self):
+        # The heap keeps superseded (amount, username) entries; skip them
+        while True:
+            amount, username = heapq.heappop(self._heap)
+            counter = self.counters.get(username)
+            if counter is not None and counter[1] == amount:
+                return username
+
+
+def record(events):
+    """Add new support events to their leaderboards; the caller commits.
+
+    events are SupportEvent mappings or tuples in data_insertion.EVENT_COLUMNS
+    order, with started_at as a datetime or the text SQLite stores.
+    """
+    totals = defaultdict(lambda: [0, 0])  # (scope, kind, username) -> [events, amount]
+    for event in events:
+        if isinstance(event, dict):
+            stream_id, kind, username, amount, started_at = (event[name] for name in EVENT_FIELDS)
+        else:
+            stream_id, _, kind, username, amount, started_at = event[:6]
+        if started_at is None:
+            scopes = (ALL_TIME,)
+        else:
+            scopes = _day_scopes(started_at.date() if isinstance(started_at, datetime) else started_at[:10])
+        for scope in (stream_scope(stream_id),) + scopes:
+            total = totals[scope, kind, username]
+            total[0] += 1
+            total[1] += amount
+    if not totals:
+        return
+    limit = capacity()
+    if limit is None:
+        _add_exact(totals)
+    else:
+        _add_approximate(totals, limit)
+
+
+def _add_exact(totals):
+    statement = insert(SupporterTotal.__table__)
+    old, new = statement.table.c, statement.excluded
+    db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=['scope', 'kind', 'username'],
+            set_={'events': old.events + new.events, 'amount': old.amount + new.amount},
+        ),
+        [
+            {'scope': scope, 'kind': kind, 'username': username, 'events': events, 'amount': amount, 'error': 0}
+            for (scope, kind, username), (events, amount) in totals.items()
+        ],
+    )
+
+
+def _add_approximate(totals, limit):
+    groups = defaultdict(dict)  # (scope, kind) -> {username: [events, amount]}
+    for (scope, kind, username), total in totals.items():
+        groups[scope, kind][username] = total
+    stored = defaultdict(dict)  # (scope, kind) -> {username: [events, amount, error]}
+    scopes = sorted({scope for scope, _ in groups})
+    for offset in range(0, len(scopes), QUERY_CHUNK):
+        rows = db.session.execute(select(
+            SupporterTotal.scope, SupporterTotal.kind, SupporterTotal.username,
+            SupporterTotal.events, SupporterTotal.amount, SupporterTotal.error,
+        ).where(SupporterTotal.scope.in_(scopes[offset:offset + QUERY_CHUNK])))
+        for scope, kind, username, events, amount, error in rows:
+            stored[scope, kind][username] = [events, amount, error]
+    removed, changed = [], []
+    for (scope, kind), entries in groups.items():
+        counters = stored.get((scope, kind), {})
+        before = set(counters)
+        summary = SpaceSaving(limit, counters)
+        for username, (events, amount) in entries.items():
+            summary.add(username, events, amount)
+        removed.extend({'s': scope, 'k': kind, 'u': username} for username in summary.evicted & before)
+        changed.extend(
+            {'scope': scope, 'kind': kind, 'username': username, 'events': counter[0], 'amount': counter[1], 'error': counter[2]}
+            for username, counter in summary.counters.items() if username in entries
+        )
+    if removed:
+        table = SupporterTotal.__table__
+        db.session.execute(delete(table).where(
+            table.c.scope == bindparam('s'), table.c.kind == bindparam('k'), table.c.username == bindparam('u'),
+        ), removed)
+    if changed:
+        statement = insert(SupporterTotal.__table__)
+        new = statement.excluded
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['scope', 'kind', 'username'],
+            set_={'events': new.events, 'amount': new.amount, 'error': new.error},
+        ), changed)
+
+
+def _scope_columns():
+    # (scope expression, criterion) per scope of a support_event row, as record() assigns them
+    event = SupportEvent.__table__.c
+    started = event.started_at.is_not(None)
+    return (
+        (literal('stream:').concat(event.stream_id), None),
+        (literal('day:').concat(func.substr(event.started_at, 1, 10)), started),
+        (literal('month:').concat(func.substr(event.started_at, 1, 7)).concat('-01'), started),
+        (literal('year:').concat(func.substr(event.started_at, 1, 4)).concat('-01-01'), started),
+        (literal(ALL_TIME), None),
+    )
+
+
+def record_events(*criteria):
+    """Add the support_event rows matching criteria to their leaderboards; the caller commits.
+
+    Exact counts are summed by SQLite with one INSERT ... SELECT ... GROUP BY per
+    scope kind, so the events never pass through Python. With LEADERBOARD_CAPACITY
+    set, the rows are read in insertion order and passed to record().
+    """
+    if capacity() is not None:
+        rows = db.session.execute(
+            select(SupportEvent.stream_id, SupportEvent.hourly_stat_id, SupportEvent.kind, SupportEvent.username,
+                   SupportEvent.amount, SupportEvent.started_at)
+            .where(*criteria).order_by(SupportEvent.id).execution_options(yield_per=REBUILD_BATCH)
+        )
+        for batch in rows.partitions():
+            record(batch)
+        return
+    event = SupportEvent.__table__.c
+    for scope, criterion in _scope_columns():
+        query = select(scope, event.kind, event.username, func.count(), func.sum(event.amount), literal(0)).where(*criteria)
+        if criterion is not None:
+            query = query.where(criterion)
+        statement = insert(SupporterTotal.__table__).from_select(
+            ['scope', 'kind', 'username', 'events', 'amount', 'error'], query.group_by(scope, event.kind, event.username),
+        )
+        old, new = statement.table.c, statement.excluded
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['scope', 'kind', 'username'],
+            set_={'events': old.events + new.events, 'amount': old.amount + new.amount},
+        ))
+
+
+def clear():
+    db.session.execute(delete(SupporterTotal))
+
+
+def rebuild():
+    """Regenerate every leaderboard from the archive and support_event in insertion order; the caller commits.
+
+    Archived hours keep their events in the text columns, which are parsed again.
+    Returns the number of supporter_total rows.
+    """
+    clear()
+    batch = []
+    for row in archive.rows(Scope(), with_streams=False):
+        batch.extend(support_events.event_mappings(row))
+        if len(batch) >= REBUILD_BATCH:
+            record(batch)
+            batch = []
+    record(batch)
+    record_events()
+    return db.session.scalar(select(func.count()).select_from(SupporterTotal))
+
+
+# Readers return [(username, events, amount, error)] ranked by amount, then username
+
+def top(kind, scope=ALL_TIME, limit=10):
+    return db.session.execute(
+        select(SupporterTotal.username, SupporterTotal.events, SupporterTotal.amount, SupporterTotal.error)
+        .where(SupporterTotal.scope == scope, SupporterTotal.kind == kind)
+        .order_by(SupporterTotal.amount.desc(), SupporterTotal.username)
+        .limit(limit)
+    ).all()
+
+
+def stream_top(stream_id, kind, limit=10):
+    return top(kind, stream_scope(stream_id), limit)
+
+
+def _scope_range(period, start, end=None):
+    # Scopes of one period kind from start up to end; ISO dates sort as text
+    scope = SupporterTotal.scope
+    if end is None:
+        return scope.between(period_scope(period, start), f'{period}:9999')
+    return and_(scope >= period_scope(period, start), scope < period_scope(period, end))
+
+
+def top_since(kind, start, limit=10, end=None):
+    """Leaderboard of the events of hours that started on or after the date start and before end.
+
+    The current year reads its year scope. Other ranges sum the day scopes of the
+    partial months at either end with the month scopes in between, as in
+    rollups.summary_since().
+    """
+    if end is None and start.month == 1 and start.day == 1 and start.year == date.today().year:
+        return top(kind, period_scope('year', start), limit)
+    first, last = rollups.month_span(start, end)
+    if last is None:
+        criterion = or_(_scope_range('day', start, first), _scope_range('month', first))
+    else:
+        criterion = or_(
+            _scope_range('day', start, min(first, end)), _scope_range('month', first, last), _scope_range('day', last, end),
+        )
+    amount = func.sum(SupporterTotal.amount).label('amount')
+    return db.session.execute(
+        select(
+            SupporterTotal.username, func.sum(SupporterTotal.events).label('events'), amount,
+            func.sum(SupporterTotal.error).label('error'),
+        )
+        .where(SupporterTotal.kind == kind, criterion)
+        .group_by(SupporterTotal.username)
+        .order_by(amount.desc(), SupporterTotal.username)
+        .limit(limit)
+    ).all()
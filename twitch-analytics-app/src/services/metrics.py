@@ -0,0 +1,329 @@
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+import cProfile
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+from extensions import db
+
+# Request instrumentation for the Prometheus /metrics endpoint.
+#
+# Each request gets a RequestMetrics record on flask.g. SQLAlchemy cursor events
+# add query counts and execute time to it, the counting SQLite cursor adds the
+# rows fetched, and metrics.phase() blocks add chart and PDF time (net of the
+# queries run inside them). The record is folded into the per-route counters and
+# histograms when the response is closed, so streamed PDFs are measured to their
+# last byte. Work done outside a request (background report jobs) only feeds the
+# phase histograms.
+
+PREFIX = 'twitch_analytics'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+
+class CountingCursor(sqlite3.Cursor):
+    """sqlite3 cursor that reports how many rows were fetched through it when closed."""
+
+    rows_fetched = 0
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self.rows_fetched += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.rows_fetched += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self.rows_fetched += len(rows)
+        return rows
+
+    def close(self):
+        if self.rows_fetched:
+            record = current()
+            if record is not None:
+                record.rows += self.rows_fetched
+            self.rows_fetched = 0
+        super().close()
+
+
+class CountingConnection(sqlite3.Connection):
+    def cursor(self, factory=CountingCursor):
+        return super().cursor(factory)
+
+
+def counting_engine_options(options, database_uri):
+    """Engine options with row counting added for SQLite databases."""
+    if database_uri.startswith('sqlite'):
+        options = dict(options)
+        options['connect_args'] = dict(options.get('connect_args', {}), factory=CountingConnection)
+    return options
+
+
+class RequestMetrics:
+    __slots__ = ('start', 'queries', 'db_time', 'rows', 'phases', 'size', 'profiler')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.phases = defaultdict(float)
+        self.size = 0
+        self.profiler = None
+
+
+def current():
+    return g.get('_request_metrics') if has_app_context() else None
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def lines(self, name, label_names):
+        for labels, series in sorted(self.series.items()):
+            base = _labels(zip(label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                yield f'{name}_bucket{{{base},le="{bound}"}} {cumulative}'
+            yield f'{name}_sum{{{base}}} {series[-1]}'
+            yield f'{name}_count{{{base}}} {cumulative}'
+
+
+def _labels(pairs):
+    return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs)
+
+
+class Metrics:
+    """Per-route request counters and histograms, rendered in Prometheus text format.
+
+    Optional cProfile sampling: with PROFILE_SLOW_SECONDS set, PROFILE_SAMPLE_RATE
+    of requests run under a profiler and the ones slower than the threshold are
+    dumped to PROFILE_DIR (keeping the newest PROFILE_MAX_FILES).
+    """
+
+    def __init__(self):
+        self.app = None
+        self.profile_slow_seconds = None
+        self.profile_sample_rate = 0.1
+        self.profile_dir = None
+        self.profile_max_files = 100
+        self._lock = threading.Lock()
+        self._requests = defaultdict(int)  # (route, method, status) -> count
+        self._route_totals = defaultdict(lambda: defaultdict(float))  # route -> counter -> total
+        self._durations = Histogram(LATENCY_BUCKETS)
+        self._sizes = Histogram(SIZE_BUCKETS)
+        self._phases = Histogram(LATENCY_BUCKETS)
+        self._profiles = 0
+
+    def init_app(self, app):
+        self.app = app
+        slow_ms = os.environ.get('APP_PROFILE_SLOW_MS')
+        self.profile_slow_seconds = app.config.setdefault('PROFILE_SLOW_SECONDS', float(slow_ms) / 1000 if slow_ms else None)
+        self.profile_sample_rate = app.config.setdefault(
+            'PROFILE_SAMPLE_RATE', float(os.environ.get('APP_PROFILE_SAMPLE_RATE', self.profile_sample_rate)))
+        self.profile_dir = app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        self.profile_max_files = app.config.setdefault('PROFILE_MAX_FILES', self.profile_max_files)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    # Request lifecycle
+
+    def _before_request(self):
+        record = g._request_metrics = RequestMetrics()
+        if self.profile_slow_seconds is not None and random.random() < self.profile_sample_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except (ValueError, RuntimeError):
+                return  # Another profiler is active (Python 3.12+ allows one at a time)
+            record.profiler = profiler
+
+    def _after_request(self, response):
+        record = current()
+        if record is None:
+            return response
+        route = request.endpoint or 'unmatched'
+        method, status = request.method, response.status_code
+        finish = lambda: self._finish(record, route, method, status)  # noqa: E731
+        if response.content_length is None or response.direct_passthrough:
+            # Streamed bodies and files: count the bytes and finish when the server closes
+            # the body (direct passthrough responses skip call_on_close callbacks)
+            response.response = self._counted(response.response, record, finish)
+        else:
+            record.size = response.content_length
+            response.headers['Server-Timing'] = self.server_timing(record)
+            response.call_on_close(finish)
+        return response
+
+    @staticmethod
+    def _counted(iterable, record, finish):
+        try:
+            for chunk in iterable:
+                record.size += len(chunk)
+                yield chunk
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+            finish()
+
+    def _finish(self, record, route, method, status):
+        duration = time.perf_counter() - record.start
+        if record.profiler is not None:
+            record.profiler.disable()
+            if duration >= self.profile_slow_seconds:
+                self._dump_profile(record.profiler, route, duration)
+        with self._lock:
+            self._requests[(route, method, status)] += 1
+            totals = self._route_totals[route]
+            totals['queries'] += record.queries
+            totals['rows'] += record.rows
+            totals['db_seconds'] += record.db_time
+            for name, seconds in record.phases.items():
+                totals[f'{name}_seconds'] += seconds
+            self._durations.observe((route,), duration)
+            self._sizes.observe((route,), record.size)
+
+    def server_timing(self, record):
+        """Server-Timing header value with the phases measured so far."""
+        parts = [f'db;dur={record.db_time * 1000:.1f};desc="{record.queries} queries, {record.rows} rows"']
+        parts += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in record.phases.items()]
+        parts.append(f'total;dur={(time.perf_counter() - record.start) * 1000:.1f}')
+        return ', '.join(parts)
+
+    # SQLAlchemy hooks
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        record = current()
+        if record is not None:
+            record.queries += 1
+            record.db_time += elapsed
+        with self._lock:
+            self._phases.observe(('db',), elapsed)
+
+    # Phases
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block as phase name, excluding the SQL it runs (that counts as db)."""
+        record = current()
+        db_before = record.db_time if record is not None else 0.0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if record is not None:
+                elapsed -= record.db_time - db_before
+                record.phases[name] += elapsed
+            with self._lock:
+                self._phases.observe((name,), elapsed)
+
+    def timed_iter(self, name, iterable):
+        """Yield from iterable, timing each step as phase name."""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    # Profiles
+
+    def _dump_profile(self, profiler, route, duration):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}-{route}-{duration * 1000:.0f}ms-{threading.get_ident()}.prof'
+        profiler.dump_stats(os.path.join(self.profile_dir, name))
+        with self._lock:
+            self._profiles += 1
+        try:
+            entries = sorted(
+                (entry for entry in os.scandir(self.profile_dir) if entry.name.endswith('.prof')),
+                key=lambda entry: entry.stat().st_mtime,
+            )
+        except OSError:
+            return
+        for entry in entries[:max(len(entries) - self.profile_max_files, 0)]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    # Exposition
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            name = f'{PREFIX}_http_requests_total'
+            header(name, 'counter', 'HTTP requests by route, method and status.')
+            for (route, method, status), count in sorted(self._requests.items()):
+                lines.append(f'{name}{{{_labels([("route", route), ("method", method), ("status", status)])}}} {count}')
+
+            name = f'{PREFIX}_http_request_duration_seconds'
+            header(name, 'histogram', 'Time from request start until the last response byte was sent.')
+            lines.extend(self._durations.lines(name, ('route',)))
+
+            name = f'{PREFIX}_http_response_size_bytes'
+            header(name, 'histogram', 'Response body size.')
+            lines.extend(self._sizes.lines(name, ('route',)))
+
+            for counter, kind, help_text in (
+                ('queries', 'db_queries_total', 'SQL statements executed while serving the route.'),
+                ('rows', 'db_rows_total', 'Rows fetched from SQLite while serving the route.'),
+                ('db_seconds', 'db_seconds_total', 'Time spent executing SQL while serving the route.'),
+                ('chart_seconds', 'chart_seconds_total', 'Time spent rendering charts while serving the route.'),
+                ('pdf_seconds', 'pdf_seconds_total', 'Time spent building PDFs while serving the route.'),
+            ):
+                name = f'{PREFIX}_{kind}'
+                header(name, 'counter', help_text)
+                for route, totals in sorted(self._route_totals.items()):
+                    lines.append(f'{name}{{{_labels([("route", route)])}}} {totals.get(counter, 0)}')
+
+            name = f'{PREFIX}_phase_duration_seconds'
+            header(name, 'histogram', 'Duration of each SQL statement, chart render and PDF build step, including background jobs.')
+            lines.extend(self._phases.lines(name, ('phase',)))
+
+            name = f'{PREFIX}_slow_request_profiles_total'
+            header(name, 'counter', 'cProfile dumps written for slow requests.')
+            lines.append(f'{name} {self._profiles}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,210 @@
+import zlib
+
+from fpdf.fonts import fpdf_charwidths
+
+from services.pdf_images import compiled_png
+
+# Incremental PDF 1.4 writer for long reports.
+#
+# FPDF keeps every page in memory until output(); StreamingPDF instead writes each
+# object as soon as it is complete and hands the bytes back through flush(), so a
+# report can be yielded page by page to the HTTP response. The page tree and the
+# shared resource dictionary are forward-referenced and only written by close().
+# Units are millimetres from the top-left corner, like FPDF.
+
+K = 72 / 25.4  # points per millimetre
+CELL_MARGIN = 1.0
+
+FONTS = {
+    # resource name -> (base font, width table)
+    'F1': ('Helvetica', fpdf_charwidths['helvetica']),
+    'F2': ('Helvetica-Bold', fpdf_charwidths['helveticaB']),
+}
+
+CATALOG, PAGES, RESOURCES = 1, 2, 3
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)').replace('\r', '')
+
+
+class PageCanvas:
+    """Drawing operations for one page, collected as a PDF content stream."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.ops = []
+        self.font = 'F1'
+        self.font_size = 12
+        self.text_color = '0 0 0 rg'
+
+    def set_font(self, size=12, bold=False):
+        self.font = 'F2' if bold else 'F1'
+        self.font_size = size
+
+    def set_text_color(self, r, g, b):
+        self.text_color = f'{r / 255:.3f} {g / 255:.3f} {b / 255:.3f} rg'
+
+    def text_width(self, text):
+        widths = FONTS[self.font][1]
+        return sum(widths.get(ch, 500) for ch in text) * self.font_size / 1000 / K
+
+    def fit(self, text, width):
+        # Truncate text with an ellipsis so it fits inside width millimetres
+        if self.text_width(text) <= width:
+            return text
+        while text and self.text_width(text + '...') > width:
+            text = text[:-1]
+        return text + '...'
+
+    def text(self, x, y, text):
+        """Draw text with its baseline at y."""
+        self.ops.append(
+            f'BT {self.text_color} /{self.font} {self.font_size:.2f} Tf '
+            f'{x * K:.2f} {(self.height - y) * K:.2f} Td ({_escape(text)}) Tj ET'
+        )
+
+    def cell(self, x, y, w, h, text='', border=False, fill=None, align='L', fit=True):
+        """FPDF-style cell: optional fill colour and border, text vertically centred."""
+        if fill or border:
+            rect = f'{x * K:.2f} {(self.height - y - h) * K:.2f} {w * K:.2f} {h * K:.2f} re'
+            if fill:
+                r, g, b = fill
+                self.ops.append(f'{r / 255:.3f} {g / 255:.3f} {b / 255:.3f} rg {rect} ' + ('B' if border else 'f'))
+            else:
+                self.ops.append(f'{rect} S')
+        if text:
+            if fit:
+                text = self.fit(text, w - 2 * CELL_MARGIN)
+            if align == 'C':
+                dx = (w - self.text_width(text)) / 2
+            elif align == 'R':
+                dx = w - CELL_MARGIN - self.text_width(text)
+            else:
+                dx = CELL_MARGIN
+            self.text(x + dx, y + h / 2 + 0.3 * self.font_size / K, text)
+
+    def image(self, name, x, y, w, h):
+        self.ops.append(f'q {w * K:.2f} 0 0 {h * K:.2f} {x * K:.2f} {(self.height - y - h) * K:.2f} cm /{name} Do Q')
+
+    def content(self):
+        return '\n'.join(self.ops).encode('latin1', 'replace')
+
+
+class StreamingPDF:
+    def __init__(self, width=210, height=297, compress=True):
+        self.width = width
+        self.height = height
+        self.compress = compress
+        self._pending = []
+        self._offset = 0
+        self._offsets = {}
+        self._next_obj = RESOURCES + 1
+        self._pages = []
+        self._images = {}  # PNG digest -> (resource name, object number)
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self._fonts = {}
+        for name, (base_font, _) in FONTS.items():
+            self._fonts[name] = self._add_object(
+                f'<</Type /Font /BaseFont /{base_font} /Subtype /Type1 /Encoding /WinAnsiEncoding>>'.encode()
+            )
+
+    @property
+    def pending(self):
+        return bool(self._pending)
+
+    def flush(self):
+        """Bytes written since the last flush."""
+        data = b''.join(self._pending)
+        self._pending = []
+        return data
+
+    def _write(self, data):
+        self._pending.append(data)
+        self._offset += len(data)
+
+    def _reserve(self):
+        number = self._next_obj
+        self._next_obj += 1
+        return number
+
+    def _add_object(self, body, number=None, stream=None):
+        number = number or self._reserve()
+        self._offsets[number] = self._offset
+        self._write(f'{number} 0 obj\n'.encode())
+        self._write(body)
+        if stream is not None:
+            self._write(b'\nstream\n')
+            self._write(stream)
+            self._write(b'\nendstream')
+        self._write(b'\nendobj\n')
+        return number
+
+    def _stream_object(self, dictionary, data, number=None):
+        if self.compress:
+            data = zlib.compress(data)
+            dictionary += ' /Filter /FlateDecode'
+        return self._add_object(f'<<{dictionary} /Length {len(data)}>>'.encode(), number, data)
+
+    def _image_object(self, info, colorspace, bpc, decode_parms, data, extra=''):
+        # Image data from compiled_png is already Flate-compressed PNG scanlines
+        return self._add_object(
+            (f'<</Type /XObject /Subtype /Image /Width {info["w"]} /Height {info["h"]} /ColorSpace {colorspace} '
+             f'/BitsPerComponent {bpc} /Filter /FlateDecode /DecodeParms <<{decode_parms}>>{extra} '
+             f'/Length {len(data)}>>').encode(),
+            stream=data,
+        )
+
+    def add_image(self, png):
+        """Write a PNG as an image XObject once and return its resource name."""
+        key, info = compiled_png(png)
+        if key in self._images:
+            return self._images[key][0]
+        extra = ''
+        if 'smask' in info:
+            smask = self._image_object(
+                info, '/DeviceGray', 8, f'/Predictor 15 /Colors 1 /BitsPerComponent 8 /Columns {info["w"]}', info['smask'],
+            )
+            extra += f' /SMask {smask} 0 R'
+        if isinstance(info['trns'], list):
+            extra += ' /Mask [' + ' '.join(f'{t} {t}' for t in info['trns']) + ']'
+        if info['cs'] == 'Indexed':
+            colorspace = f'[/Indexed /DeviceRGB {len(info["pal"]) // 3 - 1} <{info["pal"].hex()}>]'
+        else:
+            colorspace = f'/{info["cs"]}'
+        number = self._image_object(info, colorspace, info['bpc'], info['dp'], info['data'], extra)
+        name = f'I{len(self._images) + 1}'
+        self._images[key] = (name, number)
+        return name
+
+    def new_page(self):
+        return PageCanvas(self.width, self.height)
+
+    def end_page(self, page):
+        """Write a finished page; its bytes are available from flush() right away."""
+        content = self._stream_object('', page.content())
+        self._pages.append(self._add_object(
+            (f'<</Type /Page /Parent {PAGES} 0 R /MediaBox [0 0 {self.width * K:.2f} {self.height * K:.2f}] '
+             f'/Resources {RESOURCES} 0 R /Contents {content} 0 R>>').encode()
+        ))
+
+    def close(self):
+        """Write the resources, page tree, catalog, cross-reference table and trailer."""
+        fonts = ' '.join(f'/{name} {number} 0 R' for name, number in self._fonts.items())
+        images = ' '.join(f'/{name} {number} 0 R' for name, number in self._images.values())
+        self._add_object(
+            f'<</ProcSet [/PDF /Text /ImageB /ImageC /ImageI] /Font <<{fonts}>> /XObject <<{images}>>>>'.encode(),
+            RESOURCES,
+        )
+        kids = ' '.join(f'{number} 0 R' for number in self._pages)
+        self._add_object(f'<</Type /Pages /Kids [{kids}] /Count {len(self._pages)}>>'.encode(), PAGES)
+        self._add_object(f'<</Type /Catalog /Pages {PAGES} 0 R>>'.encode(), CATALOG)
+        info = self._add_object(b'<</Producer (Twitch Analytics App)>>')
+        xref_offset = self._offset
+        size = self._next_obj
+        lines = [f'xref\n0 {size}\n', '0000000000 65535 f \n']
+        lines.extend(f'{self._offsets[number]:010d} 00000 n \n' for number in range(1, size))
+        lines.append(f'trailer\n<</Size {size} /Root {CATALOG} 0 R /Info {info} 0 R>>\n')
+        lines.append(f'startxref\n{xref_offset}\n%%EOF\n')
+        self._write(''.join(lines).encode())
@@ -0,0 +1,212 @@
+from collections import OrderedDict, namedtuple
+from datetime import date, timedelta
+from functools import cached_property
+import threading
+import time
+
+from models import HourlyStat, Stream
+from services import aggregation, rollups, timebuckets
+from services.archive import Scope, archive, merged
+
+# Reporting periods and the data loaded for them.
+#
+# resolve() turns a period name (plus dates for custom ranges) into a Period, a
+# [start, end) range of started_at dates, so every report route selects rows the
+# same way. report_data.get() loads what a report reads at most once per period and
+# data version: a preview followed by a download, or the report page followed
+# by its PDF, share one result set for REPORT_DATA_TTL seconds. Hours of the
+# period that were moved to the archive are read from there and merged in.
+
+# Fixed periods; week is the last seven days, calendar_week starts on Monday
+FIXED = ('day', 'week', 'calendar_week', 'month', 'year')
+ROLLING = {'last_30_days': 30, 'last_90_days': 90, 'last_365_days': 365}
+CUSTOM = 'custom'
+LABELS = {
+    'day': 'Today',
+    'week': 'Past Week',
+    'calendar_week': 'This Week',
+    'month': 'This Month',
+    'year': 'This Year',
+    'last_30_days': 'Last 30 Days',
+    'last_90_days': 'Last 90 Days',
+    'last_365_days': 'Last 365 Days',
+    'custom': 'Custom Range',
+}
+NAMES = FIXED + tuple(ROLLING) + (CUSTOM,)
+
+# Period.fingerprint(): an aggregation.Fingerprint and an archive.Version
+DataVersion = namedtuple('DataVersion', ['live', 'archived'])
+
+
+class Period(namedtuple('Period', ['name', 'start', 'end'])):
+    """Hours that started on or after start and before end (both dates; end None means up to now)."""
+
+    __slots__ = ()
+
+    @property
+    def criteria(self):
+        criteria = (aggregation.started_since(self.start),)
+        if self.end is not None:
+            criteria += (HourlyStat.started_at < self.end,)
+        return criteria
+
+    @property
+    def stream_criteria(self):
+        # Streams dated in the period, for what is reported per whole stream
+        criteria = (Stream.date >= self.start,)
+        if self.end is not None:
+            criteria += (Stream.date < self.end,)
+        return criteria
+
+    @property
+    def archived(self):
+        # The period's hours in the archive
+        return Scope(self.start, self.end)
+
+    def fingerprint(self):
+        """DataVersion of the period's live and archived rows."""
+        return DataVersion(aggregation.fingerprint(*self.criteria), archive.version(self.archived))
+
+    @property
+    def unit(self):
+        # Bucket size of the period's trend table
+        return timebuckets.unit_for(self.start, self.end)
+
+    @property
+    def key(self):
+        # Text form for cache scopes and job keys
+        return f'{self.start}..{self.end or ""}'
+
+    @property
+    def last_day(self):
+        return self.end - timedelta(days=1) if self.end is not None else date.today()
+
+    @property
+    def label(self):
+        return LABELS[self.name]
+
+    @property
+    def subtitle(self):
+        return f'{self.start:%d %b %Y} to {self.last_day:%d %b %Y}'
+
+
+def resolve(name, start=None, end=None, today=None):
+    """Period for name, or None for an unknown name.
+
+    custom takes start and end as dates or ISO strings, end inclusive, and raises
+    ValueError for missing, malformed or reversed dates.
+    """
+    today = today or date.today()
+    if name == 'day':
+        return Period(name, today, None)
+    if name == 'week':
+        return Period(name, today - timedelta(days=7), None)
+    if name == 'calendar_week':
+        return Period(name, today - timedelta(days=today.weekday()), None)
+    if name == 'month':
+        return Period(name, today.replace(day=1), None)
+    if name == 'year':
+        return Period(name, today.replace(month=1, day=1), None)
+    if name in ROLLING:
+        return Period(name, today - timedelta(days=ROLLING[name] - 1), None)
+    if name == CUSTOM:
+        if not start or not end:
+            raise ValueError('A custom range needs a start and an end date')
+        start = start if isinstance(start, date) else date.fromisoformat(start)
+        end = end if isinstance(end, date) else date.fromisoformat(end)
+        if end < start:
+            raise ValueError('The end date is before the start date')
+        return Period(name, start, end + timedelta(days=1))
+    return None
+
+
+class ReportData:
+    """What a period report reads, each part loaded on first use."""
+
+    def __init__(self, period, version, max_rows):
+        self.period = period
+        self.version = version  # Period.fingerprint()
+        self.count = version.live.count + version.archived.count
+        self.max_rows = max_rows
+
+    @cached_property
+    def summary(self):
+        return rollups.summary_since(self.period.start, self.period.end) if self.count else None
+
+    @cached_property
+    def rows(self):
+        """Report table rows in time order."""
+        if not self.count:
+            return []
+        return list(merged(aggregation.stat_rows(*self.period.criteria), archive.rows(self.period.archived)))
+
+    @cached_property
+    def buckets(self):
+        """Gap-filled timebuckets.Bucket list of the period in Period.unit steps."""
+        if not self.count:
+            return []
+        return timebuckets.buckets(self.period.unit, start=self.period.start, end=self.period.end, archived=self.period.archived)
+
+    @cached_property
+    def stream_summaries(self):
+        if not self.count:
+            return {}
+        summaries = aggregation.summarize_groups(HourlyStat.stream_id, *self.period.criteria)
+        summaries.update(archive.stream_summaries(self.period.archived, *self.period.criteria, live=summaries))
+        return summaries
+
+    def stream_rows(self):
+        """Rows grouped by stream in time order; large periods are fetched lazily instead of kept."""
+        if self.count > self.max_rows and 'rows' not in self.__dict__:
+            return merged(
+                aggregation.iter_stream_rows(*self.period.criteria), archive.rows(self.period.archived, by_stream=True),
+                by_stream=True,
+            )
+        return sorted(self.rows, key=lambda row: (row.stream_id, row.started_at, row.id))
+
+    @property
+    def reusable(self):
+        return self.count <= self.max_rows
+
+
+class ReportDataCache:
+    """Short-lived memo of ReportData keyed by (period, data version)."""
+
+    def __init__(self, ttl=30, max_entries=8, max_rows=50_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._entries = OrderedDict()  # (period, version) -> (expires, ReportData)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.setdefault('REPORT_DATA_TTL', self.ttl)
+        self.max_entries = app.config.setdefault('REPORT_DATA_MAX_ENTRIES', self.max_entries)
+        # Periods with more rows are not kept between requests
+        self.max_rows = app.config.setdefault('REPORT_DATA_MAX_ROWS', self.max_rows)
+
+    def get(self, period):
+        version = period.fingerprint()
+        key = (period, version)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+        data = ReportData(period, version, self.max_rows)
+        if data.reusable and self.ttl > 0:
+            with self._lock:
+                self._entries[key] = (now + self.ttl, data)
+                for stale in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                    del self._entries[stale]
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+report_data = ReportDataCache()
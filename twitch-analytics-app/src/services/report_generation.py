@@ -1,5 +1,7 @@
 from fpdf import FPDF
 from datetime import datetime
+from services.pdf_images import compiled_png
+from services.pdf_stream import StreamingPDF
 
 class PDF(FPDF):
     def header(self):
@@ -62,4 +64,216 @@ def generate_pdf_report(viewer_data, follower_data, subscriber_data, bit_donor_d
 
     pdf_file_name = f"twitch_report_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
     pdf.output(pdf_file_name)
-    return pdf_file_name
\ No newline at end of file
+    return pdf_file_name
+
+
+class ReportPDF(FPDF):
+    def image_bytes(self, data, x=None, y=None, w=0, h=0, link=''):
+        """Place a PNG held in memory; the compiled XObject is reused across reports."""
+        key, info = compiled_png(data)
+        name = f'mem:{key}'
+        if name not in self.images:
+            # FPDF drops 'data'/'smask' from its own image dicts on output, so each
+            # document gets a shallow copy of the shared compiled image.
+            if self.pdf_version < '1.4' and 'smask' in info:
+                self.pdf_version = '1.4'
+            self.images[name] = dict(info, i=len(self.images) + 1)
+        self.image(name, x, y, w, h, link=link)
+
+
+def generate_report_pdf(stats, summary, period, chart_img_bytes=None, progress=None):
+    pdf = ReportPDF()
+    pdf.add_page()
+    # Use Arial for now (closest built-in to Inter for FPDF)
+    pdf.set_font("Arial", size=12)
+    def safe(val):
+        return str(val) if val is not None else "-"
+    if summary:
+        if period == "day":
+            pdf.set_font("Arial", "B", 20)
+            pdf.set_text_color(145, 71, 255)
+            pdf.cell(0, 15, txt="Daily Twitch Analytics Report", ln=True, align='C')
+            pdf.set_text_color(0, 0, 0)
+            pdf.set_font("Arial", size=12)
+            pdf.ln(5)
+            avg_viewers = summary.average
+            peak_viewers = summary.maximum
+            peak_hour = safe(summary.peak_hour)
+            min_viewers = summary.minimum
+            min_hour = safe(summary.low_hour)
+            std_viewers = summary.std
+            trend = "increasing" if summary.last > summary.first else "decreasing" if summary.last < summary.first else "stable"
+            summary_text = (
+                f"Summary:\n"
+                f"- Average viewers: {avg_viewers:.2f}\n"
+                f"- Peak viewers: {peak_viewers} at {peak_hour}\n"
+                f"- Lowest viewers: {min_viewers} at {min_hour}\n"
+                f"- Viewer standard deviation: {std_viewers:.2f}\n"
+                f"- Trend: {trend}\n"
+            )
+            analysis = (
+                "Analysis:\n"
+                f"- The stream started with {summary.first} viewers and ended with {summary.last} viewers.\n"
+                f"- The trend for this stream was {trend}.\n"
+                f"- Viewer engagement {'increased' if trend == 'increasing' else 'decreased' if trend == 'decreasing' else 'remained stable'} throughout the session.\n"
+                f"- Recommendation: Focus on content during peak hours ({peak_hour}) and consider engagement strategies for low periods ({min_hour}).\n"
+                f"- Prediction: If current trends continue, next stream may reach a peak of {int(peak_viewers * 1.05)} viewers."
+            )
+            pdf.multi_cell(0, 10, summary_text)
+            pdf.multi_cell(0, 10, analysis)
+            pdf.ln(5)
+            if chart_img_bytes:
+                pdf.image_bytes(chart_img_bytes, x=10, y=pdf.get_y(), w=180)
+                pdf.ln(70)
+            pdf.set_fill_color(145, 71, 255)
+            pdf.set_text_color(255, 255, 255)
+            pdf.set_font("Arial", "B", 10)
+            headers = ["Hour", "Viewers", "Followers", "Subs", "Donations", "Sub Donos", "Bit Donos"]
+            for h in headers:
+                pdf.cell(28, 10, h, 1, 0, 'C', 1)
+            pdf.ln()
+            pdf.set_font("Arial", size=10)
+            pdf.set_text_color(0, 0, 0)
+            for i, stat in enumerate(stats):
+                if progress and i % 200 == 0:
+                    progress(70 + 25 * i // len(stats), 'Writing table rows')
+                pdf.cell(28, 10, safe(stat.hour), 1)
+                pdf.cell(28, 10, safe(stat.viewers), 1)
+                pdf.cell(28, 10, safe(stat.followers), 1)
+                pdf.cell(28, 10, safe(stat.subs), 1)
+                pdf.cell(28, 10, safe(stat.donations), 1)
+                pdf.cell(28, 10, safe(stat.sub_donations), 1)
+                pdf.cell(28, 10, safe(stat.bit_donations), 1)
+                pdf.ln()
+        # Week/month/year reports are paginated and streamed by stream_period_report
+    else:
+        pdf.set_font("Arial", "B", 16)
+        pdf.set_text_color(0, 0, 0)
+        pdf.cell(0, 10, "No data for this period.", ln=True)
+    return pdf
+
+
+PERIOD_TITLES = {
+    'day': 'Daily', 'week': 'Weekly', 'calendar_week': 'Weekly', 'month': 'Monthly', 'year': 'Yearly',
+    'last_30_days': '30-Day', 'last_90_days': '90-Day', 'last_365_days': '365-Day', 'custom': 'Custom Range',
+}
+TABLE_HEADERS = ["Hour", "Viewers", "Followers", "Subs", "Donations", "Sub Donos", "Bit Donos"]
+TABLE_FIELDS = ['hour', 'viewers', 'followers', 'subs', 'donations', 'sub_donations', 'bit_donations']
+TWITCH_PURPLE = (145, 71, 255)
+MARGIN = 10
+CELL_W = 28
+ROW_H = 8
+
+
+def summary_lines(summary):
+    trend = "increasing" if summary.last > summary.first else "decreasing" if summary.last < summary.first else "stable"
+    return [
+        f"- Hours recorded: {summary.count}",
+        f"- Average viewers: {summary.average:.2f}",
+        f"- Peak viewers: {summary.maximum} at {summary.peak_hour}",
+        f"- Lowest viewers: {summary.minimum} at {summary.low_hour}",
+        f"- Viewer standard deviation: {summary.std:.2f}",
+        f"- Trend: {trend} ({summary.first} -> {summary.last} viewers)",
+    ]
+
+
+class _PagedLayout:
+    # Top-down cursor over StreamingPDF pages with automatic page breaks
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self.page = None
+        self.y = MARGIN
+        self.bottom = pdf.height - MARGIN
+
+    def new_page(self):
+        if self.page is not None:
+            self.pdf.end_page(self.page)
+        self.page = self.pdf.new_page()
+        self.y = MARGIN
+
+    def fits(self, height):
+        return self.y + height <= self.bottom
+
+    def heading(self, text, size=16, color=TWITCH_PURPLE, align='L'):
+        self.page.set_font(size, bold=True)
+        self.page.set_text_color(*color)
+        self.page.cell(MARGIN, self.y, self.pdf.width - 2 * MARGIN, size * 0.5, text, align=align)
+        self.page.set_text_color(0, 0, 0)
+        self.y += size * 0.5 + 2
+
+    def lines(self, lines, size=11, height=6):
+        self.page.set_font(size)
+        for line in lines:
+            self.page.cell(MARGIN, self.y, self.pdf.width - 2 * MARGIN, height, line)
+            self.y += height
+
+    def image(self, name, width, height):
+        self.page.image(name, MARGIN, self.y, width, height)
+        self.y += height + 4
+
+    def table_header(self):
+        self.page.set_font(9, bold=True)
+        self.page.set_text_color(255, 255, 255)
+        for i, header in enumerate(TABLE_HEADERS):
+            self.page.cell(MARGIN + i * CELL_W, self.y, CELL_W, ROW_H, header, border=True, fill=TWITCH_PURPLE, align='C')
+        self.page.set_text_color(0, 0, 0)
+        self.y += ROW_H
+
+    def table_row(self, row):
+        self.page.set_font(9)
+        for i, field in enumerate(TABLE_FIELDS):
+            value = getattr(row, field)
+            self.page.cell(MARGIN + i * CELL_W, self.y, CELL_W, ROW_H, "-" if value is None else str(value), border=True)
+        self.y += ROW_H
+
+
+def stream_period_report(period, subtitle, rollup, stream_summaries, rows, chart_img_bytes=None, progress=None):
+    """Yield a multi-page week/month/year report as PDF byte chunks.
+
+    rollup is the period-level Summary, stream_summaries maps stream_id to a
+    per-stream Summary, and rows is an iterable of table rows ordered by stream.
+    Rows are consumed lazily and every finished page is yielded straight away,
+    so only the page being drawn is held in memory.
+    """
+    pdf = StreamingPDF()
+    layout = _PagedLayout(pdf)
+    layout.new_page()
+    layout.heading(f"{PERIOD_TITLES.get(period, period.title())} Twitch Analytics Report", size=20, align='C')
+    layout.lines([subtitle], size=11)
+    layout.y += 4
+    if rollup is None:
+        layout.heading("No data for this period.", size=16, color=(0, 0, 0))
+    else:
+        layout.heading("Period Summary", size=14)
+        layout.lines([f"- Streams: {len(stream_summaries)}"] + summary_lines(rollup))
+        layout.y += 4
+        if chart_img_bytes:
+            name = pdf.add_image(chart_img_bytes)
+            layout.image(name, 180, 90)
+    yield pdf.flush()
+
+    current_stream = None
+    written = 0
+    for row in rows:
+        if row.stream_id != current_stream:
+            # Every stream starts on its own page with its own summary section
+            current_stream = row.stream_id
+            layout.new_page()
+            yield pdf.flush()
+            layout.heading(f"Stream: {row.stream_title or row.stream_date} ({row.stream_date})", size=14)
+            summary = stream_summaries.get(row.stream_id)
+            if summary:
+                layout.lines(summary_lines(summary), size=10, height=5)
+            layout.y += 3
+            layout.table_header()
+        if not layout.fits(ROW_H):
+            layout.new_page()
+            yield pdf.flush()
+            layout.table_header()
+        layout.table_row(row)
+        written += 1
+        if progress and rollup and written % 200 == 0:
+            progress(70 + 25 * written // rollup.count, 'Writing table rows')
+    pdf.end_page(layout.page)
+    pdf.close()
+    yield pdf.flush()
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+from flask import Response, request
+from werkzeug.http import is_resource_modified
+
+
+class ResponseCache:
+    """Conditional GET plus a bounded LRU cache of rendered response bodies.
+
+    Callers pass a fingerprint of the rows a response is rendered from. The ETag
+    is a hash of the cache key, that fingerprint and the cache version, so a
+    client that already holds the current version gets a 304 without anything
+    being queried beyond the fingerprint, and other clients get the stored body.
+    Each key keeps only its latest version; the cache is bounded by entries and
+    total bytes.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version = None
+        self._entries = OrderedDict()  # key -> (etag, body)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_entries = app.config.setdefault('RESPONSE_CACHE_MAX_ENTRIES', self.max_entries)
+        self.max_bytes = app.config.setdefault('RESPONSE_CACHE_MAX_BYTES', self.max_bytes)
+        # Part of every ETag; the default changes on restart so pages rendered by an
+        # older build are never revalidated
+        self.version = app.config.setdefault('RESPONSE_CACHE_VERSION', str(time.time()))
+
+    def etag(self, key, fingerprint):
+        return hashlib.sha256(repr((self.version, key, fingerprint)).encode()).hexdigest()[:32]
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, etag, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._entries[key] = (etag, body)
+            self._size += len(body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def respond(self, key, fingerprint, last_modified, build, mimetype='text/html', headers=None):
+        """Response for key at this fingerprint; build() returns the body and only runs on a miss.
+
+        A request whose If-None-Match (or, without one, If-Modified-Since) matches
+        gets a 304. Responses must be revalidated before reuse, as the rows behind
+        them can change at any time.
+        """
+        etag = self.etag(key, fingerprint)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = Response(status=304, headers=headers)
+        else:
+            body = self.get(key, etag)
+            if body is None:
+                body = build()
+                if isinstance(body, str):
+                    body = body.encode()
+                self.put(key, etag, body)
+            response = Response(body, mimetype=mimetype, headers=headers)
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+
+response_cache = ResponseCache()
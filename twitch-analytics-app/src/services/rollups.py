@@ -0,0 +1,394 @@
+from datetime import datetime, time, timedelta
+from functools import lru_cache, reduce
+import math
+
+from sqlalchemy import and_, case, delete, event, func, inspect, or_, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import HourlyStat, PeriodRollup, StreamRollup
+from services.aggregation import Summary
+from services.archive import Scope, archive, merged
+
+# Materialized viewer statistics per stream and per calendar day, week and month.
+#
+# Every write path folds its new hours into the matching rollup rows with an upsert
+# that combines running moments (count, mean, M2) the Welford/Chan way, so readers
+# get the total, average and standard deviation from one row instead of rescanning
+# hourly_stat. Edges follow summarize(): hours are ordered by started_at, then by
+# insertion, and ties on the peak or lowest viewers keep the earlier hour. The
+# *_at columns hold the started_at of the edge hours; the *_hour columns their
+# labels for display.
+#
+# Folding cannot take an hour back out (the edges have no inverse), so when the
+# ORM flushes a changed or deleted hour, the rollups of its stream and of the
+# periods it started in, before and after the change, are recomputed from their
+# hours with refresh() in the same transaction. Support events and leaderboards
+# are parsed from an hour once, when it is added, and do not follow edits. Hours
+# changed with SQL are picked up by rebuild().
+
+STATE_COLUMNS = (
+    'count', 'total', 'mean', 'm2', 'minimum', 'maximum', 'low_hour', 'peak_hour',
+    'first_hour', 'first_viewers', 'last_hour', 'last_viewers', 'total_followers',
+    'low_at', 'peak_at', 'first_at', 'last_at',
+)
+STAT_FIELDS = ('stream_id', 'hour', 'started_at', 'viewers', 'followers')
+REBUILD_BATCH = 5000
+
+
+def period_keys(started_at):
+    # (kind, start) of the day, week and month rollups an hour that started at started_at belongs to
+    return _period_keys(started_at.date())
+
+
+@lru_cache(maxsize=1024)
+def _period_keys(day):
+    return (
+        ('day', day),
+        ('week', day - timedelta(days=day.weekday())),
+        ('month', day.replace(day=1)),
+    )
+
+
+def moments(hour, started_at, viewers, followers):
+    """Rollup state of a single hourly stat."""
+    return {
+        'count': 1, 'total': viewers, 'mean': float(viewers), 'm2': 0.0,
+        'minimum': viewers, 'maximum': viewers, 'low_hour': hour, 'peak_hour': hour,
+        'first_hour': hour, 'first_viewers': viewers, 'last_hour': hour, 'last_viewers': viewers,
+        'total_followers': followers,
+        'low_at': started_at, 'peak_at': started_at, 'first_at': started_at, 'last_at': started_at,
+    }
+
+
+def merge(a, b):
+    """Combine two rollup states, b covering hours recorded after a's.
+
+    The mean and M2 use the parallel form of Welford's update (Chan et al.), which
+    for a single-hour b is Welford's step itself. upsert() evaluates the same
+    expressions in SQL, so folding rows one at a time here and there agrees.
+    """
+    count = a['count'] + b['count']
+    delta = b['mean'] - a['mean']
+    peak = b if b['maximum'] > a['maximum'] or (b['maximum'] == a['maximum'] and b['peak_at'] < a['peak_at']) else a
+    low = b if b['minimum'] < a['minimum'] or (b['minimum'] == a['minimum'] and b['low_at'] < a['low_at']) else a
+    first = b if b['first_at'] < a['first_at'] else a
+    last = b if b['last_at'] >= a['last_at'] else a
+    return {
+        'count': count,
+        'total': a['total'] + b['total'],
+        'mean': a['mean'] + delta * b['count'] / count,
+        'm2': a['m2'] + b['m2'] + delta * delta * a['count'] * b['count'] / count,
+        'minimum': low['minimum'], 'maximum': peak['maximum'],
+        'low_hour': low['low_hour'], 'peak_hour': peak['peak_hour'],
+        'first_hour': first['first_hour'], 'first_viewers': first['first_viewers'],
+        'last_hour': last['last_hour'], 'last_viewers': last['last_viewers'],
+        'total_followers': a['total_followers'] + b['total_followers'],
+        'low_at': low['low_at'], 'peak_at': peak['peak_at'],
+        'first_at': first['first_at'], 'last_at': last['last_at'],
+    }
+
+
+def add(state, hour, started_at, viewers, followers):
+    """merge(state, moments(hour, started_at, viewers, followers)) in place, for folding many rows."""
+    count = state['count'] + 1
+    delta = viewers - state['mean']
+    state['mean'] += delta / count
+    state['m2'] += delta * delta * state['count'] / count
+    state['count'] = count
+    state['total'] += viewers
+    state['total_followers'] += followers
+    if viewers > state['maximum'] or (viewers == state['maximum'] and started_at < state['peak_at']):
+        state['maximum'], state['peak_hour'], state['peak_at'] = viewers, hour, started_at
+    if viewers < state['minimum'] or (viewers == state['minimum'] and started_at < state['low_at']):
+        state['minimum'], state['low_hour'], state['low_at'] = viewers, hour, started_at
+    if started_at < state['first_at']:
+        state['first_hour'], state['first_viewers'], state['first_at'] = hour, viewers, started_at
+    if started_at >= state['last_at']:
+        state['last_hour'], state['last_viewers'], state['last_at'] = hour, viewers, started_at
+
+
+def _merge_set(statement):
+    # merge(stored row, excluded row) as the SET clause of ON CONFLICT DO UPDATE
+    old, new = statement.table.c, statement.excluded
+    count = old.count + new.count
+    delta = new.mean - old.mean
+    new_peak = or_(new.maximum > old.maximum, and_(new.maximum == old.maximum, new.peak_at < old.peak_at))
+    new_low = or_(new.minimum < old.minimum, and_(new.minimum == old.minimum, new.low_at < old.low_at))
+    new_first = new.first_at < old.first_at
+    new_last = new.last_at >= old.last_at
+    return {
+        'count': count,
+        'total': old.total + new.total,
+        'mean': old.mean + delta * new.count / count,
+        'm2': old.m2 + new.m2 + delta * delta * old.count * new.count / count,
+        'minimum': func.min(old.minimum, new.minimum),
+        'maximum': func.max(old.maximum, new.maximum),
+        'low_hour': case((new_low, new.low_hour), else_=old.low_hour),
+        'peak_hour': case((new_peak, new.peak_hour), else_=old.peak_hour),
+        'first_hour': case((new_first, new.first_hour), else_=old.first_hour),
+        'first_viewers': case((new_first, new.first_viewers), else_=old.first_viewers),
+        'last_hour': case((new_last, new.last_hour), else_=old.last_hour),
+        'last_viewers': case((new_last, new.last_viewers), else_=old.last_viewers),
+        'total_followers': old.total_followers + new.total_followers,
+        'low_at': case((new_low, new.low_at), else_=old.low_at),
+        'peak_at': case((new_peak, new.peak_at), else_=old.peak_at),
+        'first_at': case((new_first, new.first_at), else_=old.first_at),
+        'last_at': case((new_last, new.last_at), else_=old.last_at),
+    }
+
+
+def upsert(model, rows):
+    """Fold rollup states (dicts with the primary key and STATE_COLUMNS) into model's table."""
+    if not rows:
+        return
+    statement = insert(model.__table__)
+    keys = [column.name for column in model.__table__.primary_key]
+    db.session.execute(statement.on_conflict_do_update(index_elements=keys, set_=_merge_set(statement)), rows)
+
+
+def _fold(states, key, hour, started_at, viewers, followers):
+    state = states.get(key)
+    if state is None:
+        states[key] = moments(hour, started_at, viewers, followers)
+    else:
+        add(state, hour, started_at, viewers, followers)
+
+
+class Pending:
+    """Rollup states of new hours, folded as they are added and upserted by write()."""
+
+    def __init__(self):
+        self.streams, self.periods = {}, {}
+
+    def add(self, stats):
+        """Fold new hourly stats (HourlyStat objects or mappings with STAT_FIELDS) in insertion order."""
+        streams, periods = self.streams, self.periods
+        for stat in stats:
+            if not isinstance(stat, dict):
+                stat = {name: getattr(stat, name) for name in STAT_FIELDS}
+            hour, started_at, viewers, followers = stat['hour'], stat['started_at'], stat['viewers'], stat['followers']
+            _fold(streams, stat['stream_id'], hour, started_at, viewers, followers)
+            for key in period_keys(started_at):
+                _fold(periods, key, hour, started_at, viewers, followers)
+
+    def write(self):
+        """Fold the pending states into the rollup tables; the caller commits."""
+        upsert(StreamRollup, [dict(state, stream_id=stream_id) for stream_id, state in self.streams.items()])
+        upsert(PeriodRollup, [dict(state, kind=kind, start=start) for (kind, start), state in self.periods.items()])
+        self.streams, self.periods = {}, {}
+
+
+def record(stats):
+    """Fold new hourly stats into their rollups; the caller commits.
+
+    stats are HourlyStat objects or mappings with stream_id, hour, started_at,
+    viewers and followers, in insertion order.
+    """
+    pending = Pending()
+    pending.add(stats)
+    pending.write()
+
+
+STALE = 'rollups.stale'
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_stale(session, flush_context, instances):
+    # Before the flush, while deleted rows can still be loaded; new hours are folded in by record()
+    dirty = session.dirty
+    for stat in (*dirty, *session.deleted):
+        if not isinstance(stat, HourlyStat):
+            continue
+        state = inspect(stat)
+        histories = {name: state.attrs[name].load_history() for name in STAT_FIELDS}
+        if stat in dirty and not any(history.has_changes() for history in histories.values()):
+            continue  # Touched without a change to the rolled-up fields
+        streams, periods = session.info.setdefault(STALE, (set(), set()))
+        streams.update(histories['stream_id'].sum())
+        for started_at in histories['started_at'].sum():
+            if started_at is not None:
+                periods.update(period_keys(started_at))
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _refresh_stale(session, flush_context):
+    stale = session.info.pop(STALE, None)
+    if stale:
+        refresh(*stale)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_stale(session):
+    session.info.pop(STALE, None)
+
+
+def _period_end(kind, start):
+    if kind == 'day':
+        return start + timedelta(days=1)
+    if kind == 'week':
+        return start + timedelta(days=7)
+    return (start + timedelta(days=31)).replace(day=1)
+
+
+def _stream_states(rows):
+    # Rollup states with stream_id of rows in (stream_id, started_at, id) order, one stream at a time
+    current = None
+    for row in rows:
+        stream_id, hour, started_at, viewers, followers = (getattr(row, name) for name in STAT_FIELDS)
+        if current is not None and current['stream_id'] == stream_id:
+            add(current, hour, started_at, viewers, followers)
+            continue
+        if current is not None:
+            yield current
+        current = dict(moments(hour, started_at, viewers, followers), stream_id=stream_id)
+    if current is not None:
+        yield current
+
+
+def refresh(stream_ids=(), keys=()):
+    """Recompute the rollups of the given streams and (kind, start) periods from hourly_stat and the archive; the caller commits."""
+    columns = [getattr(HourlyStat, name) for name in STAT_FIELDS] + [HourlyStat.id]
+    stream_ids = sorted(stream_ids)
+    if stream_ids:
+        db.session.execute(delete(StreamRollup).where(StreamRollup.stream_id.in_(stream_ids)))
+    states = []
+    for stream_id in stream_ids:
+        rows = db.session.execute(
+            select(*columns).where(HourlyStat.stream_id == stream_id, HourlyStat.started_at.is_not(None))
+            .order_by(HourlyStat.started_at, HourlyStat.id)
+        )
+        archived = archive.rows(Scope(stream_id=stream_id), by_stream=True, with_streams=False)
+        states.extend(_stream_states(merged(rows, archived, by_stream=True)))
+    if states:
+        db.session.execute(insert(StreamRollup.__table__), states)
+    # Periods in insertion order after their archived hours, as rebuild() folds them
+    period_rows = []
+    for kind, start in sorted(keys):
+        db.session.execute(delete(PeriodRollup).where(PeriodRollup.kind == kind, PeriodRollup.start == start))
+        end = _period_end(kind, start)
+        rows = db.session.execute(
+            select(*columns).where(HourlyStat.started_at >= datetime.combine(start, time()), HourlyStat.started_at < datetime.combine(end, time()))
+            .order_by(HourlyStat.id)
+        )
+        periods = {}
+        for row in (*archive.rows(Scope(start, end), with_streams=False), *rows):
+            _fold(periods, (kind, start), row.hour, row.started_at, row.viewers, row.followers)
+        period_rows.extend(dict(state, kind=kind, start=start) for state in periods.values())
+    if period_rows:
+        db.session.execute(insert(PeriodRollup.__table__), period_rows)
+
+
+def clear():
+    db.session.execute(delete(StreamRollup))
+    db.session.execute(delete(PeriodRollup))
+
+
+def rebuild():
+    """Regenerate every rollup from hourly_stat and the archive; the caller commits. Returns (streams, periods)."""
+    clear()
+    columns = [getattr(HourlyStat, name) for name in STAT_FIELDS] + [HourlyStat.id]
+    # Streams one at a time in (stream_id, started_at) index order, so memory stays at one batch
+    states, stream_count = [], 0
+    rows = db.session.execute(
+        select(*columns).where(HourlyStat.started_at.is_not(None))
+        .order_by(HourlyStat.stream_id, HourlyStat.started_at, HourlyStat.id).execution_options(yield_per=REBUILD_BATCH)
+    )
+    archived = archive.rows(Scope(), by_stream=True, with_streams=False)
+    for state in _stream_states(merged(rows, archived, by_stream=True)):
+        states.append(state)
+        stream_count += 1
+        if len(states) >= REBUILD_BATCH:
+            db.session.execute(insert(StreamRollup.__table__), states)
+            states = []
+    if states:
+        db.session.execute(insert(StreamRollup.__table__), states)
+    # Periods in insertion order, which breaks ties on started_at; there are only a few thousand of them.
+    # Archived hours are older and come first.
+    periods = {}
+    for hour, started_at, viewers, followers in ((row.hour, row.started_at, row.viewers, row.followers)
+                                                 for row in archive.rows(Scope(), with_streams=False)):
+        for key in period_keys(started_at):
+            _fold(periods, key, hour, started_at, viewers, followers)
+    rows = db.session.execute(
+        select(*columns).where(HourlyStat.started_at.is_not(None)).order_by(HourlyStat.id).execution_options(yield_per=REBUILD_BATCH)
+    )
+    for _, hour, started_at, viewers, followers, _ in rows:
+        for key in period_keys(started_at):
+            _fold(periods, key, hour, started_at, viewers, followers)
+    period_rows = [dict(state, kind=kind, start=start) for (kind, start), state in periods.items()]
+    if period_rows:
+        db.session.execute(insert(PeriodRollup.__table__), period_rows)
+    return stream_count, len(period_rows)
+
+
+def _state(rollup):
+    return {name: getattr(rollup, name) for name in STATE_COLUMNS}
+
+
+def summary(state):
+    """aggregation.Summary of a rollup state or row."""
+    if not isinstance(state, dict):
+        state = _state(state)
+    count = state['count']
+    return Summary(
+        count=count, total=state['total'], average=state['total'] / count,
+        minimum=state['minimum'], maximum=state['maximum'],
+        std=math.sqrt(max(state['m2'], 0.0) / count),
+        peak_hour=state['peak_hour'], low_hour=state['low_hour'],
+        first=state['first_viewers'], last=state['last_viewers'],
+    )
+
+
+def stream_rollup(stream_id):
+    return db.session.get(StreamRollup, stream_id)
+
+
+def stream_summary(stream_id):
+    """Summary of a stream's hours in time order, or None when it has none."""
+    rollup = stream_rollup(stream_id)
+    return summary(rollup) if rollup else None
+
+
+def stream_summaries(stream_ids):
+    """{stream_id: Summary} of the given streams that have hours."""
+    rollups = db.session.scalars(select(StreamRollup).where(StreamRollup.stream_id.in_(stream_ids)))
+    return {rollup.stream_id: summary(rollup) for rollup in rollups}
+
+
+def month_span(start, end=None):
+    """(first, last) bounds of the whole calendar months in [start, end); last is None when open.
+
+    Dates in [start, first) and [last, end) are covered by day rollups instead,
+    so any range reads at most two partial months of day rows.
+    """
+    first = start if start.day == 1 else (start.replace(day=1) + timedelta(days=31)).replace(day=1)
+    if end is None:
+        return first, None
+    return first, max(first, end.replace(day=1))
+
+
+def summary_since(start, end=None):
+    """Summary of the hours that started on or after the date start and before end, or None when there are none.
+
+    Reads day rollups for the partial months at either end and month rollups in
+    between, so a year is at most 31 + 11 rows.
+    """
+    first, last = month_span(start, end)
+    day, month = PeriodRollup.kind == 'day', PeriodRollup.kind == 'month'
+    if last is None:
+        criterion = or_(
+            and_(day, PeriodRollup.start >= start, PeriodRollup.start < first),
+            and_(month, PeriodRollup.start >= first),
+        )
+    else:
+        criterion = or_(
+            and_(day, PeriodRollup.start >= start, PeriodRollup.start < min(first, end)),
+            and_(month, PeriodRollup.start >= first, PeriodRollup.start < last),
+            and_(day, PeriodRollup.start >= last, PeriodRollup.start < end),
+        )
+    rollups = db.session.scalars(select(PeriodRollup).where(criterion).order_by(PeriodRollup.start)).all()
+    if not rollups:
+        return None
+    return summary(reduce(merge, (_state(rollup) for rollup in rollups)))
@@ -0,0 +1,190 @@
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+import re
+
+from sqlalchemy import func, select
+
+from extensions import db
+from models import HourlyStat
+from services.archive import archive
+
+# Hour start times, and calendar buckets over them.
+#
+# HourlyStat.hour is a free-form label ("14:00", "2 PM"). started_at is when the
+# hour began: the stream's date plus the label's clock time, on the next day for
+# hours of a stream that ran past midnight. Periods, rollups and charts select and
+# order hours by it. buckets() groups the hours of a range by hour, day, week
+# (Monday start) or month in one indexed query, adds the archived hours of the
+# range, and fills in the buckets that have no hours, so tables and charts get
+# one entry per bucket.
+
+UNITS = ('hour', 'day', 'week', 'month')
+UNIT_LENGTHS = {'hour': timedelta(hours=1), 'day': timedelta(days=1), 'week': timedelta(days=7), 'month': timedelta(days=31)}
+LABEL_FORMATS = {'hour': '%d %b %H:00', 'day': '%a %d %b %Y', 'week': 'Week of %d %b %Y', 'month': '%B %Y'}
+# An hour more than this before a stream's first hour is taken to be past midnight
+OVERNIGHT = timedelta(hours=12)
+
+_CLOCK = re.compile(r'(\d{1,2})(?::(\d{2}))?(?::(\d{2}))?\s*([ap])?\.?m?\.?', re.IGNORECASE)
+
+Bucket = namedtuple('Bucket', ['start', 'hours', 'viewers', 'peak', 'followers'])
+
+
+@lru_cache(maxsize=1024)
+def parse_clock(label):
+    """Clock time of an hour label such as "14:00", "14", "13:00:00" or "2 PM", or None."""
+    match = _CLOCK.fullmatch(label.strip()) if label else None
+    if match is None:
+        return None
+    hours, minutes, seconds, meridiem = match.groups()
+    hours = int(hours)
+    if meridiem:
+        if not 1 <= hours <= 12:
+            return None
+        hours = hours % 12 + (12 if meridiem.lower() == 'p' else 0)
+    try:
+        return time(hours, int(minutes or 0), int(seconds or 0))
+    except ValueError:
+        return None
+
+
+def hour_start(stream_date, label, first=None):
+    """When the hour labelled label of a stream on stream_date began.
+
+    first is the start of the stream's first recorded hour; hours whose clock time
+    is more than OVERNIGHT before it fall on the next day. Labels without a clock
+    time start at midnight of the stream's date.
+    """
+    clock = parse_clock(label)
+    if clock is None:
+        return datetime.combine(stream_date, time())
+    start = datetime.combine(stream_date, clock)
+    if first is not None and datetime.combine(stream_date, first.time()) - start > OVERNIGHT:
+        start += timedelta(days=1)
+    return start
+
+
+class HourStarts:
+    """hour_start() for the rows of many streams, each anchored on its first recorded hour."""
+
+    def __init__(self):
+        self.first = {}  # stream id -> started_at of its first hour
+
+    def load(self, stream_ids):
+        # First hours already stored for streams not seen yet
+        missing = [stream_id for stream_id in set(stream_ids) if stream_id not in self.first]
+        if missing:
+            first_ids = select(func.min(HourlyStat.id)).where(HourlyStat.stream_id.in_(missing)).group_by(HourlyStat.stream_id)
+            self.first.update(db.session.execute(
+                select(HourlyStat.stream_id, HourlyStat.started_at).where(HourlyStat.id.in_(first_ids))
+            ).all())
+
+    def start(self, stream_id, stream_date, label):
+        first = self.first.get(stream_id)
+        start = hour_start(stream_date, label, first)
+        if first is None:
+            self.first[stream_id] = start
+        return start
+
+
+def floor(value, unit):
+    """Start of the unit bucket holding value (a datetime or date)."""
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, time())
+    if unit == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    day = datetime.combine(value.date(), time())
+    if unit == 'day':
+        return day
+    if unit == 'week':
+        return day - timedelta(days=day.weekday())
+    if unit == 'month':
+        return day.replace(day=1)
+    raise ValueError(f'Unknown unit {unit!r}, expected one of {", ".join(UNITS)}')
+
+
+def following(start, unit):
+    """Start of the bucket after the one starting at start."""
+    if unit == 'month':
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + UNIT_LENGTHS[unit]
+
+
+def _bucket_key(unit):
+    # SQL twin of floor(); started_at is stored as ISO text
+    column = HourlyStat.started_at
+    if unit == 'hour':
+        return func.strftime('%Y-%m-%d %H:00:00', column)
+    if unit == 'day':
+        return func.date(column)
+    if unit == 'week':
+        return func.date(column, '-6 days', 'weekday 1')
+    if unit == 'month':
+        return func.strftime('%Y-%m-01', column)
+    raise ValueError(f'Unknown unit {unit!r}, expected one of {", ".join(UNITS)}')
+
+
+def label(start, unit):
+    return start.strftime(LABEL_FORMATS[unit])
+
+
+def range_criteria(start=None, end=None):
+    """Criteria for hours that started in [start, end)."""
+    criteria = ()
+    if start is not None:
+        criteria += (HourlyStat.started_at >= start,)
+    if end is not None:
+        criteria += (HourlyStat.started_at < end,)
+    return criteria
+
+
+def buckets(unit, *criteria, start=None, end=None, fill=True, archived=None):
+    """Buckets of the hours matching criteria that started in [start, end), oldest first.
+
+    viewers is the average and peak the highest viewer count of a bucket's hours,
+    followers their sum. archived is an archive.Scope of archived hours to count
+    in as well. With fill, every bucket from start (or the first bucket with
+    hours) to end (or the later of the last bucket and now) is returned, the
+    empty ones with 0 hours and None viewers.
+    """
+    key = _bucket_key(unit).label('bucket')
+    rows = db.session.execute(
+        select(key, func.count(HourlyStat.id), func.sum(HourlyStat.viewers), func.max(HourlyStat.viewers), func.sum(HourlyStat.followers))
+        .where(*criteria, *range_criteria(start, end))
+        .group_by(key)
+        .order_by(key)
+    )
+    totals = {datetime.fromisoformat(bucket): tuple(values) for bucket, *values in rows if bucket is not None}
+    if archived is not None:
+        for bucket, (hours, viewers, peak, followers) in archive.bucket_totals(unit, archived.within(start, end)).items():
+            if bucket in totals:
+                live = totals[bucket]
+                hours, viewers, peak, followers = hours + live[0], viewers + live[1], max(peak, live[2]), followers + live[3]
+            totals[bucket] = (hours, viewers, peak, followers)
+    found = {
+        bucket: Bucket(bucket, hours, viewers / hours, peak, followers)
+        for bucket, (hours, viewers, peak, followers) in sorted(totals.items())
+    }
+    if not fill or not (found or start is not None):
+        return list(found.values())
+    current = floor(start, unit) if start is not None else min(found)
+    if end is not None:
+        last = datetime.combine(end, time()) if not isinstance(end, datetime) else end
+        last -= timedelta(microseconds=1)
+    else:
+        last = max([floor(datetime.now(), unit), *found])
+    filled = []
+    while current <= last:
+        filled.append(found.get(current) or Bucket(current, 0, None, None, 0))
+        current = following(current, unit)
+    return filled
+
+
+def unit_for(start, end=None, limit=31):
+    """Finest unit that splits [start, end) (dates; end None means today) into at most limit buckets."""
+    end = end or date.today() + timedelta(days=1)
+    span = datetime.combine(end, time()) - datetime.combine(start, time())
+    for unit in UNITS:
+        if span <= UNIT_LENGTHS[unit] * limit:
+            return unit
+    return 'month'
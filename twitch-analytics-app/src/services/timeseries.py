@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta, timezone
+import heapq
+
+from sqlalchemy import select
+
+from extensions import db
+from models import HourlyStat
+from services import timebuckets
+from services.archive import archive
+
+# Downsampled viewer and follower series for the chart endpoints and PNG charts.
+#
+# A period can hold tens of thousands of hours, far more points than a chart is
+# wide. Series are reduced to at most `resolution` points per line, either with
+# Largest-Triangle-Three-Buckets (keeps the visual shape) or with the minimum and
+# maximum of each bucket (keeps every peak and dip). Both work on plain lists
+# and return the indices to keep, in order. Long ranges can be loaded as calendar
+# buckets instead (load_buckets), with None for the buckets without hours. Both
+# loaders merge in the archived hours of an archive.Scope.
+
+METHODS = ('lttb', 'minmax')
+DEFAULT_RESOLUTION = 600
+MAX_RESOLUTION = 5000
+SERIES = ('viewers', 'followers')
+
+
+def lttb(xs, ys, threshold):
+    """Indices of at most threshold points chosen by Largest-Triangle-Three-Buckets (Steinarsson)."""
+    n = len(ys)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for bucket in range(threshold - 2):
+        low = int(bucket * every) + 1
+        high = int((bucket + 1) * every) + 1
+        # The third corner is the average of the next bucket (the last point for the last one)
+        next_low, next_high = high, min(int((bucket + 2) * every) + 1, n)
+        span = next_high - next_low
+        avg_x = sum(xs[next_low:next_high]) / span
+        avg_y = sum(ys[next_low:next_high]) / span
+        ax, ay = xs[a], ys[a]
+        dx, dy = ax - avg_x, avg_y - ay
+        best, best_area = low, -1.0
+        for index in range(low, high):
+            area = abs(dx * (ys[index] - ay) - (ax - xs[index]) * dy)
+            if area > best_area:
+                best, best_area = index, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def min_max(xs, ys, threshold):
+    """Indices of the first and last point and of the lowest and highest point of each bucket."""
+    n = len(ys)
+    if threshold >= n or threshold < 4:
+        return list(range(n))
+    buckets = (threshold - 2) // 2
+    every = (n - 2) / buckets
+    selected = [0]
+    for bucket in range(buckets):
+        indices = range(int(bucket * every) + 1, int((bucket + 1) * every) + 1)
+        if not indices:
+            continue
+        low = min(indices, key=ys.__getitem__)
+        high = max(indices, key=ys.__getitem__)
+        selected.extend(sorted({low, high}))
+    selected.append(n - 1)
+    return selected
+
+
+DOWNSAMPLERS = {'lttb': lttb, 'minmax': min_max}
+
+
+def downsample(xs, ys, threshold, method='lttb'):
+    # Gaps (None) count as 0 when choosing points and stay None in the result
+    indices = DOWNSAMPLERS[method](xs, [y or 0 for y in ys] if None in ys else ys, threshold)
+    return [xs[i] for i in indices], [ys[i] for i in indices]
+
+
+def _epoch_ms(started_at):
+    # started_at is naive stream-local time; the client shows it unconverted
+    return int(started_at.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _from_epoch_ms(value):
+    return datetime.fromtimestamp(value / 1000, timezone.utc).replace(tzinfo=None)
+
+
+def _range(start=None, end=None):
+    # [start, end] in epoch milliseconds as a half-open datetime range
+    return (
+        _from_epoch_ms(start) if start is not None else None,
+        _from_epoch_ms(end) + timedelta(microseconds=1) if end is not None else None,
+    )
+
+
+def load(*criteria, by_time=True, start=None, end=None, archived=None):
+    """Columns of the rows matching criteria with x in [start, end]: (x, labels, {series: values}).
+
+    by_time uses the epoch milliseconds of started_at as x, with labels None;
+    otherwise x is the position (as on the stream page) and labels are the hours
+    of every row. Rows are in started_at order either way. archived is an
+    archive.Scope of archived hours to merge in.
+    """
+    if by_time:
+        if start is not None:
+            criteria += (HourlyStat.started_at >= _from_epoch_ms(start),)
+        if end is not None:
+            criteria += (HourlyStat.started_at <= _from_epoch_ms(end),)
+    query = (
+        select(HourlyStat.started_at, HourlyStat.id, HourlyStat.hour, HourlyStat.viewers, HourlyStat.followers)
+        .where(*criteria)
+        .order_by(HourlyStat.started_at, HourlyStat.id)
+    )
+    rows = db.session.execute(query)
+    if archived is not None:
+        points = archive.points(archived.within(*_range(start, end)) if by_time else archived, labels=not by_time)
+        rows = heapq.merge(points, rows, key=lambda row: (row[0] or datetime.min, row[1]))
+    xs, labels, columns = [], [], {name: [] for name in SERIES}
+    viewers, followers = columns['viewers'], columns['followers']
+    for position, (started_at, _, label, viewer_count, follower_count) in enumerate(rows):
+        if by_time:
+            if started_at is None:
+                continue
+            xs.append(_epoch_ms(started_at))
+        else:
+            labels.append(label)
+            if (start is not None and position < start) or (end is not None and position > end):
+                continue
+            xs.append(position)
+        viewers.append(viewer_count or 0)
+        followers.append(follower_count or 0)
+    return xs, None if by_time else labels, columns
+
+
+def load_buckets(unit, *criteria, start=None, end=None, archived=None):
+    """Like load(by_time=True), one point per unit bucket from timebuckets.buckets().
+
+    x is the bucket start, viewers the bucket's average and followers its sum;
+    buckets without hours are None in both, so charts show the gap.
+    """
+    if start is not None:
+        criteria += (HourlyStat.started_at >= _from_epoch_ms(start),)
+    if end is not None:
+        criteria += (HourlyStat.started_at <= _from_epoch_ms(end),)
+    if archived is not None:
+        archived = archived.within(*_range(start, end))
+    xs, columns = [], {name: [] for name in SERIES}
+    for bucket in timebuckets.buckets(unit, *criteria, archived=archived):
+        xs.append(_epoch_ms(bucket.start))
+        columns['viewers'].append(round(bucket.viewers) if bucket.hours else None)
+        columns['followers'].append(bucket.followers if bucket.hours else None)
+    return xs, None, columns
+
+
+def auto_unit(span_ms, resolution):
+    """None (every hour) when a span of span_ms holds at most resolution hours, else the finest unit that fits."""
+    for unit in timebuckets.UNITS:
+        if span_ms <= timebuckets.UNIT_LENGTHS[unit].total_seconds() * 1000 * resolution:
+            return None if unit == 'hour' else unit
+    return 'month'
+
+
+def payload(xs, labels, columns, resolution=DEFAULT_RESOLUTION, method='lttb', unit=None):
+    """JSON-ready chart data, each series downsampled to resolution points separately."""
+    series = {}
+    for name, values in columns.items():
+        x, y = downsample(xs, values, resolution, method)
+        series[name] = {'x': x, 'y': y}
+    return {
+        'axis': 'time' if labels is None else 'hour',
+        'unit': unit,
+        'labels': labels,
+        'points': len(xs),
+        'resolution': resolution,
+        'method': method,
+        'range': [xs[0], xs[-1]] if xs else None,
+        'series': series,
+    }
@@ -0,0 +1,99 @@
+import os
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Serving modes for the desktop launcher and headless deployments:
+#   waitress - production WSGI server answering requests from a pool of worker threads
+#   dev      - Flask's development server, the previous behaviour
+# Settings come from arguments, then the APP_SERVER, APP_THREADS, APP_HOST and
+# APP_PORT environment variables, then the defaults below.
+
+SERVERS = ('waitress', 'dev')
+DEFAULT_SERVER = 'waitress'
+DEFAULT_THREADS = 8
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 5000
+SQLITE_BUSY_TIMEOUT = 30  # Seconds a writer waits for another writer's lock
+
+
+def threads_setting(threads=None):
+    threads = int(threads or os.environ.get('APP_THREADS') or DEFAULT_THREADS)
+    if threads < 1:
+        raise ValueError(f'Worker thread count must be at least 1, got {threads}')
+    return threads
+
+
+def settings(server=None, threads=None, host=None, port=None):
+    server = server or os.environ.get('APP_SERVER') or DEFAULT_SERVER
+    if server not in SERVERS:
+        raise ValueError(f'Unknown server {server!r}, expected one of {", ".join(SERVERS)}')
+    return {
+        'server': server,
+        'threads': threads_setting(threads),
+        'host': host or os.environ.get('APP_HOST') or DEFAULT_HOST,
+        'port': int(port or os.environ.get('APP_PORT') or DEFAULT_PORT),
+    }
+
+
+def engine_options(database_uri, threads, extra_connections=0):
+    """SQLAlchemy engine options sized for threads concurrent requests.
+
+    File-backed SQLite keeps one pooled connection per worker thread plus
+    extra_connections (background report jobs), and waits up to
+    SQLITE_BUSY_TIMEOUT for locks instead of failing with "database is locked".
+    """
+    url = make_url(database_uri)
+    if url.get_backend_name() != 'sqlite':
+        return {'pool_size': threads + extra_connections, 'pool_pre_ping': True}
+    if url.database in (None, '', ':memory:'):
+        return {}  # One shared in-memory connection, nothing to pool
+    return {
+        'pool_size': threads + extra_connections,
+        'max_overflow': threads,
+        'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT},
+    }
+
+
+def tune_sqlite(engine):
+    """Switch a file-backed SQLite engine to WAL so readers run alongside a writer."""
+    if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')  # Durable at checkpoints; safe with WAL
+        cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT * 1000}')
+        cursor.close()
+
+
+def prewarm():
+    """Load the chart and PDF stack and render a throwaway chart.
+
+    The routes import them on first use; running this in the background once the
+    window is up takes that cost off the first chart or report request.
+    """
+    from services import charts, report_generation  # noqa: F401
+    charts.render('trend', ['0:00', '1:00', '2:00'], [1, 3, 2])
+
+
+def prewarm_in_background():
+    thread = threading.Thread(target=prewarm, name='prewarm', daemon=True)
+    thread.start()
+    return thread
+
+
+def serve(app, server=None, threads=None, host=None, port=None):
+    """Serve app until interrupted; arguments left as None fall back to settings()."""
+    options = settings(server, threads, host, port)
+    if options['server'] == 'waitress':
+        from waitress import serve as waitress_serve
+        print(f"Serving on http://{options['host']}:{options['port']} with {options['threads']} waitress threads")
+        waitress_serve(app, host=options['host'], port=options['port'], threads=options['threads'])
+    else:
+        # What app.run() starts; called directly because app.run() is a no-op under the flask CLI
+        from werkzeug.serving import run_simple
+        run_simple(options['host'], options['port'], app, threaded=True)
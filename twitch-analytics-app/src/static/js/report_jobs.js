@@ -0,0 +1,34 @@
+// Links with class "pdf-job" build their PDF in a background job: start the job,
+// show its progress on the link, then download the finished file. Without
+// JavaScript the link's href still downloads the report synchronously.
+document.querySelectorAll('a.pdf-job').forEach(function (link) {
+    link.addEventListener('click', function (event) {
+        event.preventDefault();
+        if (link.classList.contains('disabled')) {
+            return;
+        }
+        const label = link.textContent;
+        link.classList.add('disabled');
+        const finish = function (text) {
+            link.textContent = text;
+            link.classList.remove('disabled');
+        };
+        const poll = function (job) {
+            if (job.status === 'done') {
+                finish(label);
+                window.location = job.download_url;
+            } else if (job.status === 'failed') {
+                finish('Report failed, try again');
+            } else {
+                link.textContent = `${job.message} (${job.progress}%)`;
+                setTimeout(function () {
+                    fetch(job.status_url).then(function (r) { return r.json(); }).then(poll);
+                }, 500);
+            }
+        };
+        fetch(link.dataset.jobUrl, { method: 'POST' })
+            .then(function (r) { return r.json(); })
+            .then(poll)
+            .catch(function () { finish(label); window.location = link.href; });
+    });
+});
@@ -0,0 +1,277 @@
+// Interactive viewer/follower chart for elements with a data-series-url. The
+// server downsamples each line to about one point per pixel of the canvas, so
+// payloads stay small for any period. Drag across the chart to zoom in (the
+// visible range is fetched again at full resolution), double-click to zoom out.
+// Calendar-bucket series (data.unit) have null for empty buckets, drawn as gaps.
+(function () {
+    const COLORS = { viewers: '#9147ff', followers: '#00b8a9' };
+    const PAD = { top: 16, right: 56, bottom: 36, left: 56 };
+
+    const niceTicks = function (max, count) {
+        if (max <= 0) {
+            return [0];
+        }
+        const raw = max / count;
+        const magnitude = Math.pow(10, Math.floor(Math.log10(raw)));
+        const step = [1, 2, 5, 10].map(function (m) { return m * magnitude; }).find(function (s) { return s >= raw; });
+        const ticks = [];
+        for (let value = 0; value <= max + step / 2; value += step) {
+            ticks.push(value);
+        }
+        return ticks;
+    };
+
+    const formatTime = function (ms, span) {
+        // x is stored time, shown as is; UTC getters keep the browser's zone out of it
+        const iso = new Date(ms).toISOString();
+        return span > 2 * 86400000 ? iso.slice(0, 10) : iso.slice(5, 16).replace('T', ' ');
+    };
+
+    const setup = function (container) {
+        const baseUrl = container.dataset.seriesUrl;
+        const canvas = document.createElement('canvas');
+        canvas.style.width = '100%';
+        canvas.style.height = `${container.dataset.height || 320}px`;
+        canvas.style.cursor = 'crosshair';
+        const status = document.createElement('div');
+        status.className = 'small mt-1';
+        status.style.opacity = '0.7';
+        const reset = document.createElement('button');
+        reset.type = 'button';
+        reset.className = 'btn btn-sm btn-outline-secondary ms-2';
+        reset.textContent = 'Reset zoom';
+        reset.hidden = true;
+        container.append(canvas, status);
+        status.after(reset);
+
+        let data = null;
+        let zoom = null;
+        let drag = null;
+        let hover = null;
+        let request = 0;
+
+        const plot = function () {
+            return {
+                left: PAD.left, top: PAD.top,
+                width: canvas.clientWidth - PAD.left - PAD.right,
+                height: canvas.clientHeight - PAD.top - PAD.bottom,
+            };
+        };
+
+        const scales = function (area) {
+            const [x0, x1] = data.range;
+            const span = Math.max(x1 - x0, 1);
+            const maxima = {};
+            Object.keys(data.series).forEach(function (name) {
+                maxima[name] = Math.max(1, ...data.series[name].y);
+            });
+            return {
+                x: function (value) { return area.left + (value - x0) / span * area.width; },
+                invert: function (px) { return x0 + (px - area.left) / area.width * span; },
+                y: function (name, value) { return area.top + area.height - value / maxima[name] * area.height; },
+                maxima: maxima,
+                span: span,
+            };
+        };
+
+        const label = function (x) {
+            if (data.axis === 'hour') {
+                return data.labels[Math.round(x)] || '';
+            }
+            return formatTime(x, data.range[1] - data.range[0]);
+        };
+
+        const draw = function () {
+            const ratio = window.devicePixelRatio || 1;
+            canvas.width = canvas.clientWidth * ratio;
+            canvas.height = canvas.clientHeight * ratio;
+            const ctx = canvas.getContext('2d');
+            ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+            const color = getComputedStyle(container).color;
+            ctx.font = '11px Inter, Arial, sans-serif';
+            ctx.fillStyle = color;
+            if (!data || !data.range) {
+                ctx.fillText('No data for this range.', PAD.left, PAD.top + 20);
+                return;
+            }
+            const area = plot();
+            const scale = scales(area);
+
+            // Axes: viewers on the left, followers on the right, time or hour below
+            ctx.strokeStyle = color;
+            ctx.globalAlpha = 0.15;
+            niceTicks(scale.maxima.viewers, 5).forEach(function (tick) {
+                const y = scale.y('viewers', tick);
+                ctx.beginPath();
+                ctx.moveTo(area.left, y);
+                ctx.lineTo(area.left + area.width, y);
+                ctx.stroke();
+            });
+            ctx.globalAlpha = 1;
+            ctx.textAlign = 'right';
+            niceTicks(scale.maxima.viewers, 5).forEach(function (tick) {
+                ctx.fillText(tick.toLocaleString(), area.left - 6, scale.y('viewers', tick) + 4);
+            });
+            ctx.textAlign = 'left';
+            niceTicks(scale.maxima.followers, 5).forEach(function (tick) {
+                ctx.fillText(tick.toLocaleString(), area.left + area.width + 6, scale.y('followers', tick) + 4);
+            });
+            ctx.textAlign = 'center';
+            const ticks = Math.max(2, Math.floor(area.width / 110));
+            for (let i = 0; i <= ticks; i++) {
+                const x = scale.invert(area.left + area.width * i / ticks);
+                ctx.fillText(label(x), area.left + area.width * i / ticks, area.top + area.height + 18);
+            }
+
+            Object.keys(data.series).forEach(function (name) {
+                const series = data.series[name];
+                ctx.strokeStyle = COLORS[name];
+                ctx.lineWidth = 1.5;
+                ctx.beginPath();
+                let pen = false;
+                series.x.forEach(function (x, i) {
+                    if (series.y[i] === null) {
+                        pen = false;
+                        return;
+                    }
+                    const px = scale.x(x);
+                    const py = scale.y(name, series.y[i]);
+                    if (pen) {
+                        ctx.lineTo(px, py);
+                    } else {
+                        ctx.moveTo(px, py);
+                        pen = true;
+                    }
+                });
+                ctx.stroke();
+                if (series.x.length === 1 || series.x.length * 8 < area.width) {
+                    ctx.fillStyle = COLORS[name];
+                    series.x.forEach(function (x, i) {
+                        if (series.y[i] === null) {
+                            return;
+                        }
+                        ctx.beginPath();
+                        ctx.arc(scale.x(x), scale.y(name, series.y[i]), 2.5, 0, 2 * Math.PI);
+                        ctx.fill();
+                    });
+                }
+            });
+
+            ctx.textAlign = 'left';
+            ctx.fillStyle = COLORS.viewers;
+            ctx.fillText('Viewers', area.left, area.top - 4);
+            ctx.fillStyle = COLORS.followers;
+            ctx.fillText('Followers', area.left + 60, area.top - 4);
+
+            if (drag) {
+                ctx.fillStyle = 'rgba(145, 71, 255, 0.2)';
+                ctx.fillRect(Math.min(drag.from, drag.to), area.top, Math.abs(drag.to - drag.from), area.height);
+            } else if (hover !== null && data.series.viewers.y.some(function (value) { return value !== null; })) {
+                // Nearest kept viewer point to the pointer
+                const series = data.series.viewers;
+                const x = scale.invert(hover);
+                let nearest = series.y.findIndex(function (value) { return value !== null; });
+                series.x.forEach(function (value, i) {
+                    if (series.y[i] !== null && Math.abs(value - x) < Math.abs(series.x[nearest] - x)) {
+                        nearest = i;
+                    }
+                });
+                const px = scale.x(series.x[nearest]);
+                ctx.strokeStyle = color;
+                ctx.globalAlpha = 0.4;
+                ctx.beginPath();
+                ctx.moveTo(px, area.top);
+                ctx.lineTo(px, area.top + area.height);
+                ctx.stroke();
+                ctx.globalAlpha = 1;
+                ctx.fillStyle = color;
+                ctx.textAlign = px > area.left + area.width / 2 ? 'right' : 'left';
+                ctx.fillText(`${label(series.x[nearest])}: ${series.y[nearest].toLocaleString()} viewers`,
+                    px + (ctx.textAlign === 'right' ? -6 : 6), area.top + 12);
+            }
+        };
+
+        const load = function () {
+            const params = new URLSearchParams({ resolution: Math.max(50, Math.round(plot().width)) });
+            if (zoom) {
+                params.set('from', Math.floor(zoom[0]));
+                params.set('to', Math.ceil(zoom[1]));
+            }
+            const separator = baseUrl.includes('?') ? '&' : '?';
+            const current = ++request;
+            fetch(`${baseUrl}${separator}${params}`)
+                .then(function (r) { return r.json(); })
+                .then(function (payload) {
+                    if (current !== request) {
+                        return;  // A newer zoom level was requested meanwhile
+                    }
+                    data = payload;
+                    const shown = data.series.viewers ? data.series.viewers.x.length : 0;
+                    status.textContent = `Showing ${shown.toLocaleString()} of ${data.points.toLocaleString()} points`
+                        + (data.unit ? `, one per ${data.unit}` : '')
+                        + (data.points > shown ? ` (${data.method} downsampled)` : '');
+                    reset.hidden = !zoom;
+                    draw();
+                })
+                .catch(function () { status.textContent = 'Chart data could not be loaded.'; });
+        };
+
+        const position = function (event) {
+            return event.clientX - canvas.getBoundingClientRect().left;
+        };
+        canvas.addEventListener('mousedown', function (event) {
+            if (data && data.range) {
+                drag = { from: position(event), to: position(event) };
+            }
+        });
+        canvas.addEventListener('mousemove', function (event) {
+            if (drag) {
+                drag.to = position(event);
+            } else {
+                hover = position(event);
+            }
+            if (data && data.range) {
+                draw();
+            }
+        });
+        canvas.addEventListener('mouseleave', function () {
+            hover = null;
+            drag = null;
+            if (data) {
+                draw();
+            }
+        });
+        window.addEventListener('mouseup', function () {
+            if (!drag) {
+                return;
+            }
+            const scale = scales(plot());
+            const from = scale.invert(Math.min(drag.from, drag.to));
+            const to = scale.invert(Math.max(drag.from, drag.to));
+            drag = null;
+            if (Math.abs(scale.x(to) - scale.x(from)) > 4) {
+                zoom = [from, to];
+                load();
+            } else {
+                draw();
+            }
+        });
+        const zoomOut = function () {
+            if (zoom) {
+                zoom = null;
+                load();
+            }
+        };
+        canvas.addEventListener('dblclick', zoomOut);
+        reset.addEventListener('click', zoomOut);
+
+        let resizeTimer = null;
+        window.addEventListener('resize', function () {
+            clearTimeout(resizeTimer);
+            resizeTimer = setTimeout(load, 200);
+        });
+        load();
+    };
+
+    document.querySelectorAll('[data-series-url]').forEach(setup);
+})();
@@ -0,0 +1,68 @@
+// Infinite scroll for the home page stream list: when the "Older streams" link
+// comes into view, fetch the next page as JSON and append its cards. Without
+// JavaScript the link still loads the next page as a full HTML page.
+(function () {
+    const more = document.getElementById('more-streams');
+    const list = document.getElementById('stream-list');
+    if (!more || !list) {
+        return;
+    }
+    let nextUrl = more.dataset.nextUrl;
+    let loading = false;
+
+    const badge = function (className, text) {
+        const span = document.createElement('span');
+        span.className = `badge ${className}`;
+        span.textContent = text;
+        return span;
+    };
+
+    const card = function (stream) {
+        const div = document.createElement('div');
+        div.className = 'stream-card p-3';
+        const heading = document.createElement('h5');
+        const link = document.createElement('a');
+        link.href = stream.url;
+        link.className = 'text-twitch';
+        link.style.color = '#9147ff';
+        link.textContent = `${stream.title || stream.date} (${stream.streamer})`;
+        heading.appendChild(link);
+        div.appendChild(heading);
+        div.appendChild(badge('bg-secondary', stream.date));
+        div.append(' ');
+        div.appendChild(badge('bg-dark', `Peak viewers: ${stream.peak_viewers === null ? '-' : stream.peak_viewers}`));
+        div.append(' ');
+        div.appendChild(badge('bg-dark', `Followers: ${stream.total_followers}`));
+        return div;
+    };
+
+    const loadMore = function () {
+        if (loading || !nextUrl) {
+            return;
+        }
+        loading = true;
+        fetch(nextUrl)
+            .then(function (r) { return r.json(); })
+            .then(function (page) {
+                page.streams.forEach(function (stream) { list.appendChild(card(stream)); });
+                nextUrl = page.next;
+                if (!nextUrl) {
+                    more.remove();
+                    observer.disconnect();
+                }
+                loading = false;
+            })
+            .catch(function () { loading = false; });
+    };
+
+    more.addEventListener('click', function (event) {
+        event.preventDefault();
+        loadMore();
+    });
+    const observer = new IntersectionObserver(function (entries) {
+        if (entries.some(function (entry) { return entry.isIntersecting; })) {
+            loadMore();
+        }
+    });
+    observer.observe(more);
+})();